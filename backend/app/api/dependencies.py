@@ -0,0 +1,84 @@
+from fastapi import Request, Header, Query, HTTPException, UploadFile, File
+from typing import Iterator, Optional
+from app.core.config import settings
+from app.services.image_processor import ImageProcessor
+from app.services.image_processor.encoding import OutputFormat, negotiate
+from app.services.image_processor.ingest import UploadSource, UploadRejected, ingest
+from app.services.image_processor.store import ImageStore
+from app.services.job_service import JobManager
+from app.services.metrics import stage
+
+def get_processor(request: Request) -> ImageProcessor:
+    """Return the worker-wide processor created in the lifespan hook"""
+    processor = getattr(request.app.state, "processor", None)
+    if processor is None:
+        # Lifespan didn't run (e.g. a bare TestClient), build it once lazily
+        processor = ImageProcessor()
+        request.app.state.processor = processor
+    return processor
+
+def get_image_store(request: Request) -> ImageStore:
+    """Return the worker-wide store of edit sessions"""
+    store = getattr(request.app.state, "image_store", None)
+    if store is None:
+        store = ImageStore()
+        request.app.state.image_store = store
+    return store
+
+async def get_job_manager(request: Request) -> JobManager:
+    """Return the worker-wide bulk job manager"""
+    manager = getattr(request.app.state, "job_manager", None)
+    if manager is None:
+        manager = JobManager(get_processor(request))
+        await manager.start()
+        request.app.state.job_manager = manager
+    return manager
+
+def get_upload(image: UploadFile = File(...)) -> Iterator[UploadSource]:
+    """The uploaded image, checked from its header before any pixels are read"""
+    try:
+        with stage("upload"):
+            source = ingest(image.file)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    try:
+        yield source
+    finally:
+        # Unmaps a spooled upload; decoded images don't reference it
+        source.close()
+
+class OutputOptions:
+    def __init__(self, output: OutputFormat, binary: bool):
+        self.output = output
+        self.binary = binary
+
+def get_output_options(
+    accept: Optional[str] = Header(None),
+    format: Optional[str] = Query(None, description="png, jpeg or webp"),
+    quality: Optional[int] = Query(None, ge=1, le=100),
+    compress_level: Optional[int] = Query(None, ge=0, le=9),
+    effort: Optional[int] = Query(None, ge=0, le=6),
+    response: Optional[str] = Query(None, pattern="^(json|binary)$")
+) -> OutputOptions:
+    """Resolve the output encoding from query params and the Accept header"""
+    format_name, binary = negotiate(accept, format)
+    if response:
+        binary = response == "binary"
+    try:
+        output = OutputFormat(format_name, quality=quality, compress_level=compress_level, effort=effort)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return OutputOptions(output, binary)
+
+def get_preview_edge(
+    preview: bool = Query(False, description="Process a viewport-sized proxy with a fast encoding"),
+    viewport: Optional[int] = Query(None, ge=16, description="Longest edge of the client canvas in pixels")
+) -> Optional[int]:
+    """Longest edge of the preview proxy, None for a full-resolution render"""
+    if not preview:
+        return None
+    edge = viewport or settings.PREVIEW_DEFAULT_EDGE
+    # Round up so nearby viewport sizes share one cached proxy
+    step = settings.PREVIEW_EDGE_STEP
+    edge = -(-edge // step) * step
+    return min(edge, settings.PREVIEW_MAX_EDGE)
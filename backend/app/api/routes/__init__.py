@@ -1,3 +1,3 @@
-from . import image_routes
+from . import image_routes, health, sessions, jobs, metrics
 
-__all__ = ['image_routes']
+__all__ = ['image_routes', 'health', 'sessions', 'jobs', 'metrics']
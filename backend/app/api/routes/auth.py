@@ -3,12 +3,10 @@ from pydantic import BaseModel
 from typing import Optional
 from app.core.config import settings
 import time
-from app.services.logging_service import LoggingService
+from app.services.logging_service import logging_service
 
 router = APIRouter()
 
-logging_service = LoggingService()
-
 class LoginRequest(BaseModel):
     email: str
     password: str
@@ -53,7 +51,7 @@ async def login(request: Request, login_data: LoginRequest):
     ]
     
     user = next(
-        (u for u in USERS if u["email"] == login_data.email and u["password"] == login_data.password),
+        (u for u in USERS if u["email"] and u["email"] == login_data.email and u["password"] == login_data.password),
         None
     )
     
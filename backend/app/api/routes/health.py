@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+router = APIRouter()
+
+@router.get("/health")
+async def health(request: Request):
+    processor = getattr(request.app.state, "processor", None)
+    if processor is None:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+
+    status = processor.status()
+    store = getattr(request.app.state, "image_store", None)
+    if store is not None:
+        status["image_store"] = store.stats()
+    # Warming up and degraded still serve every filter; background removal
+    # waits for the model or, once degraded, retries loading it per request
+    status_code = 503 if status["status"] == "starting" else 200
+    return JSONResponse(status_code=status_code, content=status)
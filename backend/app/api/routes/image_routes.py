@@ -1,26 +1,85 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Header
-from app.services.image_processor import ImageProcessor
-from app.schemas.image import ImageResponse, ProcessingParams
+from fastapi import APIRouter, Form, HTTPException, Header, Depends, Response, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from app.api.dependencies import get_processor, get_output_options, get_preview_edge, get_upload, OutputOptions
+from app.core.config import settings
+from app.services.image_processor import ImageProcessor, ServerBusyError, OutputFormat
+from app.services.image_processor.cache import content_key
+from app.services.image_processor.coalesce import result_etag, etag_matches
+from app.services.image_processor.renditions import ZipStream, MultipartStream
+from app.services.image_processor.ingest import UploadSource
+from app.schemas.image import ImageResponse, ProcessingParams, PipelineRequest, RenditionsRequest
+from app.services.metrics import stage
 from typing import Optional
-import io
 import logging
 import json
+import uuid
 
 router = APIRouter()
 
+def image_response(encoded, options: OutputOptions, metadata: dict = None, headers: dict = None):
+    """Raw bytes when the client negotiated an image type, legacy base64 JSON otherwise"""
+    if options.binary:
+        headers = {**(headers or {}), "Vary": "Accept"}
+        return Response(content=encoded.data, media_type=encoded.media_type, headers=headers)
+    with stage("base64"):
+        data = encoded.to_base64()
+    # The resize byte budget may switch PNG to JPEG/WebP, so say which it is
+    body = {
+        "image": data,
+        "metadata": {**(metadata or {}), "media_type": encoded.media_type}
+    }
+    if headers:
+        return JSONResponse(body, headers=headers)
+    return body
+
+def request_etag(image: UploadSource, request: dict, options: OutputOptions, preview_edge: Optional[int],
+                 weak: bool = False) -> str:
+    """ETag of the response to an upload + request, before anything is decoded"""
+    return result_etag(content_key(image.getbuffer()), {
+        **request,
+        "output": vars(options.output),
+        # Binary and base64 JSON are different representations of the same result
+        "binary": options.binary,
+        "preview_edge": preview_edge
+    }, weak)
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
+
+async def compute_once(processor: ImageProcessor, etag: str, image: UploadSource, compute):
+    """Run compute, or wait for an identical request's run already in flight"""
+    if not settings.COALESCE_REQUESTS:
+        return await compute()
+
+    def hold(task):
+        # Others may wait on this run after this request is gone; its upload stays open until it ends
+        image.retain()
+        task.add_done_callback(lambda _: image.release())
+
+    return await processor.inflight.run(etag, compute, on_start=hold)
+
+def etag_headers(etag: str) -> Optional[dict]:
+    return {"ETag": etag} if settings.RESULT_ETAGS_ENABLED else None
+
 @router.post("/process-image", response_model=ImageResponse)
 async def process_image(
-    image: UploadFile = File(...),
+    image: UploadSource = Depends(get_upload),
     operation: str = Header(None),
-    params: str = Header(None)
+    params: str = Header(None),
+    operation_field: Optional[str] = Form(None, alias="operation"),
+    params_field: Optional[str] = Form(None, alias="params"),
+    options: OutputOptions = Depends(get_output_options),
+    preview_edge: Optional[int] = Depends(get_preview_edge),
+    if_none_match: Optional[str] = Header(None),
+    processor: ImageProcessor = Depends(get_processor)
 ):
+    # The editor sends operation/params as headers, scripts usually as form fields
+    operation = operation or operation_field
+    params = params or params_field
     try:
         logging.info(f"Received request - Operation: {operation}, Params: {params}")
         
-        processor = ImageProcessor()
-        content = await image.read()
-        img_bytes = io.BytesIO(content)
-        
         # Parse params into a dictionary
         params_dict = {}
         if params:
@@ -32,25 +91,174 @@ async def process_image(
             except json.JSONDecodeError as e:
                 raise HTTPException(status_code=400, detail=f"Invalid params JSON: {str(e)}")
         
-        result = await processor.process(
-            img_bytes,
+        etag = request_etag(image, {
+            "route": "process-image", "operation": operation, "params": params_dict
+        }, options, preview_edge)
+        if settings.RESULT_ETAGS_ENABLED and etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+        result = await compute_once(processor, etag, image, lambda: processor.process(
+            image,
             operation=operation,
-            params=params_dict
-        )
+            params=params_dict,
+            output=options.output,
+            preview_edge=preview_edge
+        ))
         
-        return {"image": result}
+        return image_response(result, options, headers=etag_headers(etag))
+    except (HTTPException, ServerBusyError):
+        raise
     except Exception as e:
         logging.error(f"Error processing image: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/pipeline", response_model=ImageResponse)
+async def run_pipeline(
+    image: UploadSource = Depends(get_upload),
+    steps: str = Form(...),
+    options: OutputOptions = Depends(get_output_options),
+    preview_edge: Optional[int] = Depends(get_preview_edge),
+    if_none_match: Optional[str] = Header(None),
+    processor: ImageProcessor = Depends(get_processor)
+):
+    """Apply an ordered list of {operation, params} steps with a single decode and encode"""
+    try:
+        pipeline = PipelineRequest(steps=json.loads(steps))
+    except (json.JSONDecodeError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid steps: {str(e)}")
+
+    if len(pipeline.steps) > settings.MAX_PIPELINE_STEPS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Pipeline has {len(pipeline.steps)} steps, the limit is {settings.MAX_PIPELINE_STEPS}"
+        )
+
+    step_dicts = [step.model_dump() for step in pipeline.steps]
+    try:
+        processor.validate_steps(step_dicts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        # The JSON form carries timings, which differ between runs of the same result
+        etag = request_etag(image, {"route": "pipeline", "steps": step_dicts}, options, preview_edge,
+                            weak=not options.binary)
+        if settings.RESULT_ETAGS_ENABLED and etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+        result, timings = await compute_once(processor, etag, image, lambda: processor.run_pipeline(
+            image, step_dicts, options.output, preview_edge
+        ))
+        return image_response(result, options, {"timings": timings}, etag_headers(etag))
+    except ServerBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"Error running pipeline: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/renditions")
+async def create_renditions(
+    image: UploadSource = Depends(get_upload),
+    renditions: str = Form(...),
+    steps: Optional[str] = Form(None),
+    container: str = Query("zip", pattern="^(zip|multipart)$"),
+    if_none_match: Optional[str] = Header(None),
+    processor: ImageProcessor = Depends(get_processor)
+):
+    """Several sizes/formats of one upload, decoded once and streamed as a ZIP or multipart/mixed body"""
+    try:
+        request = RenditionsRequest(renditions=json.loads(renditions), steps=json.loads(steps) if steps else [])
+    except (json.JSONDecodeError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid renditions: {str(e)}")
+
+    if not 0 < len(request.renditions) <= settings.MAX_RENDITIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Request has {len(request.renditions)} renditions, between 1 and {settings.MAX_RENDITIONS} are allowed"
+        )
+    if len({rendition.name for rendition in request.renditions}) != len(request.renditions):
+        raise HTTPException(status_code=400, detail="Rendition names must be unique")
+
+    step_dicts = [step.model_dump() for step in request.steps]
+    specs = []
+    try:
+        if step_dicts:
+            processor.validate_steps(step_dicts)
+        for rendition in request.renditions:
+            spec = rendition.model_dump(exclude_none=True)
+            try:
+                processor.filters['resize'].validate(spec)
+                spec['output'] = OutputFormat(spec.pop('format'), quality=spec.pop('quality', None))
+                # A byte budget may fall back to a lossy format only when none was asked for
+                spec['lossy_fallback'] = 'format' not in rendition.model_fields_set
+            except ValueError as e:
+                raise ValueError(f"Rendition {rendition.name}: {e}")
+            specs.append(spec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    etag = result_etag(content_key(image.getbuffer()), {
+        "route": "renditions", "container": container, "steps": step_dicts,
+        # Unset fields stay out: an explicit format disables the lossy fallback
+        "renditions": [rendition.model_dump(exclude_unset=True) for rendition in request.renditions]
+    })
+    if settings.RESULT_ETAGS_ENABLED and etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    stream = ZipStream() if container == "zip" else MultipartStream(uuid.uuid4().hex)
+    parts = processor.render_renditions(image, specs, step_dicts)
+    try:
+        # Wait for the first output so decode and step errors still get a 400
+        first = await anext(parts)
+    except ServerBusyError:
+        raise
+    except Exception as e:
+        await parts.aclose()
+        logging.error(f"Error creating renditions: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def body():
+        try:
+            rendition, encoded = first
+            yield stream.add(rendition['name'], encoded)
+            async for rendition, encoded in parts:
+                yield stream.add(rendition['name'], encoded)
+            yield stream.close()
+        finally:
+            await parts.aclose()
+
+    return StreamingResponse(body(), media_type=stream.media_type, headers=etag_headers(etag))
+
 @router.post("/crop")
 async def crop_image(
-    image: UploadFile = File(...),
+    image: UploadSource = Depends(get_upload),
     x: int = 0,
     y: int = 0,
     width: int = 100,
-    height: int = 100
+    height: int = 100,
+    options: OutputOptions = Depends(get_output_options),
+    if_none_match: Optional[str] = Header(None),
+    processor: ImageProcessor = Depends(get_processor)
 ):
-    processor = ImageProcessor()
-    content = await image.read()
-    return await processor.crop(io.BytesIO(content), x, y, width, height) 
\ No newline at end of file
+    etag = request_etag(image, {
+        "route": "crop", "params": {"x": x, "y": y, "width": width, "height": height}
+    }, options, None)
+    if settings.RESULT_ETAGS_ENABLED and etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    try:
+        result = await compute_once(processor, etag, image, lambda: processor.crop(
+            image, x, y, width, height, options.output
+        ))
+    except ServerBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"Error cropping image: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    if options.binary:
+        return image_response(result, options, headers=etag_headers(etag))
+    with stage("base64"):
+        data = result.to_base64()
+    # Legacy shape: the base64 string itself
+    return JSONResponse(data, headers=etag_headers(etag))
+ 
\ No newline at end of file
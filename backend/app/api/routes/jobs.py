@@ -0,0 +1,109 @@
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from app.api.dependencies import get_processor, get_job_manager, get_output_options, OutputOptions
+from app.core.config import settings
+from app.services.image_processor import ImageProcessor
+from app.services.job_service import JobManager
+from app.schemas.image import PipelineRequest
+from pathlib import Path
+from typing import Optional
+import asyncio
+import json
+import os
+import tempfile
+
+router = APIRouter()
+
+def save_upload(upload, directory: Path) -> str:
+    """Copy an uploaded archive to disk in chunks, enforcing JOB_MAX_ARCHIVE_BYTES"""
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, suffix=".zip")
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := upload.read(1024 * 1024):
+                written += len(chunk)
+                if written > settings.JOB_MAX_ARCHIVE_BYTES:
+                    raise ValueError(f"Archive is larger than {settings.JOB_MAX_ARCHIVE_BYTES} bytes")
+                f.write(chunk)
+    except Exception:
+        Path(path).unlink(missing_ok=True)
+        raise
+    return path
+
+@router.post("/jobs", status_code=202)
+async def create_job(
+    steps: str = Form(...),
+    archive: Optional[UploadFile] = File(None),
+    paths: Optional[str] = Form(None, description="JSON list of server-local image paths"),
+    concurrency: Optional[int] = Form(None, ge=1),
+    options: OutputOptions = Depends(get_output_options),
+    processor: ImageProcessor = Depends(get_processor),
+    jobs: JobManager = Depends(get_job_manager)
+):
+    """Queue a pipeline over a ZIP of images (or server-local paths); poll /jobs/{job_id}"""
+    try:
+        pipeline = PipelineRequest(steps=json.loads(steps))
+    except (json.JSONDecodeError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid steps: {str(e)}")
+    if len(pipeline.steps) > settings.MAX_PIPELINE_STEPS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Pipeline has {len(pipeline.steps)} steps, the limit is {settings.MAX_PIPELINE_STEPS}"
+        )
+    step_dicts = [step.model_dump() for step in pipeline.steps]
+    try:
+        processor.validate_steps(step_dicts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if (archive is None) == (paths is None):
+        raise HTTPException(status_code=400, detail="Send either an archive or a list of paths")
+
+    try:
+        if archive is not None:
+            saved = await asyncio.to_thread(save_upload, archive.file, jobs.jobs_dir / "uploads")
+            job = await jobs.create(step_dicts, options.output, archive=saved, concurrency=concurrency)
+        else:
+            path_list = json.loads(paths)
+            if not isinstance(path_list, list):
+                raise ValueError("paths must be a JSON list")
+            job = await jobs.create(step_dicts, options.output, paths=path_list, concurrency=concurrency)
+    except (ValueError, json.JSONDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return job.status()
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str, jobs: JobManager = Depends(get_job_manager)):
+    """Progress of a job: done/failed/remaining counts, images per second and ETA"""
+    try:
+        return jobs.get(job_id).status()
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+@router.get("/jobs/{job_id}/results")
+async def job_results(job_id: str, jobs: JobManager = Depends(get_job_manager)):
+    """Stream the finished outputs as a ZIP; callable while the job is still running"""
+    try:
+        job = jobs.get(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        jobs.iter_results(job),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="job-{job_id}.zip"',
+            "X-Job-Status": job.status()["status"]
+        }
+    )
+
+@router.delete("/jobs/{job_id}", status_code=204)
+async def delete_job(job_id: str, jobs: JobManager = Depends(get_job_manager)):
+    """Cancel a job and delete its inputs and outputs"""
+    try:
+        await jobs.delete(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Response(status_code=204)
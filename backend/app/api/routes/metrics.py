@@ -0,0 +1,69 @@
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import PlainTextResponse
+from app.core.config import settings
+from app.services import metrics
+from app.services.logging_service import logging_service
+
+router = APIRouter()
+
+def runtime_gauges(request: Request) -> list:
+    """Queue depths, in-flight work and cache hit rates, read at scrape time"""
+    lines = []
+    state = request.app.state
+    processor = getattr(state, "processor", None)
+    if processor is not None:
+        executor = processor.executor.status()
+        lines += metrics.render_gauge("image_admitted_requests", "Requests holding an admission slot",
+                                      {None: executor["admitted"]})
+        lines += metrics.render_gauge("image_queue_depth", "Filter runs waiting for an operation slot",
+                                      executor["waiting"], "operation")
+        lines += metrics.render_gauge("image_in_flight", "Filter runs executing", executor["in_flight"], "operation")
+
+        background = processor.filters['remove_background'].cache.stats()
+        intermediate = processor.memo.stats()
+        lines += metrics.render_gauge("image_cache_hit_rate", "Hit rate since start", {
+            "background_removal": background["hit_rate"],
+            "intermediate": intermediate["hit_rate"]
+        }, "cache")
+        lines += metrics.render_gauge("image_cache_bytes", "Bytes held in memory", {
+            "background_removal": background["memory_bytes"],
+            "intermediate": intermediate["bytes"]
+        }, "cache")
+        sessions = processor.filters['remove_background'].sessions.stats()
+        lines += metrics.render_gauge("image_segmentation_sessions", "Segmentation models loaded",
+                                      {None: len(sessions["loaded"])})
+        lines += metrics.render_gauge("image_segmentation_bytes", "Estimated memory of loaded segmentation models",
+                                      {None: sessions["bytes"]})
+        coalescing = processor.inflight.stats()
+        lines += metrics.render_gauge("image_coalesced_computations", "Computations identical requests can join",
+                                      {None: coalescing["in_flight"]})
+        lines += metrics.render_gauge("image_coalesced_requests", "Requests served by another request's computation",
+                                      {None: coalescing["coalesced"]})
+        lines += metrics.render_gauge("image_ready", "1 once models are warmed up", {None: int(processor.ready)})
+
+    store = getattr(state, "image_store", None)
+    if store is not None:
+        stats = store.stats()
+        lines += metrics.render_gauge("image_sessions", "Open edit sessions", {None: stats["sessions"]})
+        lines += metrics.render_gauge("image_session_bytes", "Bytes held by edit sessions", {None: stats["bytes"]})
+
+    jobs = getattr(state, "job_manager", None)
+    if jobs is not None:
+        lines += metrics.render_gauge("image_jobs_running", "Bulk jobs with work in progress", {None: len(jobs.tasks)})
+
+    queue = logging_service.queue
+    lines += metrics.render_gauge("request_log_queue_depth", "Log rows waiting for the sink",
+                                  {None: queue.qsize() if queue else 0})
+    lines += metrics.render_counter("request_log_dropped_total", "Log rows dropped on a full queue or unreadable when replayed",
+                                    {None: logging_service.dropped})
+    return lines
+
+@router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """Prometheus text exposition of latency histograms and runtime gauges"""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(
+        metrics.render(runtime_gauges(request)),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
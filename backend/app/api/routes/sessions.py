@@ -0,0 +1,176 @@
+from fastapi import APIRouter, HTTPException, Depends, Response, Body
+from app.api.dependencies import (get_processor, get_image_store, get_output_options, get_preview_edge,
+                                  get_upload, OutputOptions)
+from app.api.routes.image_routes import image_response
+from app.core.config import settings
+from app.services.image_processor import ImageProcessor, ServerBusyError
+from app.services.image_processor.store import ImageStore
+from app.services.image_processor.ingest import UploadSource
+from app.schemas.image import EditRequest, ExportRequest, ImageSessionResponse
+from typing import Optional
+import logging
+
+router = APIRouter()
+
+def session_headers(image_id: str, version: int) -> dict:
+    return {"X-Image-Id": image_id, "X-Image-Version": str(version)}
+
+def checked_steps(edit, processor: ImageProcessor) -> list:
+    if len(edit.steps) > settings.MAX_PIPELINE_STEPS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Pipeline has {len(edit.steps)} steps, the limit is {settings.MAX_PIPELINE_STEPS}"
+        )
+    steps = [step.model_dump() for step in edit.steps]
+    try:
+        processor.validate_steps(steps)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return steps
+
+def get_base(store: ImageStore, image_id: str, version: Optional[int]):
+    try:
+        return store.get(image_id, version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Image or version not found, upload it again")
+
+async def render_version(image_id: str, base, steps: list, options: OutputOptions,
+                         processor: ImageProcessor, store: ImageStore):
+    """Apply steps at full resolution and store the result as a new version"""
+    try:
+        result, key, encoded, timings = await processor.edit(base.image, base.key, steps, options.output)
+    except ServerBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"Error editing image {image_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        version = store.add_version(image_id, result, key, parent=base.version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Image expired while processing, upload it again")
+
+    metadata = {"image_id": image_id, "version": version.version, "timings": timings}
+    return image_response(encoded, options, metadata, session_headers(image_id, version.version))
+
+async def render_preview(image_id: str, base, steps: list, edge: int, options: OutputOptions,
+                         processor: ImageProcessor, store: ImageStore):
+    """Apply steps to the version's cached proxy; nothing is stored except the proxy"""
+    try:
+        cached = store.get_proxy(image_id, base.version, edge)
+        if cached is None:
+            proxy, key = await processor.make_proxy(base.image, base.key, edge)
+            store.put_proxy(image_id, base.version, edge, proxy, key)
+        else:
+            proxy, key = cached
+        result, _, encoded, timings = await processor.edit(
+            proxy, key, steps, options.output, preview_scale=proxy.width / base.image.width
+        )
+        store.session(image_id).pending = {"base_version": base.version, "steps": steps}
+    except ServerBusyError:
+        raise
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Image expired while processing, upload it again")
+    except Exception as e:
+        logging.error(f"Error previewing image {image_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    metadata = {
+        "image_id": image_id,
+        "base_version": base.version,
+        "preview": {"width": result.width, "height": result.height},
+        "timings": timings
+    }
+    headers = {**session_headers(image_id, base.version), "X-Preview": "1"}
+    return image_response(encoded, options, metadata, headers)
+
+@router.post("/images", response_model=ImageSessionResponse)
+async def upload_image(
+    image: UploadSource = Depends(get_upload),
+    processor: ImageProcessor = Depends(get_processor),
+    store: ImageStore = Depends(get_image_store)
+):
+    """Upload once; later edits reference the returned image_id"""
+    try:
+        async with processor.executor.admit():
+            decoded, key = await processor.decode(image)
+    except ServerBusyError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
+
+    session = store.create(decoded, key)
+    return {
+        "image_id": session.image_id,
+        "version": 0,
+        "width": decoded.width,
+        "height": decoded.height
+    }
+
+@router.post("/images/{image_id}/process")
+async def edit_image(
+    image_id: str,
+    edit: EditRequest,
+    options: OutputOptions = Depends(get_output_options),
+    preview_edge: Optional[int] = Depends(get_preview_edge),
+    processor: ImageProcessor = Depends(get_processor),
+    store: ImageStore = Depends(get_image_store)
+):
+    """Apply steps to a stored version (latest by default).
+
+    Full renders are stored as a new version. With ?preview=true the steps run
+    on a viewport-sized proxy and are remembered for a later export.
+    """
+    steps = checked_steps(edit, processor)
+    base = get_base(store, image_id, edit.base_version)
+    if preview_edge:
+        return await render_preview(image_id, base, steps, preview_edge, options, processor, store)
+    return await render_version(image_id, base, steps, options, processor, store)
+
+@router.post("/images/{image_id}/export")
+async def export_image(
+    image_id: str,
+    export: Optional[ExportRequest] = Body(None),
+    options: OutputOptions = Depends(get_output_options),
+    processor: ImageProcessor = Depends(get_processor),
+    store: ImageStore = Depends(get_image_store)
+):
+    """Replay an operation list at full resolution, by default the last previewed one"""
+    if export is None or export.steps is None:
+        try:
+            pending = store.session(image_id).pending
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Image not found, upload it again")
+        if pending is None:
+            raise HTTPException(status_code=400, detail="Nothing to export, preview some steps first")
+        base = get_base(store, image_id, pending["base_version"])
+        steps = pending["steps"]
+    else:
+        steps = checked_steps(export, processor)
+        base = get_base(store, image_id, export.base_version)
+    return await render_version(image_id, base, steps, options, processor, store)
+
+@router.get("/images/{image_id}/versions/{version}")
+async def get_version(
+    image_id: str,
+    version: int,
+    options: OutputOptions = Depends(get_output_options),
+    processor: ImageProcessor = Depends(get_processor),
+    store: ImageStore = Depends(get_image_store)
+):
+    try:
+        stored = store.get(image_id, version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Image or version not found")
+    async with processor.executor.admit():
+        encoded = await processor.encode(stored.image, options.output)
+    metadata = {"image_id": image_id, "version": version}
+    return image_response(encoded, options, metadata, session_headers(image_id, version))
+
+@router.delete("/images/{image_id}", status_code=204)
+async def delete_image(image_id: str, store: ImageStore = Depends(get_image_store)):
+    try:
+        store.delete(image_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return Response(status_code=204)
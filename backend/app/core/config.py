@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Dict, Optional
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "Image Processing API"
@@ -8,23 +8,153 @@ class Settings(BaseSettings):
     API_V1_STR: str = "/api/v1"
     ALLOWED_ORIGINS: List[str] = ["http://localhost:5173"]  # React dev server
     
-    # Google Cloud settings
-    GOOGLE_APPLICATION_CREDENTIALS: str
-    PROJECT_ID: str
-    DATASET_ID: str
-    TABLE_ID: str
-
-    # User settings
-    USER_EMAIL1: str
-    USER_PASSWORD1: str
-    USER_EMAIL2: str
-    USER_PASSWORD2: str
-    USER_EMAIL3: str
-    USER_PASSWORD3: str
-    USER_EMAIL4: str
-    USER_PASSWORD4: str
-    USER_EMAIL5: str
-    USER_PASSWORD5: str
+    # Google Cloud settings, only needed by the BigQuery log sink
+    GOOGLE_APPLICATION_CREDENTIALS: Optional[str] = None
+    PROJECT_ID: Optional[str] = None
+    DATASET_ID: Optional[str] = None
+    TABLE_ID: Optional[str] = None
+
+    # Request logging: rows are queued and flushed in batches to the sink
+    # ("bigquery", "file" or "none"), spilling to LOG_SPILL_PATH if it is down.
+    # "auto" uses BigQuery when the Google Cloud settings are present, else the file.
+    LOG_SINK: str = "auto"
+    LOG_FILE_PATH: str = "logs/requests.jsonl"
+    LOG_SPILL_PATH: str = "logs/spill.jsonl"
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_BATCH_SIZE: int = 500
+    LOG_FLUSH_INTERVAL_SECONDS: float = 2.0
+    LOG_MAX_RETRIES: int = 3
+    LOG_RETRY_BACKOFF_SECONDS: float = 0.5
+
+    # User settings; unset users can't log in
+    USER_EMAIL1: Optional[str] = None
+    USER_PASSWORD1: Optional[str] = None
+    USER_EMAIL2: Optional[str] = None
+    USER_PASSWORD2: Optional[str] = None
+    USER_EMAIL3: Optional[str] = None
+    USER_PASSWORD3: Optional[str] = None
+    USER_EMAIL4: Optional[str] = None
+    USER_PASSWORD4: Optional[str] = None
+    USER_EMAIL5: Optional[str] = None
+    USER_PASSWORD5: Optional[str] = None
+
+    # Filter execution backend: cv2/Pillow ops release the GIL and run on the
+    # thread pool; PROCESS_POOL_OPERATIONS go to a process pool when
+    # FILTER_PROCESS_WORKERS > 0 (each process loads its own model)
+    FILTER_THREAD_WORKERS: int = 8
+    FILTER_PROCESS_WORKERS: int = 0
+    PROCESS_POOL_OPERATIONS: List[str] = ["remove_background"]
+    DEFAULT_OPERATION_CONCURRENCY: int = 4
+    # Background removals share one batched forward pass, so let a full batch in
+    OPERATION_CONCURRENCY: Dict[str, int] = {"remove_background": 4}
+
+    # Admission control: requests beyond MAX_QUEUED_REQUESTS, or waiting longer
+    # than QUEUE_TIMEOUT_SECONDS for a slot, are rejected with 503 + Retry-After
+    MAX_QUEUED_REQUESTS: int = 32
+    QUEUE_TIMEOUT_SECONDS: float = 30.0
+
+    # Edit sessions: decoded images kept in memory so edits don't re-upload.
+    # Least recently used sessions are evicted past SESSION_STORE_BYTES.
+    SESSION_STORE_BYTES: int = 1024 * 1024 * 1024
+    SESSION_TTL_SECONDS: int = 30 * 60
+    SESSION_MAX_VERSIONS: int = 20
+
+    # Preview mode: slider edits run on a proxy whose longest edge is the
+    # client viewport (rounded up to PREVIEW_EDGE_STEP so proxies get reused)
+    PREVIEW_DEFAULT_EDGE: int = 1024
+    PREVIEW_MAX_EDGE: int = 4096
+    PREVIEW_EDGE_STEP: int = 256
+    # Proxies cached per stored version, e.g. editor canvas + thumbnail
+    PREVIEW_PROXIES_PER_VERSION: int = 2
+
+    # Stage timings: Server-Timing response header and Prometheus /metrics
+    SERVER_TIMING_ENABLED: bool = True
+    METRICS_ENABLED: bool = True
+
+    # Per-pixel filters run strip by strip on frames of at least this many
+    # pixels, keeping each strip's working set under TILE_MEMORY_BYTES
+    TILED_PIXEL_THRESHOLD: int = 40_000_000
+    TILE_MEMORY_BYTES: int = 64 * 1024 * 1024
+
+    # Memory budget for memoized pipeline intermediates, so changing the last
+    # step of a chain resumes from the cached output of the step before it
+    MEMO_CACHE_BYTES: int = 512 * 1024 * 1024
+
+    # /process-image and /pipeline results carry an ETag derived from the upload
+    # hash, steps and output settings; If-None-Match is answered with 304 and
+    # identical requests in flight at the same time share one computation
+    RESULT_ETAGS_ENABLED: bool = True
+    COALESCE_REQUESTS: bool = True
+
+    # Bulk jobs: inputs, progress and outputs live under JOBS_DIR so jobs
+    # resume after a restart. All jobs share JOB_WORKERS processing slots.
+    JOBS_DIR: str = "jobs"
+    JOB_WORKERS: int = 4
+    JOB_CONCURRENCY: int = 2
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BACKOFF_SECONDS: float = 1.0
+    JOB_MAX_ITEMS: int = 10000
+    JOB_MAX_ITEM_BYTES: int = 100 * 1024 * 1024
+    JOB_MAX_ARCHIVE_BYTES: int = 4 * 1024 * 1024 * 1024
+    # Directories a job may read server-local paths from; empty disables paths
+    JOB_LOCAL_ROOTS: List[str] = []
+
+    # Maximum number of steps accepted by /pipeline
+    MAX_PIPELINE_STEPS: int = 20
+
+    # Uploads are checked from their header before anything is decoded:
+    # bigger files, other formats or more pixels than this get a 413/415
+    MAX_UPLOAD_BYTES: int = 100 * 1024 * 1024
+    MAX_UPLOAD_PIXELS: int = 100_000_000
+    UPLOAD_FORMATS: List[str] = ["JPEG", "MPO", "PNG", "WEBP", "TIFF", "BMP", "GIF"]
+
+    # /renditions: outputs per upload, and how much larger than a rendition an
+    # already-built one must be to resize it instead of the source
+    MAX_RENDITIONS: int = 12
+    RENDITION_REDUCING_GAP: float = 1.5
+
+    # JPEG in, JPEG out chains of crops, flips and quarter turns (with no
+    # explicit quality) are done by jpegtran on the DCT blocks when it is
+    # installed: lossless, and nothing is decoded or re-encoded
+    JPEG_LOSSLESS_TRANSFORMS: bool = True
+    JPEGTRAN_PATH: str = "jpegtran"
+
+    # Byte budget for resize output; the encoder searches quality/colours to fit
+    RESIZE_MAX_BYTES: int = 1024 * 1024
+
+    # Background removal result cache: memory LRU in front of a disk LRU, both
+    # capped in bytes; entries unused for BG_CACHE_TTL_SECONDS expire
+    BG_CACHE_DIR: str = "cache/background_removal"
+    BG_CACHE_MEMORY_BYTES: int = 256 * 1024 * 1024
+    BG_CACHE_DISK_BYTES: int = 2 * 1024 * 1024 * 1024
+    BG_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    BG_CACHE_STORE_MASK_ONLY: bool = False
+
+    # Background removal models (registry in models.py). A remove_background
+    # step may name one with its 'model' param; otherwise full-resolution
+    # renders use the quality tier REMBG_MODEL and previews the fast tier
+    REMBG_MODEL: str = "u2net_human_seg"
+    SEGMENTATION_FAST_MODEL: str = "u2netp"
+    # Loaded sessions are unloaded least recently used first past this estimate
+    SEGMENTATION_POOL_BYTES: int = 1024 * 1024 * 1024
+    # Mask refinement tier: "fast", "balanced" or "quality" (see matting.py)
+    BG_REMOVAL_QUALITY: str = "balanced"
+    WARMUP_ON_STARTUP: bool = True
+    # Concurrent removals are batched into one forward pass: the first request
+    # waits up to the window for others; 1 disables batching. Up to
+    # INFERENCE_BATCH_MAX_SIZE filter threads may be parked waiting for a batch
+    INFERENCE_BATCH_MAX_SIZE: int = 4
+    INFERENCE_BATCH_WINDOW_MS: float = 10.0
+    # Load the model in the background so the worker serves other filters
+    # (and reports healthy) while it loads; False blocks startup until it is ready
+    WARMUP_IN_BACKGROUND: bool = True
+
+    # ONNX Runtime session options (0 lets ONNX Runtime pick the thread count,
+    # an empty provider list lets rembg pick the best available provider)
+    ONNX_INTRA_OP_THREADS: int = 0
+    ONNX_INTER_OP_THREADS: int = 0
+    ONNX_GRAPH_OPTIMIZATION_LEVEL: str = "all"
+    ONNX_EXECUTION_PROVIDERS: List[str] = []
 
     class Config:
         env_file = ".env"
@@ -1,13 +1,48 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import asyncio
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.core.config import settings
-from app.api.routes import image_routes, auth
+from app.api.routes import image_routes, auth, health, sessions, jobs, metrics
 from app.middleware.logging_middleware import logging_middleware
+from app.middleware.upload_limit import upload_limit_middleware
+from app.services.image_processor import ImageProcessor, ImageStore, ServerBusyError
+from app.services.logging_service import logging_service
+from app.services.job_service import JobManager
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await logging_service.start()
+    # One processor per worker: the segmentation model is loaded and warmed
+    # up here instead of inside the first request that needs it
+    processor = await asyncio.to_thread(ImageProcessor)
+    app.state.processor = processor
+    app.state.image_store = ImageStore()
+    if not settings.WARMUP_ON_STARTUP:
+        processor.ready = True
+    elif settings.WARMUP_IN_BACKGROUND:
+        # Serve the other filters right away; background removal requests
+        # that arrive first wait for the model instead of loading it twice
+        processor.ready = processor.warming = True
+        app.state.warmup_task = asyncio.create_task(asyncio.to_thread(processor.warmup))
+    else:
+        await asyncio.to_thread(processor.warmup)
+    # Resume bulk jobs interrupted by the last shutdown
+    job_manager = JobManager(processor)
+    await job_manager.start()
+    app.state.job_manager = job_manager
+    yield
+    await job_manager.stop()
+    processor.shutdown()
+    # Drain queued log rows before the worker exits
+    await logging_service.stop()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
-    description=settings.DESCRIPTION
+    description=settings.DESCRIPTION,
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -20,9 +55,24 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+@app.exception_handler(ServerBusyError)
+async def server_busy_handler(request: Request, exc: ServerBusyError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# Registered before the logging middleware so rejected uploads are still logged
+app.middleware("http")(upload_limit_middleware)
 # Add after CORS middleware
 app.middleware("http")(logging_middleware)
 
 # Include routers
 app.include_router(image_routes.router, prefix="/api")
 app.include_router(auth.router, prefix="/api")
+app.include_router(health.router, prefix="/api")
+app.include_router(sessions.router, prefix="/api")
+app.include_router(jobs.router, prefix="/api")
+# Prometheus scrapes the conventional path, outside /api
+app.include_router(metrics.router)
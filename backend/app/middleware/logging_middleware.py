@@ -1,11 +1,26 @@
 from fastapi import Request
 import time
-from app.services.logging_service import LoggingService
+from app.core.config import settings
+from app.services.logging_service import logging_service
+from app.services.metrics import begin_request, server_timing, stage, REQUEST_SECONDS, REQUESTS
 
-logging_service = LoggingService()
+def route_label(request: Request) -> str:
+    """The request path with path parameters put back as {name}, so ids don't explode label cardinality"""
+    if request.scope.get("route") is None:
+        return "unmatched"
+    segments = request.url.path.split("/")
+    for name, value in request.path_params.items():
+        segments = [f"{{{name}}}" if segment == str(value) else segment for segment in segments]
+    return "/".join(segments)
+
+def record_request(request: Request, status_code: int, execution_time: float):
+    labels = {"method": request.method, "route": route_label(request), "status": str(status_code)}
+    REQUEST_SECONDS.observe(execution_time, **labels)
+    REQUESTS.inc(**labels)
 
 async def logging_middleware(request: Request, call_next):
     start_time = time.time()
+    stages = begin_request()
     
     try:
         response = await call_next(request)
@@ -18,12 +33,16 @@ async def logging_middleware(request: Request, call_next):
         if request.url.path.endswith("/login"):
             request.state.login_time = start_time
         
-        await logging_service.log_request(
-            request=request,
-            user_email=user_email,
-            status_code=response.status_code,
-            execution_time=execution_time
-        )
+        with stage("log"):
+            await logging_service.log_request(
+                request=request,
+                user_email=user_email,
+                status_code=response.status_code,
+                execution_time=execution_time
+            )
+        record_request(request, response.status_code, execution_time)
+        if settings.SERVER_TIMING_ENABLED:
+            response.headers["Server-Timing"] = server_timing(stages, time.time() - start_time)
         
         return response
         
@@ -37,4 +56,5 @@ async def logging_middleware(request: Request, call_next):
             execution_time=execution_time,
             error_message=str(e)
         )
-        raise 
\ No newline at end of file
+        record_request(request, 500, execution_time)
+        raise
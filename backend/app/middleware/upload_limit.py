@@ -0,0 +1,19 @@
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from app.core.config import settings
+
+# Room for the form fields and multipart boundaries around the image
+MULTIPART_OVERHEAD = 64 * 1024
+# Bulk job archives are copied to disk in chunks under JOB_MAX_ARCHIVE_BYTES
+EXEMPT_PREFIXES = ("/api/jobs",)
+
+async def upload_limit_middleware(request: Request, call_next):
+    """Refuse a body whose declared length is over MAX_UPLOAD_BYTES before any of it is read"""
+    length = request.headers.get("content-length", "")
+    if (length.isdigit() and int(length) > settings.MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD
+            and not request.url.path.startswith(EXEMPT_PREFIXES)):
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Request body is {length} bytes, uploads are limited to {settings.MAX_UPLOAD_BYTES}"}
+        )
+    return await call_next(request)
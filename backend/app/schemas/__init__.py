@@ -1,3 +1,5 @@
-from .image import ImageResponse, ProcessingParams
+from .image import (ImageResponse, ProcessingParams, PipelineStep, PipelineRequest,
+                    EditRequest, ExportRequest, ImageSessionResponse)
 
-__all__ = ['ImageResponse', 'ProcessingParams']
+__all__ = ['ImageResponse', 'ProcessingParams', 'PipelineStep', 'PipelineRequest',
+           'EditRequest', 'ExportRequest', 'ImageSessionResponse']
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List
 
 class ProcessingParams(BaseModel):
     value: Optional[float] = None
@@ -12,3 +12,37 @@ class ProcessingParams(BaseModel):
 class ImageResponse(BaseModel):
     image: str
     metadata: Optional[Dict[str, Any]] = None
+
+class PipelineStep(BaseModel):
+    operation: str
+    params: Dict[str, Any] = {}
+
+class PipelineRequest(BaseModel):
+    steps: List[PipelineStep]
+
+class Rendition(BaseModel):
+    # Used as the file name inside the ZIP/multipart response
+    name: str = Field(..., pattern=r"^[A-Za-z0-9_.-]{1,64}$")
+    width: Optional[int] = None
+    height: Optional[int] = None
+    format: str = "png"
+    quality: Optional[int] = Field(None, ge=1, le=100)
+    max_bytes: Optional[int] = None
+    white_background: bool = False
+
+class RenditionsRequest(BaseModel):
+    renditions: List[Rendition]
+    steps: List[PipelineStep] = []
+
+class EditRequest(PipelineRequest):
+    base_version: Optional[int] = None
+
+class ExportRequest(BaseModel):
+    steps: Optional[List[PipelineStep]] = None
+    base_version: Optional[int] = None
+
+class ImageSessionResponse(BaseModel):
+    image_id: str
+    version: int
+    width: int
+    height: int
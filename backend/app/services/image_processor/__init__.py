@@ -1,5 +1,8 @@
 from .processor import ImageProcessor
 from .filters import ImageFilter
+from .executor import FilterExecutor, ServerBusyError
+from .encoding import OutputFormat, EncodedImage, encode_image
+from .store import ImageStore
 from .utils import convert_to_base64, load_image
 
-__all__ = ['ImageProcessor', 'ImageFilter', 'convert_to_base64', 'load_image']
+__all__ = ['ImageProcessor', 'ImageFilter', 'FilterExecutor', 'ServerBusyError', 'OutputFormat', 'EncodedImage', 'encode_image', 'ImageStore', 'convert_to_base64', 'load_image']
@@ -0,0 +1,155 @@
+"""Micro-batched segmentation inference.
+
+Concurrent background removals each run a single-image forward pass, which
+leaves the model's batch dimension unused. ``InferenceBatcher`` sits in front
+of a rembg session: callers block in ``predict`` while a dispatcher thread
+collects requests for up to ``INFERENCE_BATCH_WINDOW_MS`` after the first
+one arrives (or until ``INFERENCE_BATCH_MAX_SIZE`` are queued), runs one
+forward pass and hands each caller its mask. Requests that queued up behind
+a running batch go out as soon as it finishes, so under load the window costs
+nothing and an idle server only pays it once.
+
+The batcher quacks like a rembg session (``predict`` and ``inner_session``).
+Models whose preprocessing isn't known here, or whose ONNX graph has a fixed
+batch size of 1, are still funnelled through the dispatcher but run one by one.
+"""
+from concurrent.futures import Future
+from typing import List, Optional
+import threading
+import time
+from PIL import Image
+import numpy as np
+from app.core.config import settings
+from app.services.metrics import INFERENCE_BATCH_SIZE, INFERENCE_QUEUE_SECONDS
+from .models import base_model
+
+IMAGENET = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
+CENTERED = ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0))
+
+# Model -> (mean, std, input size) used by rembg's normalize() for that model
+NORMALIZATION = {
+    "u2net": IMAGENET + (320,),
+    "u2netp": IMAGENET + (320,),
+    "u2net_human_seg": IMAGENET + (320,),
+    "silueta": IMAGENET + (320,),
+    "isnet-general-use": CENTERED + (1024,),
+    "isnet-anime": CENTERED + (1024,),
+}
+
+def batch_capable(session) -> bool:
+    """Whether the session's graph accepts more than one image per run"""
+    try:
+        batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    except Exception:
+        return False
+    return not (isinstance(batch_dim, int) and batch_dim == 1)
+
+def to_tensor(image: Image.Image, mean, std, size: int) -> np.ndarray:
+    """Same preprocessing as rembg's normalize(), for one image, CHW float32"""
+    array = np.asarray(image.convert("RGB").resize((size, size), Image.Resampling.LANCZOS), dtype=np.float32)
+    array = array / max(float(array.max()), 1e-6)
+    array = (array - np.asarray(mean, dtype=np.float32)) / np.asarray(std, dtype=np.float32)
+    return array.transpose((2, 0, 1))
+
+def to_mask(prediction: np.ndarray, size) -> Image.Image:
+    """Min-max normalise one prediction map and resize it to the caller's image"""
+    low, high = float(prediction.min()), float(prediction.max())
+    prediction = (prediction - low) / max(high - low, 1e-6)
+    mask = Image.fromarray((prediction * 255).astype(np.uint8), "L")
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+class _Request:
+    __slots__ = ("image", "future", "queued_at")
+
+    def __init__(self, image: Image.Image):
+        self.image = image
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+class InferenceBatcher:
+    """Groups concurrent predict() calls on one session into batched forward passes"""
+
+    def __init__(self, session, max_batch: int = None, window_ms: float = None):
+        self.session = session
+        self.model_name = getattr(session, "model_name", "")
+        self.max_batch = max(1, max_batch or settings.INFERENCE_BATCH_MAX_SIZE)
+        window_ms = settings.INFERENCE_BATCH_WINDOW_MS if window_ms is None else window_ms
+        self.window = max(0.0, window_ms) / 1000
+        # Quantized variants preprocess like the model they were made from
+        self.normalization = NORMALIZATION.get(base_model(self.model_name))
+        self.batched = self.normalization is not None and self.max_batch > 1 and batch_capable(session)
+        if not self.batched:
+            # Nothing to gain from waiting for company
+            self.window = 0.0
+        self.queue: List[_Request] = []
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.closed = False
+
+    @property
+    def inner_session(self):
+        return self.session.inner_session
+
+    def close(self):
+        """Let the dispatcher exit once the queue is drained, so the session can be freed"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def predict(self, image: Image.Image) -> List[Image.Image]:
+        """Blocking: the mask for image, computed in whichever batch it lands in"""
+        request = _Request(image)
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._dispatch, name="inference-batcher", daemon=True)
+                self.thread.start()
+            self.queue.append(request)
+            self.condition.notify()
+        return request.future.result()
+
+    def _next_batch(self) -> Optional[List[_Request]]:
+        """The next batch, or None when closed and idle (the dispatcher then exits)"""
+        with self.condition:
+            while not self.queue:
+                if self.closed:
+                    # A predict() after this starts a new dispatcher
+                    self.thread = None
+                    return None
+                self.condition.wait()
+            # The window runs from the oldest request, so a backlog is sent at once
+            deadline = self.queue[0].queued_at + self.window
+            while len(self.queue) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch, self.queue = self.queue[:self.max_batch], self.queue[self.max_batch:]
+            return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            for request in batch:
+                INFERENCE_QUEUE_SECONDS.observe(started - request.queued_at, model=self.model_name)
+            INFERENCE_BATCH_SIZE.observe(len(batch), model=self.model_name)
+            try:
+                masks = self._run(batch)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            for request, request_masks in zip(batch, masks):
+                request.future.set_result(request_masks)
+
+    def _run(self, batch: List[_Request]) -> List[List[Image.Image]]:
+        """Per request, the list of masks session.predict would have returned"""
+        if not self.batched:
+            return [self.session.predict(request.image) for request in batch]
+        mean, std, size = self.normalization
+        tensor = np.stack([to_tensor(request.image, mean, std, size) for request in batch])
+        input_name = self.session.inner_session.get_inputs()[0].name
+        predictions = self.session.inner_session.run(None, {input_name: tensor})[0][:, 0, :, :]
+        return [[to_mask(prediction, request.image.size)] for request, prediction in zip(batch, predictions)]
@@ -1,23 +1,183 @@
+from collections import OrderedDict
 import hashlib
+import json
 from pathlib import Path
 import os
+import tempfile
+import threading
+import time
 from PIL import Image
-import io
+from app.core.config import settings
+
+def content_key(data) -> str:
+    """Hash of the raw upload bytes, the root of every cache key"""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+def chain_key(previous_key: str, operation: str, params: dict) -> str:
+    """Key of the image produced by applying operation/params to the keyed image"""
+    step = json.dumps([operation, params], sort_keys=True, default=str)
+    return content_key(f"{previous_key}:{step}".encode())
+
+def image_nbytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
 
 class ImageCache:
-    def __init__(self):
-        self.cache_dir = Path("cache/background_removal")
+    """Content-addressed two-tier cache: an in-memory LRU in front of a disk LRU.
+
+    Disk entries are written atomically (temp file + rename) so several uvicorn
+    workers can share the directory. A file's mtime is its last access time,
+    which drives both LRU eviction and the idle TTL. With store_mask_only the
+    disk tier keeps just the alpha mask and rebuilds the cutout from the source.
+    """
+
+    def __init__(self, cache_dir: str = None, memory_bytes: int = None, disk_bytes: int = None,
+                 ttl_seconds: int = None, store_mask_only: bool = None):
+        self.cache_dir = Path(cache_dir or settings.BG_CACHE_DIR)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-    
-    def get_cache_key(self, image_bytes: bytes) -> str:
-        return hashlib.md5(image_bytes).hexdigest()
-    
-    def get_cached_image(self, cache_key: str) -> Image.Image | None:
-        cache_path = self.cache_dir / f"{cache_key}.png"
-        if cache_path.exists():
-            return Image.open(cache_path)
-        return None
-    
-    def cache_image(self, cache_key: str, image: Image.Image):
-        cache_path = self.cache_dir / f"{cache_key}.png"
-        image.save(cache_path, "PNG") 
\ No newline at end of file
+        self.memory_limit = settings.BG_CACHE_MEMORY_BYTES if memory_bytes is None else memory_bytes
+        self.disk_limit = settings.BG_CACHE_DISK_BYTES if disk_bytes is None else disk_bytes
+        self.ttl = settings.BG_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.store_mask_only = settings.BG_CACHE_STORE_MASK_ONLY if store_mask_only is None else store_mask_only
+
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = sum(path.stat().st_size for path in self._disk_entries())
+        self.counters = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0,
+            "memory_evictions": 0, "disk_evictions": 0, "expired": 0
+        }
+
+    def make_key(self, source_key: str, model_name: str, params: dict) -> str:
+        return chain_key(source_key, f"remove_background:{model_name}", params)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.png"
+
+    def _disk_entries(self):
+        return self.cache_dir.glob("*/*.png")
+
+    def get(self, key: str, source: Image.Image = None):
+        """Return the cached result, or None. source is needed to rebuild mask-only entries"""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and now - entry[2] <= self.ttl:
+                self.memory.move_to_end(key)
+                self.memory[key] = (entry[0], entry[1], now)
+                self.counters["memory_hits"] += 1
+                return entry[0]
+            if entry:
+                self._drop_memory(key)
+                self.counters["expired"] += 1
+
+        path = self._path(key)
+        try:
+            if now - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                with self.lock:
+                    self.counters["expired"] += 1
+                    self.counters["misses"] += 1
+                return None
+            cached = Image.open(path)
+            cached.load()
+            os.utime(path)
+        except (FileNotFoundError, OSError):
+            with self.lock:
+                self.counters["misses"] += 1
+            return None
+
+        if cached.mode == 'L':
+            if source is None:
+                with self.lock:
+                    self.counters["misses"] += 1
+                return None
+            result = source.convert('RGBA')
+            result.putalpha(cached)
+            cached = result
+
+        with self.lock:
+            self.counters["disk_hits"] += 1
+            self._remember(key, cached, now)
+        return cached
+
+    def put(self, key: str, image: Image.Image):
+        with self.lock:
+            self._remember(key, image, time.time())
+
+        stored = image.getchannel('A') if self.store_mask_only and image.mode == 'RGBA' else image
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write next to the target then rename, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                stored.save(f, format="PNG", compress_level=1)
+            with self.lock:
+                # Rewriting an existing entry only adds the difference
+                try:
+                    previous = path.stat().st_size
+                except FileNotFoundError:
+                    previous = 0
+                os.replace(tmp_path, path)
+                self.disk_bytes += path.stat().st_size - previous
+                over_limit = self.disk_bytes > self.disk_limit
+        except Exception:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        if over_limit:
+            self._evict_disk()
+
+    def _remember(self, key: str, image: Image.Image, now: float):
+        size = image_nbytes(image)
+        if size > self.memory_limit:
+            return
+        if key in self.memory:
+            self._drop_memory(key)
+        self.memory[key] = (image, size, now)
+        self.memory_bytes += size
+        while self.memory_bytes > self.memory_limit:
+            oldest = next(iter(self.memory))
+            self._drop_memory(oldest)
+            self.counters["memory_evictions"] += 1
+
+    def _drop_memory(self, key: str):
+        _, size, _ = self.memory.pop(key)
+        self.memory_bytes -= size
+
+    def _evict_disk(self):
+        """Rescan the shared directory and delete least recently used files down to the limit"""
+        entries = []
+        for path in self._disk_entries():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # another worker evicted it
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        # Leave some headroom so we don't rescan on every write
+        target = self.disk_limit * 0.9
+        evicted = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        with self.lock:
+            self.disk_bytes = total
+            self.counters["disk_evictions"] += evicted
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_bytes": self.disk_bytes
+            }
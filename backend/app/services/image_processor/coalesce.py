@@ -0,0 +1,80 @@
+"""Single-flight coalescing of identical requests and their result ETags.
+
+A request's result is fully determined by the upload bytes, the steps, the
+output settings and the server's model/config, so a hash of those names it.
+That hash is both the ETag sent with the result, which lets a client that
+already holds it get a 304 without anything being decoded, and the key under
+which identical requests arriving while one is being computed wait for that
+one computation instead of starting their own.
+
+The computation runs as its own task and every caller awaits it through
+``asyncio.shield``, so the first caller disconnecting doesn't cancel the work
+the others are waiting on. Whatever that task reads from the first caller's
+request (its upload) is held open until the task is done, via ``on_start``.
+Coalescing is per worker process.
+"""
+import asyncio
+import json
+import shutil
+from typing import Awaitable, Callable, Dict, Optional
+from app.core.config import settings
+from app.services.metrics import stage
+from .cache import content_key
+
+def result_etag(source_key: str, request: dict, weak: bool = False) -> str:
+    """ETag of the response to request applied to the upload hashed as source_key.
+
+    request must hold everything else the response depends on (route, steps,
+    output format, representation). Settings that change results are mixed in
+    so a deploy with another model or version never matches an old ETag.
+    """
+    server = [settings.VERSION, settings.REMBG_MODEL, settings.SEGMENTATION_FAST_MODEL,
+              settings.BG_REMOVAL_QUALITY, settings.RESIZE_MAX_BYTES, settings.RENDITION_REDUCING_GAP,
+              # Execution provider and graph optimisations shift the model's floating point output
+              settings.ONNX_EXECUTION_PROVIDERS, settings.ONNX_GRAPH_OPTIMIZATION_LEVEL,
+              # Geometry-only JPEG edits are jpegtran's bytes when it runs, a re-encode otherwise
+              settings.JPEG_LOSSLESS_TRANSFORMS, bool(shutil.which(settings.JPEGTRAN_PATH))]
+    digest = content_key(json.dumps([source_key, request, server], sort_keys=True, default=str).encode())
+    return f'W/"{digest}"' if weak else f'"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match evaluation, which uses the weak comparison (RFC 9110 13.1.2)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+class SingleFlight:
+    """Runs one computation per key at a time; concurrent callers share its result or error"""
+
+    def __init__(self):
+        self.calls: Dict[str, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def run(self, key: str, func: Callable[[], Awaitable],
+                  on_start: Optional[Callable[[asyncio.Task], None]] = None):
+        """func's result, shared with identical calls in flight; on_start gets the task when this call starts it"""
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            if on_start is not None:
+                on_start(task)
+            return await asyncio.shield(task)
+
+        self.coalesced += 1
+        with stage("coalesced"):
+            return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Mark the error retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self.calls), "coalesced": self.coalesced}
@@ -0,0 +1,240 @@
+from PIL import Image
+from typing import Optional
+import base64
+import io
+from .frame import as_image
+
+# format name -> (Pillow format, media type)
+FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+MEDIA_TYPES = {media_type: name for name, (_, media_type) in FORMATS.items()}
+
+class OutputFormat:
+    """Encoder choice and settings for a response image"""
+
+    def __init__(self, format: str = 'png', quality: Optional[int] = None,
+                 compress_level: Optional[int] = None, effort: Optional[int] = None):
+        format = format.lower()
+        if format == 'jpg':
+            format = 'jpeg'
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported output format: {format}")
+        self.format = format
+        # JPEG/WebP quality 1-100, PNG zlib level 0-9, WebP method 0-6
+        self.quality = quality
+        self.compress_level = compress_level
+        self.effort = effort
+
+    @property
+    def media_type(self) -> str:
+        return FORMATS[self.format][1]
+
+    def fastest(self) -> 'OutputFormat':
+        """Same format with the cheapest encoder settings unless set explicitly, for previews"""
+        return OutputFormat(
+            self.format,
+            quality=self.quality,
+            compress_level=1 if self.compress_level is None else self.compress_level,
+            effort=0 if self.effort is None else self.effort
+        )
+
+class EncodedImage:
+    def __init__(self, data: bytes, media_type: str):
+        self.data = data
+        self.media_type = media_type
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.data).decode()
+
+def encode_image(image: Image.Image, output: Optional[OutputFormat] = None,
+                 use_budget: bool = True) -> EncodedImage:
+    """Encode a PIL Image with the requested format, keeping its DPI.
+
+    Images carrying a 'max_bytes' budget (set by the resize filter) go through
+    encode_to_budget instead, unless use_budget is off (previews).
+    """
+    # The encoder boundary: a pipeline's Frame becomes a Pillow image here
+    image = as_image(image)
+    output = output or OutputFormat()
+    if use_budget and image.info.get('max_bytes'):
+        return encode_to_budget(
+            image,
+            image.info['max_bytes'],
+            output,
+            lossy_fallback=image.info.get('lossy_fallback', True)
+        )
+    return _encode(image, output)
+
+def _encode(image: Image.Image, output: OutputFormat) -> EncodedImage:
+    pil_format = FORMATS[output.format][0]
+    save_args = {}
+    if 'dpi' in image.info:
+        save_args['dpi'] = image.info['dpi']
+
+    if output.format == 'png':
+        save_args['compress_level'] = 6 if output.compress_level is None else output.compress_level
+    elif output.format == 'jpeg':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha: flatten onto white like the white_background filter
+            rgba = image.convert('RGBA')
+            flattened = Image.new('RGB', image.size, (255, 255, 255))
+            flattened.paste(rgba, mask=rgba.getchannel('A'))
+            flattened.info = image.info
+            image = flattened
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        save_args['quality'] = output.quality or 85
+    elif output.format == 'webp':
+        save_args['quality'] = output.quality or 80
+        save_args['method'] = 4 if output.effort is None else output.effort
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=pil_format, **save_args)
+    return EncodedImage(buffer.getvalue(), output.media_type)
+
+# Quality range searched for lossy formats, same floor as the old resize loop
+QUALITY_RANGE = (50, 95)
+# Encodes of the full-size image allowed per budget search
+MAX_FULL_TRIALS = 4
+# Pixel count of the proxy used for size estimates
+PROXY_PIXELS = 250_000
+# Downscaled proxies compress worse per pixel, so only skip a full PNG encode
+# when the estimate is well over budget
+PNG_ESTIMATE_SLACK = 1.5
+
+def has_alpha(image: Image.Image) -> bool:
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+def encode_to_budget(image: Image.Image, max_bytes: int, output: Optional[OutputFormat] = None,
+                     lossy_fallback: bool = True) -> EncodedImage:
+    """Encode under max_bytes with a bounded number of trial encodes.
+
+    PNG is tried as-is, then with an adaptive 256 colour palette, then (if
+    allowed) as WebP/JPEG. Lossy formats search quality starting from an
+    estimate made on a downscaled proxy. If nothing fits, the smallest
+    encoding found is returned.
+    """
+    output = output or OutputFormat()
+    if output.format != 'png':
+        return _search_quality(image, max_bytes, output)
+
+    smallest = None
+    for quantize in (False, True):
+        candidate = _quantize(image) if quantize else image
+        # Skip full encodes that the proxy says are hopeless
+        if _estimate_size(candidate, output) > max_bytes * PNG_ESTIMATE_SLACK:
+            continue
+        encoded = _encode(candidate, output)
+        if len(encoded.data) <= max_bytes:
+            return encoded
+        if smallest is None or len(encoded.data) < len(smallest.data):
+            smallest = encoded
+
+    if not lossy_fallback:
+        return smallest or _encode(candidate, output)
+
+    lossy = OutputFormat('webp' if has_alpha(image) else 'jpeg', effort=output.effort)
+    return _search_quality(image, max_bytes, lossy)
+
+def _quantize(image: Image.Image) -> Image.Image:
+    """Adaptive 256 colour palette; usually several times smaller as PNG"""
+    # FASTOCTREE keeps alpha in the palette and is ~40x faster than MEDIANCUT
+    mode = 'RGBA' if has_alpha(image) else 'RGB'
+    quantized = image.convert(mode).quantize(256, method=Image.Quantize.FASTOCTREE)
+    if 'dpi' in image.info:
+        quantized.info['dpi'] = image.info['dpi']
+    return quantized
+
+def _proxy(image: Image.Image):
+    """Downscaled copy of about PROXY_PIXELS and its area ratio to the original"""
+    area = image.width * image.height
+    factor = max(1, int((area / PROXY_PIXELS) ** 0.5))
+    if factor == 1:
+        return image, 1.0
+    if image.mode == 'P':
+        # reduce() needs real pixels, nearest keeps the palette intact
+        proxy = image.resize((image.width // factor, image.height // factor), Image.Resampling.NEAREST)
+    else:
+        proxy = image.reduce(factor)
+    return proxy, area / (proxy.width * proxy.height)
+
+def _estimate_size(image: Image.Image, output: OutputFormat) -> float:
+    """Encoded size predicted from a proxy encode, 0 when the image is already small"""
+    proxy, ratio = _proxy(image)
+    if ratio == 1.0:
+        return 0
+    return len(_encode(proxy, output).data) * ratio
+
+def _estimate_quality(image: Image.Image, max_bytes: int, output: OutputFormat) -> int:
+    """Binary search quality on a small proxy, scaling its size up by the area ratio"""
+    low, high = QUALITY_RANGE
+    proxy, ratio = _proxy(image)
+    if ratio == 1.0:
+        return (low + high) // 2
+
+    estimate = low
+    while low <= high:
+        quality = (low + high) // 2
+        size = len(_encode(proxy, OutputFormat(output.format, quality=quality, effort=output.effort)).data)
+        if size * ratio <= max_bytes:
+            estimate = quality
+            low = quality + 1
+        else:
+            high = quality - 1
+    return estimate
+
+def _search_quality(image: Image.Image, max_bytes: int, output: OutputFormat) -> EncodedImage:
+    low, high = QUALITY_RANGE
+    if output.quality:
+        # An explicit quality is a ceiling, not a target
+        high = min(high, output.quality)
+    quality = min(high, _estimate_quality(image, max_bytes, output))
+    best = None
+    smallest = None
+    for _ in range(MAX_FULL_TRIALS):
+        encoded = _encode(image, OutputFormat(output.format, quality=quality, effort=output.effort))
+        if len(encoded.data) <= max_bytes:
+            best = encoded
+            low = quality + 1
+        else:
+            high = quality - 1
+            if smallest is None or len(encoded.data) < len(smallest.data):
+                smallest = encoded
+        if low > high:
+            break
+        quality = (low + high) // 2
+    return best or smallest
+
+def negotiate(accept: Optional[str], format: Optional[str] = None):
+    """Pick (format name, binary response?) from the Accept header and an explicit format.
+
+    A bare */* or application/json keeps the legacy base64 JSON response; asking
+    for an image media type switches to raw bytes.
+    """
+    ranges = []
+    for position, part in enumerate((accept or '').split(',')):
+        fields = [field.strip() for field in part.split(';')]
+        media_range = fields[0].lower()
+        if not media_range:
+            continue
+        q = 1.0
+        for field in fields[1:]:
+            if field.startswith('q='):
+                try:
+                    q = float(field[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            ranges.append((-q, position, media_range))
+
+    for _, _, media_range in sorted(ranges):
+        if media_range in MEDIA_TYPES:
+            return format or MEDIA_TYPES[media_range], True
+        if media_range == 'image/*':
+            return format or 'png', True
+        if media_range in ('application/json', '*/*'):
+            return format or 'png', False
+    return format or 'png', False
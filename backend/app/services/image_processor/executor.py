@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import contextvars
+import math
+import multiprocessing
+import time
+from PIL import Image
+from app.core.config import settings
+from .filters import ImageFilter, create_filters
+from .frame import ImageLike, share, attach, receive, release
+
+class ServerBusyError(Exception):
+    """Raised when the admission queue is full or a slot can't be obtained in time"""
+    def __init__(self, message: str, retry_after: int, status_code: int = 503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+# Filters owned by a process pool worker, built once by _init_worker
+_worker_filters = {}
+
+def _init_worker(operations):
+    global _worker_filters
+    _worker_filters = create_filters(operations)
+
+def _run_in_worker(operation: str, shared, params: dict, tiled: bool = False):
+    """Run a filter on a frame mapped from shared memory, returning the result the same way"""
+    filter_instance = _worker_filters[operation]
+    with attach(shared) as frame:
+        result = filter_instance.execute(frame, params, tiled)
+        output = share(result)
+        del result
+    return output
+
+class FilterExecutor:
+    """Runs filter work off the event loop with per-operation limits and bounded admission"""
+
+    def __init__(self):
+        self.thread_pool = ThreadPoolExecutor(
+            max_workers=settings.FILTER_THREAD_WORKERS,
+            thread_name_prefix="filter"
+        )
+        self.process_pool = None
+        self.process_operations = set()
+        if settings.FILTER_PROCESS_WORKERS > 0:
+            self.process_operations = set(settings.PROCESS_POOL_OPERATIONS)
+            self.process_pool = ProcessPoolExecutor(
+                max_workers=settings.FILTER_PROCESS_WORKERS,
+                # Spawn so workers don't inherit the parent's threads and sessions
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(list(self.process_operations),)
+            )
+
+        self.limits = {}
+        self.semaphores = {}
+        self.waiting = {}
+        self.running = {}
+        # Exponentially weighted average run time per operation, for Retry-After
+        self.avg_duration = {}
+        self.admitted = 0
+
+    def _semaphore(self, operation: str) -> asyncio.Semaphore:
+        if operation not in self.semaphores:
+            limit = settings.OPERATION_CONCURRENCY.get(operation, settings.DEFAULT_OPERATION_CONCURRENCY)
+            self.limits[operation] = max(1, limit)
+            self.semaphores[operation] = asyncio.Semaphore(self.limits[operation])
+            self.waiting[operation] = 0
+            self.running[operation] = 0
+        return self.semaphores[operation]
+
+    def retry_after(self, operation: str = None) -> int:
+        """Rough number of seconds until a slot frees up"""
+        if operation is None:
+            durations = self.avg_duration.values()
+            return max(1, math.ceil(max(durations, default=1.0)))
+        backlog = self.waiting.get(operation, 0) + 1
+        estimate = self.avg_duration.get(operation, 1.0) * backlog / self.limits.get(operation, 1)
+        return max(1, math.ceil(estimate))
+
+    @asynccontextmanager
+    async def admit(self):
+        """Reserve a place in the bounded admission queue for one request"""
+        if self.admitted >= settings.MAX_QUEUED_REQUESTS:
+            raise ServerBusyError(
+                f"Server is busy ({self.admitted} requests in progress)",
+                retry_after=self.retry_after()
+            )
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.admitted -= 1
+
+    async def apply(self, operation: str, filter_instance: ImageFilter, image: ImageLike, params: dict,
+                    tiled: bool = False) -> ImageLike:
+        """Run a filter on the thread or process pool once an operation slot is free"""
+        semaphore = self._semaphore(operation)
+        self.waiting[operation] += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=settings.QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise ServerBusyError(
+                f"Timed out waiting for a {operation} slot",
+                retry_after=self.retry_after(operation)
+            )
+        finally:
+            self.waiting[operation] -= 1
+
+        loop = asyncio.get_running_loop()
+        self.running[operation] += 1
+        start = time.perf_counter()
+        try:
+            if operation in self.process_operations:
+                return await self._run_in_process(operation, image, params, tiled)
+            # Carry the request's context so stages timed inside the filter reach it
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self.thread_pool, context.run, filter_instance.execute,
+                                              image, params, tiled)
+        finally:
+            self.running[operation] -= 1
+            semaphore.release()
+            duration = time.perf_counter() - start
+            previous = self.avg_duration.get(operation, duration)
+            self.avg_duration[operation] = 0.8 * previous + 0.2 * duration
+
+    async def _run_in_process(self, operation: str, image, params: dict, tiled: bool):
+        # Pixels cross the process boundary through shared memory, not pickling
+        loop = asyncio.get_running_loop()
+        shared = await self.call(share, image)
+        try:
+            result = await loop.run_in_executor(self.process_pool, _run_in_worker, operation, shared, params, tiled)
+        finally:
+            release(shared)
+        return await self.call(receive, result)
+
+    async def call(self, func, *args):
+        """Run a synchronous helper (decode, encode, crop) on the thread pool"""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.thread_pool, context.run, func, *args)
+
+    def status(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "waiting": dict(self.waiting),
+            "in_flight": dict(self.running)
+        }
+
+    def shutdown(self):
+        self.thread_pool.shutdown(wait=False, cancel_futures=True)
+        if self.process_pool:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
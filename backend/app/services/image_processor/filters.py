@@ -1,157 +1,299 @@
 from abc import ABC, abstractmethod
 from PIL import Image, ImageEnhance
-import cv2
-import numpy as np
-import io
-from rembg import remove
-from .cache import ImageCache
+from .cache import ImageCache, content_key
+from .models import SessionPool, create_session, available_models
+from .batching import InferenceBatcher
+from .tone import apply_curve, tone_curve
+from .geometry import transform, crop_box, fit_size, resize_info
+from .frame import ImageLike, as_image
+from .tiling import run_tiled
+from .matting import cutout, QUALITY_TIERS
+from app.core.config import settings
+from app.services.metrics import stage
+
+def check_number(params: dict, key: str, minimum: float = None):
+    """Raise ValueError if params[key] is present but not a usable number"""
+    if key not in params:
+        return
+    value = params[key]
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"'{key}' must be a number, got {value!r}")
+    if minimum is not None and value < minimum:
+        raise ValueError(f"'{key}' must be at least {minimum}, got {value!r}")
 
 class ImageFilter(ABC):
+    # True when running before a resize gives the same result as running after
+    # it, so the source may be decoded at a reduced size
+    resolution_independent = False
+    # Extra rows a strip needs on each side for tiled execution (0 for
+    # per-pixel filters), None when the filter can't run on strips
+    tile_overlap = None
+    # True when run_frame() works on NumPy frames, so the pipeline hands it the
+    # previous step's Frame instead of converting to a Pillow image
+    frame_native = False
+    # Modes run() takes as they are; the decoder converts anything else to
+    # RGB, or RGBA when the source has transparency
+    modes = ('RGB', 'RGBA')
+
     @abstractmethod
-    async def apply(self, image: Image.Image, params: dict) -> Image.Image:
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        """Synchronous pixel work, dispatched to a worker pool by FilterExecutor"""
         pass
 
-class ExposureFilter(ImageFilter):
-    async def apply(self, image: Image.Image, params: dict) -> Image.Image:
-        value = params.get('value', 0)
-        img_array = np.array(image)
-        adjusted = cv2.convertScaleAbs(img_array, alpha=1 + value, beta=0)
-        return Image.fromarray(adjusted)
+    def run_tiled(self, image: Image.Image, params: dict) -> Image.Image:
+        """run() strip by strip into a preallocated output, for very large frames"""
+        return run_tiled(image, lambda strip: self.run(strip, params), self.tile_overlap)
 
-class HighlightsFilter(ImageFilter):
-    async def apply(self, image: Image.Image, params: dict) -> Image.Image:
-        value = params.get('value', 0)
-        img_array = np.array(image)
-        hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-        h, s, v = cv2.split(hsv)
-        
-        mask = v > 127
-        v[mask] = np.clip(v[mask] * (1 + value), 0, 255)
-        
-        hsv = cv2.merge([h, s, v])
-        adjusted = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
-        return Image.fromarray(adjusted)
+    def run_frame(self, image: ImageLike, params: dict) -> ImageLike:
+        """run() for a Frame or an image, returning whichever is cheaper; frame_native filters override it"""
+        return self.run(as_image(image), params)
 
-class ShadowsFilter(ImageFilter):
-    async def apply(self, image: Image.Image, params: dict) -> Image.Image:
-        value = params.get('value', 0)
-        img_array = np.array(image)
-        hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-        h, s, v = cv2.split(hsv)
-        
-        mask = v <= 127
-        v[mask] = np.clip(v[mask] * (1 + value), 0, 255)
-        
-        hsv = cv2.merge([h, s, v])
-        adjusted = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
-        return Image.fromarray(adjusted)
+    def execute(self, image: ImageLike, params: dict, tiled: bool = False) -> ImageLike:
+        """Entry point for FilterExecutor: converts to Pillow only when the filter needs it"""
+        # A large Pillow image still goes strip by strip, a Frame is updated
+        # in place or written once into a new buffer
+        if self.frame_native and not (tiled and isinstance(image, Image.Image)):
+            return self.run_frame(image, params)
+        image = as_image(image)
+        return self.run_tiled(image, params) if tiled else self.run(image, params)
 
-class SharpnessFilter(ImageFilter):
     async def apply(self, image: Image.Image, params: dict) -> Image.Image:
+        """Run the filter inline on the calling thread"""
+        return self.run(image, params)
+
+    def validate(self, params: dict):
+        """Raise ValueError if params can't be applied, before any pixels are touched"""
+        pass
+
+    def scale_params(self, params: dict, scale: float) -> dict:
+        """Params for running on a preview proxy scaled by scale; override for pixel-space params"""
+        return params
+
+    def preview_params(self, params: dict) -> dict:
+        """Params for a preview render; override to trade quality for speed"""
+        return params
+
+def scale_pixels(params: dict, keys, scale: float) -> dict:
+    """Copy of params with the given pixel measurements scaled, at least 1px for sizes"""
+    scaled = dict(params)
+    for key in keys:
+        if key in scaled:
+            scaled[key] = round(scaled[key] * scale)
+    for key in ('width', 'height'):
+        if key in scaled:
+            scaled[key] = max(1, scaled[key])
+    return scaled
+
+class ValueFilter(ImageFilter):
+    """Base for slider filters driven by a single 'value' param"""
+    def validate(self, params: dict):
+        check_number(params, 'value', minimum=-1)
+
+class ExposureFilter(ValueFilter):
+    resolution_independent = True
+    tile_overlap = 0
+    frame_native = True
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return apply_curve(image, [('exposure', params.get('value', 0))])
+
+    def run_frame(self, image: ImageLike, params: dict) -> ImageLike:
+        return tone_curve(image, [('exposure', params.get('value', 0))])
+
+class HighlightsFilter(ValueFilter):
+    resolution_independent = True
+    tile_overlap = 0
+    frame_native = True
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return apply_curve(image, [('highlights', params.get('value', 0))])
+
+    def run_frame(self, image: ImageLike, params: dict) -> ImageLike:
+        return tone_curve(image, [('highlights', params.get('value', 0))])
+
+class ShadowsFilter(ValueFilter):
+    resolution_independent = True
+    tile_overlap = 0
+    frame_native = True
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return apply_curve(image, [('shadows', params.get('value', 0))])
+
+    def run_frame(self, image: ImageLike, params: dict) -> ImageLike:
+        return tone_curve(image, [('shadows', params.get('value', 0))])
+
+class ToneCurveFilter(ImageFilter):
+    """Consecutive exposure/highlights/shadows steps fused into one lookup pass"""
+    resolution_independent = True
+    tile_overlap = 0
+    frame_native = True
+
+    def steps(self, params: dict) -> list:
+        return [(step['operation'], step.get('params', {}).get('value', 0)) for step in params['steps']]
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return apply_curve(image, self.steps(params))
+
+    def run_frame(self, image: ImageLike, params: dict) -> ImageLike:
+        return tone_curve(image, self.steps(params))
+
+class SharpnessFilter(ValueFilter):
+    # ImageEnhance.Sharpness blends with a 3x3 smoothing kernel
+    tile_overlap = 1
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
         value = params.get('value', 0)
         enhancer = ImageEnhance.Sharpness(image)
         return enhancer.enhance(1 + value)
 
-class RotateFilter(ImageFilter):
-    async def apply(self, image: Image.Image, params: dict) -> Image.Image:
-        angle = params.get('angle', 0)
-        return image.rotate(angle, expand=True)
+class GeometryFilter(ImageFilter):
+    """Consecutive rotate/flip/crop/resize steps composed into one transform (see geometry.py)"""
+    frame_native = True
+    modes = ('L', 'LA', 'RGB', 'RGBA')
 
-class FlipFilter(ImageFilter):
-    async def apply(self, image: Image.Image, params: dict) -> Image.Image:
-        flip_x = params.get('flipX', False)
-        if flip_x:
-            return image.transpose(Image.FLIP_LEFT_RIGHT)
-        return image
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return as_image(self.run_frame(image, params))
+
+    def run_frame(self, image: ImageLike, params: dict) -> ImageLike:
+        return transform(image, params['steps'])
+
+class SingleGeometryFilter(GeometryFilter):
+    """One geometric step; quarter turns, flips and crops are views of a Frame"""
+    operation = None
+
+    def run_frame(self, image: ImageLike, params: dict) -> ImageLike:
+        return transform(image, [{'operation': self.operation, 'params': params}])
+
+class RotateFilter(SingleGeometryFilter):
+    operation = 'rotate'
+
+    def validate(self, params: dict):
+        check_number(params, 'angle')
+
+class FlipFilter(SingleGeometryFilter):
+    operation = 'flip'
+    resolution_independent = True
+
+class CropFilter(SingleGeometryFilter):
+    operation = 'crop'
+
+    def validate(self, params: dict):
+        check_number(params, 'x', minimum=0)
+        check_number(params, 'y', minimum=0)
+        check_number(params, 'width', minimum=1)
+        check_number(params, 'height', minimum=1)
+
+    def scale_params(self, params: dict, scale: float) -> dict:
+        return scale_pixels(params, ('x', 'y', 'width', 'height'), scale)
+
+    def box(self, params: dict, size) -> tuple:
+        return crop_box(params, size)
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        return image.crop(self.box(params, image.size))
+
+def load_session(model_name: str):
+    session = create_session(model_name)
+    if settings.INFERENCE_BATCH_MAX_SIZE > 1:
+        session = InferenceBatcher(session)
+    return session
 
 class RemoveBackgroundFilter(ImageFilter):
-    def __init__(self):
+    def __init__(self, model_name: str = None):
         self.cache = ImageCache()
-        self.session = None
-        try:
-            from rembg import new_session
-            self.session = new_session(model_name="u2net_human_seg")
-        except Exception as e:
-            print(f"Failed to initialize GPU session: {e}")
+        # Quality tier, used unless a step names a model; previews use the fast tier
+        self.model_name = model_name or settings.REMBG_MODEL
+        # Loaded by warmup() or the first request, so constructing the filter
+        # doesn't import onnxruntime or download a model
+        self.sessions = SessionPool(load_session)
 
-    async def apply(self, image: Image.Image, params: dict) -> Image.Image:
-        # Convert image to bytes for caching
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        img_bytes = img_byte_arr.getvalue()
-        
-        # Check cache
-        cache_key = self.cache.get_cache_key(img_bytes)
-        cached_image = self.cache.get_cached_image(cache_key)
-        if cached_image:
+    def warmup(self) -> bool:
+        """Load both tiers' models and run a dummy inference so the first request doesn't pay for graph setup"""
+        ready = True
+        for model_name in dict.fromkeys([self.model_name, settings.SEGMENTATION_FAST_MODEL]):
+            try:
+                session = self.sessions.get(model_name)
+            except Exception as e:
+                print(f"Failed to initialize {model_name} session: {e}")
+                ready = False
+                continue
+            session.predict(Image.new('RGB', (320, 320)))
+        return ready
+
+    def validate(self, params: dict):
+        quality = params.get('quality', settings.BG_REMOVAL_QUALITY)
+        if quality not in QUALITY_TIERS:
+            raise ValueError(f"'quality' must be one of {', '.join(QUALITY_TIERS)}, got {quality!r}")
+        model = params.get('model', 'auto')
+        if model != 'auto' and model not in available_models():
+            raise ValueError(f"'model' must be 'auto' or one of {', '.join(available_models())}, got {model!r}")
+
+    def preview_params(self, params: dict) -> dict:
+        if params.get('model', 'auto') != 'auto':
+            return params
+        return {**params, 'model': settings.SEGMENTATION_FAST_MODEL}
+
+    def model_for(self, params: dict) -> str:
+        model = params.get('model', 'auto')
+        return self.model_name if model == 'auto' else model
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        quality = params.get('quality', settings.BG_REMOVAL_QUALITY)
+
+        # The processor tags images with a key derived from the upload bytes;
+        # without one, hash the raw pixels rather than paying for a PNG encode
+        source_key = image.info.get('content_key') or content_key(image.tobytes())
+        model = self.model_for(params)
+        # Keyed by the resolved model, so 'auto' and naming the same model share entries
+        options = {key: value for key, value in params.items() if key != 'model'}
+        cache_key = self.cache.make_key(source_key, model, {**options, 'quality': quality})
+        with stage("cache_lookup", "remove_background"):
+            cached_image = self.cache.get(cache_key, source=image)
+        if cached_image is not None:
             return cached_image
 
-        # Process image if not cached
-        max_size = 1500
-        orig_size = image.size
-        if max(image.size) > max_size:
-            ratio = max_size / max(image.size)
-            new_size = tuple(int(dim * ratio) for dim in image.size)
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        if self.session:
-            output = remove(img_bytes, session=self.session)
-        else:
-            output = remove(img_bytes)
-        
-        result = Image.open(io.BytesIO(output))
-        
-        if max(image.size) > max_size:
-            result = result.resize(orig_size, Image.Resampling.LANCZOS)
-        
+        # The model runs on a proxy at its input size; the mask is upsampled
+        # and applied to the full-resolution image in memory
+        result = cutout(self.sessions.get(model), image, quality)
+
         # Cache the result
-        self.cache.cache_image(cache_key, result)
+        self.cache.put(cache_key, result)
         
         return result
 
-class ResizeFilter(ImageFilter):
-    async def apply(self, image: Image.Image, params: dict) -> Image.Image:
-        width = params.get('width', image.width)
-        height = params.get('height', image.height)
-        
-        # Calculate new dimensions maintaining aspect ratio
-        aspect_ratio = image.width / image.height
-        if width / height > aspect_ratio:
-            width = int(height * aspect_ratio)
-        else:
-            height = int(width / aspect_ratio)
-            
-        # Set DPI to 300
-        dpi = (300, 300)
-        
+class ResizeFilter(SingleGeometryFilter):
+    operation = 'resize'
+
+    def validate(self, params: dict):
+        check_number(params, 'width', minimum=1)
+        check_number(params, 'height', minimum=1)
+        check_number(params, 'max_bytes', minimum=1024)
+
+    def scale_params(self, params: dict, scale: float) -> dict:
+        return scale_pixels(params, ('width', 'height'), scale)
+
+    def output_size(self, params: dict, size) -> tuple:
+        return fit_size(params, size)
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
         # Resize image with high-quality resampling
-        resized = image.resize((width, height), Image.Resampling.LANCZOS)
-        resized.info['dpi'] = dpi
-        
-        # Optimize file size
-        buffer = io.BytesIO()
-        
-        # Try different quality settings until file size is < 1MB
-        quality = 95
-        while quality > 50:  # Don't go below quality of 50
-            buffer.seek(0)
-            buffer.truncate()
-            resized.save(buffer, 
-                        format='PNG', 
-                        optimize=True, 
-                        quality=quality)
-            if buffer.tell() < 1024 * 1024:  # Less than 1MB
-                break
-            quality -= 5
-        
-        buffer.seek(0)
-        optimized = Image.open(buffer)
-        optimized.info['dpi'] = dpi
-        
-        return optimized
+        resized = image.resize(self.output_size(params, image.size), Image.Resampling.LANCZOS)
+
+        # 300 DPI, and the byte budget the encode stage searches for the best
+        # encoding under, so the pixels are never re-encoded and decoded here
+        resized.info.update(resize_info(params))
+        return resized
 
 class WhiteBackgroundFilter(ImageFilter):
-    async def apply(self, image: Image.Image, params: dict) -> Image.Image:
+    resolution_independent = True
+    tile_overlap = 0
+    modes = ('L', 'LA', 'RGB', 'RGBA')
+
+    def run(self, image: Image.Image, params: dict) -> Image.Image:
+        # Nothing to composite without an alpha channel
+        if image.mode in ('RGB', 'L'):
+            return image.convert('RGB') if image.mode == 'L' else image
+
         # Convert to RGBA if not already
         if image.mode != 'RGBA':
             image = image.convert('RGBA')
@@ -164,3 +306,21 @@ class WhiteBackgroundFilter(ImageFilter):
         
         # Convert back to RGB
         return composite.convert('RGB')
+
+FILTER_CLASSES = {
+    'exposure': ExposureFilter,
+    'highlights': HighlightsFilter,
+    'shadows': ShadowsFilter,
+    'sharpness': SharpnessFilter,
+    'rotate': RotateFilter,
+    'flip': FlipFilter,
+    'crop': CropFilter,
+    'remove_background': RemoveBackgroundFilter,
+    'resize': ResizeFilter,
+    'white_background': WhiteBackgroundFilter
+}
+
+def create_filters(names=None) -> dict:
+    """Instantiate the filter registry, or only the named filters"""
+    names = names or FILTER_CLASSES.keys()
+    return {name: FILTER_CLASSES[name]() for name in names}
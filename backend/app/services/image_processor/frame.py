@@ -0,0 +1,141 @@
+"""NumPy-backed image container passed between filters.
+
+Pillow stores RGB as four bytes per pixel, so every PIL -> NumPy -> PIL round
+trip costs two full-frame copies. Filters whose work is NumPy/OpenCV anyway
+(the tone curves, crop) accept and return a ``Frame`` and the pipeline keeps
+it until a filter that needs Pillow, or the encoder, asks for an image. A
+``Frame`` carries the mode and the ``info`` dict (content key, DPI, byte
+budget), and answers the ``size``/``width``/``getbands()`` questions the
+processor, caches and stores ask, so it flows wherever an image does.
+
+Pixels are copy-on-write. A frame that is shared (memoized, stored in an
+edit session) is frozen, and in-place filters then write into a fresh
+buffer instead; an exclusively owned frame is updated where it is.
+
+Process pool workers get frames through POSIX shared memory: the parent
+copies the pixels into a segment once, the worker maps it without copying,
+and the result comes back the same way instead of being pickled.
+"""
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Union
+from PIL import Image
+import numpy as np
+
+# Modes a frame holds as uint8 arrays; anything else is converted on the way in
+FRAME_MODES = ('L', 'RGB', 'RGBA')
+
+class Frame:
+    def __init__(self, pixels: np.ndarray, mode: str, info: dict = None):
+        self.pixels = pixels
+        self.mode = mode
+        self.info = info if info is not None else {}
+
+    @classmethod
+    def from_image(cls, image: Image.Image) -> 'Frame':
+        """One copy out of Pillow; the result is read-only until something writes to it"""
+        if image.mode not in FRAME_MODES:
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        return cls(np.asarray(image), image.mode, dict(image.info))
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    @property
+    def size(self) -> tuple:
+        return self.width, self.height
+
+    def getbands(self) -> tuple:
+        return tuple(self.mode)
+
+    @property
+    def writable(self) -> bool:
+        return self.pixels.flags.writeable
+
+    def target(self) -> np.ndarray:
+        """Buffer for a same-shaped result: the pixels themselves when this frame may be changed in place"""
+        if self.writable and self.pixels.flags.c_contiguous:
+            return self.pixels
+        return np.empty(self.pixels.shape, np.uint8)
+
+    def with_pixels(self, pixels: np.ndarray, mode: str = None) -> 'Frame':
+        if pixels is self.pixels and (mode or self.mode) == self.mode:
+            return self
+        return Frame(pixels, mode or self.mode, dict(self.info))
+
+    def freeze(self):
+        self.pixels.flags.writeable = False
+
+    def to_image(self) -> Image.Image:
+        """Pillow image for encoding or a Pillow-only filter; L and RGBA map the buffer without copying"""
+        image = Image.fromarray(np.ascontiguousarray(self.pixels), self.mode)
+        image.info = dict(self.info)
+        return image
+
+ImageLike = Union[Image.Image, Frame]
+
+def as_frame(image: ImageLike) -> Frame:
+    return image if isinstance(image, Frame) else Frame.from_image(image)
+
+def as_image(image: ImageLike) -> Image.Image:
+    return image.to_image() if isinstance(image, Frame) else image
+
+def freeze(image: ImageLike):
+    """Protect a shared frame from in-place filters (Pillow images are never changed in place)"""
+    if isinstance(image, Frame):
+        image.freeze()
+
+class SharedFrame:
+    """Picklable handle to a frame held in a shared memory segment"""
+    def __init__(self, name: str, shape: tuple, mode: str, info: dict):
+        self.name = name
+        self.shape = shape
+        self.mode = mode
+        self.info = info
+
+def share(image: ImageLike) -> SharedFrame:
+    """Copy pixels into a new segment; whoever ends up with the handle must release() it"""
+    frame = as_frame(image)
+    pixels = frame.pixels
+    segment = shared_memory.SharedMemory(create=True, size=max(1, pixels.nbytes))
+    try:
+        np.ndarray(pixels.shape, np.uint8, buffer=segment.buf)[...] = pixels
+    finally:
+        segment.close()
+    return SharedFrame(segment.name, pixels.shape, frame.mode, dict(frame.info))
+
+@contextmanager
+def attach(shared: SharedFrame):
+    """Map a shared frame without copying; the frame is only valid inside the block"""
+    segment = shared_memory.SharedMemory(name=shared.name)
+    frame = Frame(np.ndarray(shared.shape, np.uint8, buffer=segment.buf), shared.mode, dict(shared.info))
+    try:
+        yield frame
+    finally:
+        frame.pixels = None
+        try:
+            segment.close()
+        except BufferError:
+            # Something still maps the buffer; it is unmapped when that is collected
+            pass
+
+def release(shared: SharedFrame):
+    try:
+        segment = shared_memory.SharedMemory(name=shared.name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
+
+def receive(shared: SharedFrame) -> Frame:
+    """Copy a worker's result out of its segment and free the segment"""
+    try:
+        with attach(shared) as frame:
+            return Frame(frame.pixels.copy(), frame.mode, frame.info)
+    finally:
+        release(shared)
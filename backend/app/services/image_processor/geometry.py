@@ -0,0 +1,389 @@
+"""Fused geometric transforms for the rotate, flip, crop and resize filters.
+
+Each of these ops maps one pixel grid onto another with an affine map, so a
+run of them composes into one matrix (kept as output -> source, the form a
+resampler wants) and a final size. ``plan`` splits a run into segments that
+each cost at most one resampling pass:
+
+* crops, flips and quarter turns are exact and move no pixels: on a
+  ``Frame`` they end up as NumPy views, on a Pillow image as one crop and
+  one transpose;
+* a resize reads only the source window left by the crops before it and
+  resamples it straight to the part the crops after it keep (Pillow's
+  ``resize(box=...)``); flips are applied to the small result;
+* an arbitrary rotation, with the crops and turns around it, is a single
+  ``Image.transform`` over the crop window.
+
+A second resampling op, or a crop reaching outside the image (which pads
+with black), starts a new segment. Results are the pixels running the
+filters one by one gives, up to floating point rounding: an occasional
+level after a resize, and for an arbitrary rotation sometimes the
+neighbouring source pixel along the edges of the sampling grid.
+
+``jpeg_transform`` is the lossless counterpart for JPEG in, JPEG out chains
+of crops, flips and quarter turns: jpegtran rearranges the DCT blocks, so
+nothing is decoded or re-encoded.
+"""
+from typing import List, Optional
+import io
+import logging
+import math
+import shutil
+import subprocess
+from PIL import Image
+import numpy as np
+from app.core.config import settings
+from .frame import Frame, ImageLike, as_image
+
+GEOMETRY_OPERATIONS = ('rotate', 'flip', 'crop', 'resize')
+
+# (swap axes, mirror x, mirror y), applied in that order -> Pillow transpose
+TRANSPOSES = {
+    (False, True, False): Image.Transpose.FLIP_LEFT_RIGHT,
+    (False, False, True): Image.Transpose.FLIP_TOP_BOTTOM,
+    (False, True, True): Image.Transpose.ROTATE_180,
+    (True, False, False): Image.Transpose.TRANSPOSE,
+    (True, False, True): Image.Transpose.ROTATE_90,
+    (True, True, False): Image.Transpose.ROTATE_270,
+    (True, True, True): Image.Transpose.TRANSVERSE,
+}
+# Same transforms as jpegtran options (jpegtran rotates clockwise)
+JPEGTRAN_TRANSPOSES = {
+    (False, True, False): ['-flip', 'horizontal'],
+    (False, False, True): ['-flip', 'vertical'],
+    (False, True, True): ['-rotate', '180'],
+    (True, False, False): ['-transpose'],
+    (True, False, True): ['-rotate', '270'],
+    (True, True, False): ['-rotate', '90'],
+    (True, True, True): ['-transverse'],
+}
+IDENTITY = (False, False, False)
+# Pillow's Lanczos kernel radius, in source pixels per output pixel
+LANCZOS_SUPPORT = 3
+
+def crop_box(params: dict, size) -> tuple:
+    x = params.get('x', 0)
+    y = params.get('y', 0)
+    width = params.get('width', size[0] - x)
+    height = params.get('height', size[1] - y)
+    return x, y, x + width, y + height
+
+def fit_size(params: dict, size) -> tuple:
+    """Largest size with the image's aspect ratio that fits the requested box"""
+    box_width = width = params.get('width', size[0])
+    box_height = height = params.get('height', size[1])
+
+    aspect_ratio = size[0] / size[1]
+    if width / height > aspect_ratio:
+        width = int(height * aspect_ratio)
+    else:
+        height = int(width / aspect_ratio)
+
+    # A box that already has the image's aspect ratio up to rounding is kept,
+    # so a source decoded at reduced size resizes to the same pixel size
+    if abs(box_width - width) <= 1 and abs(box_height - height) <= 1:
+        return box_width, box_height
+    return width, height
+
+def resize_info(params: dict) -> dict:
+    """What a resize records for the encoder: 300 DPI and the byte budget to search under"""
+    return {
+        'dpi': (300, 300),
+        'max_bytes': params.get('max_bytes', settings.RESIZE_MAX_BYTES),
+        'lossy_fallback': params.get('lossy_fallback', True)
+    }
+
+def _matrix(a, b, c, d, e, f) -> np.ndarray:
+    return np.array([[a, b, c], [d, e, f], [0, 0, 1]], dtype=np.float64)
+
+def rotation(angle: float, size) -> tuple:
+    """Output -> input matrix and size of Image.rotate(angle, expand=True); exact for quarter turns"""
+    angle = angle % 360.0
+    w, h = size
+    if angle == 0:
+        return np.eye(3), size, True
+    if angle == 90:
+        return _matrix(0, -1, w, 1, 0, 0), (h, w), True
+    if angle == 180:
+        return _matrix(-1, 0, w, 0, -1, h), size, True
+    if angle == 270:
+        return _matrix(0, 1, 0, -1, 0, h), (h, w), True
+
+    # Pillow's own construction, so sizes and sampling positions agree with it
+    radians = -math.radians(angle)
+    cos, sin = round(math.cos(radians), 15), round(math.sin(radians), 15)
+    matrix = [cos, sin, 0.0, -sin, cos, 0.0]
+
+    def transform(x, y):
+        return matrix[0] * x + matrix[1] * y + matrix[2], matrix[3] * x + matrix[4] * y + matrix[5]
+
+    matrix[2], matrix[5] = transform(-w / 2, -h / 2)
+    matrix[2] += w / 2
+    matrix[5] += h / 2
+    xs, ys = zip(*(transform(x, y) for x, y in ((0, 0), (w, 0), (w, h), (0, h))))
+    nw = math.ceil(max(xs)) - math.floor(min(xs))
+    nh = math.ceil(max(ys)) - math.floor(min(ys))
+    matrix[2], matrix[5] = transform(-(nw - w) / 2.0, -(nh - h) / 2.0)
+    return _matrix(*matrix), (nw, nh), False
+
+def _orientation(inverse: np.ndarray) -> tuple:
+    """(swap, mirror x, mirror y) of an axis-aligned output -> input matrix"""
+    # The forward map is a signed permutation after a positive scale, so its
+    # signs are the transpose of the inverse's
+    signs = np.sign(np.round(inverse[:2, :2], 9)).T
+    swap = signs[0, 0] == 0
+    if swap:
+        signs = signs[:, ::-1]
+    return bool(swap), bool(signs[0, 0] < 0), bool(signs[1, 1] < 0)
+
+def _inside(box: tuple, size) -> bool:
+    return box[0] >= 0 and box[1] >= 0 and box[2] <= size[0] and box[3] <= size[1]
+
+def _region(image: ImageLike, box: tuple) -> ImageLike:
+    if box == (0, 0) + tuple(image.size):
+        return image
+    left, top, right, bottom = box
+    if isinstance(image, Frame):
+        return image.with_pixels(image.pixels[top:bottom, left:right])
+    return image.crop(box)
+
+def _transpose(image: ImageLike, orientation: tuple) -> ImageLike:
+    if orientation == IDENTITY:
+        return image
+    if not isinstance(image, Frame):
+        return image.transpose(TRANSPOSES[orientation])
+    swap, mirror_x, mirror_y = orientation
+    pixels = image.pixels.swapaxes(0, 1) if swap else image.pixels
+    if mirror_x:
+        pixels = pixels[:, ::-1]
+    if mirror_y:
+        pixels = pixels[::-1]
+    return image.with_pixels(pixels)
+
+def _forward(orientation: tuple, size) -> np.ndarray:
+    """Matrix taking coordinates in an image of the given size to the transposed image's"""
+    swap, mirror_x, mirror_y = orientation
+    width, height = size[::-1] if swap else size
+    matrix = _matrix(0, 1, 0, 1, 0, 0) if swap else np.eye(3)
+    if mirror_x:
+        matrix = _matrix(-1, 0, width, 0, 1, 0) @ matrix
+    if mirror_y:
+        matrix = _matrix(1, 0, 0, 0, -1, height) @ matrix
+    return matrix
+
+class Segment:
+    """Crops, flips and quarter turns around at most one resize or arbitrary rotation"""
+
+    def __init__(self, size):
+        self.inverse = np.eye(3)
+        self.size = tuple(size)
+        # 'resize' or 'rotate', and the source window it reads
+        self.resample = None
+        self.window = None
+        self.turned = IDENTITY
+        self.info = {}
+
+    def _then(self, matrix: np.ndarray, size):
+        self.inverse = self.inverse @ matrix
+        self.size = tuple(size)
+
+    def source_box(self) -> tuple:
+        """Integer source rectangle the output covers (exact while nothing is resampled)"""
+        w, h = self.size
+        corners = self.inverse @ np.array([[0, w, 0, w], [0, 0, h, h], [1, 1, 1, 1]], dtype=np.float64)
+        left, top = np.floor(np.round(corners[:2].min(axis=1), 6)).astype(int)
+        right, bottom = np.ceil(np.round(corners[:2].max(axis=1), 6)).astype(int)
+        return int(left), int(top), int(right), int(bottom)
+
+    def _start(self, kind: str) -> bool:
+        if self.resample:
+            return False
+        self.resample = kind
+        self.window = self.source_box()
+        # How the window is turned when the resampling op sees it
+        self.turned = _orientation(self.inverse)
+        return True
+
+    def crop(self, box: tuple):
+        self._then(_matrix(1, 0, box[0], 0, 1, box[1]), (box[2] - box[0], box[3] - box[1]))
+
+    def flip(self):
+        self._then(_matrix(-1, 0, self.size[0], 0, 1, 0), self.size)
+
+    def rotate(self, angle: float) -> bool:
+        matrix, size, exact = rotation(angle, self.size)
+        if not exact and not self._start('rotate'):
+            return False
+        self._then(matrix, size)
+        return True
+
+    def resize(self, params: dict) -> bool:
+        if not self._start('resize'):
+            return False
+        width, height = fit_size(params, self.size)
+        self._then(_matrix(self.size[0] / width, 0, 0, 0, self.size[1] / height, 0), (width, height))
+        self.info.update(resize_info(params))
+        return True
+
+    def lossless(self) -> Optional[tuple]:
+        """(source box, orientation) when the segment only moves whole pixels"""
+        if self.resample:
+            return None
+        return self.source_box(), _orientation(self.inverse)
+
+    def apply(self, image: ImageLike) -> ImageLike:
+        window = self.window or self.source_box()
+        region = _region(image, window)
+        # Output -> coordinates within the window
+        inverse = _matrix(1, 0, -window[0], 0, 1, -window[1]) @ self.inverse
+        orientation = _orientation(inverse) if self.resample != 'rotate' else IDENTITY
+
+        if self.resample == 'rotate':
+            result = as_image(region).transform(
+                self.size, Image.Transform.AFFINE, tuple(inverse[:2].ravel()),
+                # Image.rotate's default, and several times faster than bicubic
+                Image.Resampling.NEAREST
+            )
+        elif self.resample == 'resize':
+            result, orientation = self._resize(region, inverse)
+        else:
+            result = region
+        result = _transpose(result, orientation)
+        if self.info:
+            result.info.update(self.info)
+        return result
+
+    def _box(self, inverse: np.ndarray) -> np.ndarray:
+        corners = inverse @ np.array([[0, self.size[0]], [0, self.size[1]], [1, 1]], dtype=np.float64)
+        return np.concatenate([corners[:2].min(axis=1), corners[:2].max(axis=1)])
+
+    def _resize(self, region: ImageLike, inverse: np.ndarray) -> tuple:
+        """Resample the part of the window the output covers; returns it and the turn still to apply"""
+        box = self._box(inverse)
+        # Only the box and the Lanczos support around it are read
+        scale = max(1.0, (box[2] - box[0]) / self.size[0], (box[3] - box[1]) / self.size[1])
+        reach = LANCZOS_SUPPORT * scale + 1
+        left, top = (max(0, math.floor(value - reach)) for value in box[:2])
+        right = min(region.width, math.ceil(box[2] + reach))
+        bottom = min(region.height, math.ceil(box[3] + reach))
+        # Pillow from here: its transpose is faster than copying a NumPy view out
+        region = as_image(_region(region, (left, top, right, bottom)))
+        inverse = _matrix(1, 0, -left, 0, 1, -top) @ inverse
+
+        if self.turned[0]:
+            # Pillow resamples rows before columns and clips in between, so
+            # the axes are swapped first, like the separate steps do
+            inverse = _forward(self.turned, region.size) @ inverse
+            region = _transpose(region, self.turned)
+        orientation = _orientation(inverse)
+
+        box = self._box(inverse)
+        box = (max(0.0, box[0]), max(0.0, box[1]),
+               min(float(region.width), box[2]), min(float(region.height), box[3]))
+        # Mirroring, and turns after the resize, are done on the smaller result
+        size = self.size[::-1] if orientation[0] else self.size
+        return region.resize(size, Image.Resampling.LANCZOS, box=box), orientation
+
+class PaddedCrop:
+    """A crop reaching outside the image; the part outside is black, like Image.crop"""
+
+    def __init__(self, box: tuple):
+        self.box = box
+        self.size = (box[2] - box[0], box[3] - box[1])
+
+    def apply(self, image: ImageLike) -> ImageLike:
+        if not isinstance(image, Frame):
+            return image.crop(self.box)
+        left, top, right, bottom = self.box
+        out = np.zeros((bottom - top, right - left) + image.pixels.shape[2:], np.uint8)
+        # Where the frame and the box overlap, in frame and in box coordinates
+        x0, y0 = max(left, 0), max(top, 0)
+        x1, y1 = min(right, image.width), min(bottom, image.height)
+        if x1 > x0 and y1 > y0:
+            out[y0 - top:y1 - top, x0 - left:x1 - left] = image.pixels[y0:y1, x0:x1]
+        return image.with_pixels(out)
+
+def plan(steps: List[dict], size) -> list:
+    """Segments that apply the steps to an image of the given size"""
+    segments = []
+    segment = Segment(size)
+    for step in steps:
+        operation, params = step['operation'], step.get('params', {})
+        if operation == 'crop':
+            box = crop_box(params, segment.size)
+            if _inside(box, segment.size):
+                segment.crop(box)
+                continue
+            padded = PaddedCrop(box)
+            segments += [segment, padded]
+            segment = Segment(padded.size)
+        elif operation == 'flip':
+            if params.get('flipX', False):
+                segment.flip()
+        elif operation == 'rotate':
+            if not segment.rotate(params.get('angle', 0)):
+                segments.append(segment)
+                segment = Segment(segment.size)
+                segment.rotate(params.get('angle', 0))
+        elif operation == 'resize':
+            if not segment.resize(params):
+                segments.append(segment)
+                segment = Segment(segment.size)
+                segment.resize(params)
+        else:
+            raise ValueError(f"Not a geometric operation: {operation}")
+    segments.append(segment)
+    return segments
+
+def transform(image: ImageLike, steps: List[dict]) -> ImageLike:
+    """Apply a run of geometric steps with the fewest copies and resampling passes"""
+    for segment in plan(steps, image.size):
+        image = segment.apply(image)
+    return image
+
+def jpeg_transform(data: bytes, steps: List[dict]) -> Optional[bytes]:
+    """The steps applied losslessly to a JPEG with jpegtran, or None if they can't be.
+
+    That takes JPEG_LOSSLESS_TRANSFORMS, a jpegtran binary, steps that only
+    crop, flip and turn by quarter turns, a crop starting on an MCU boundary
+    and, for flips and turns, an image made of whole MCUs.
+    """
+    jpegtran = settings.JPEG_LOSSLESS_TRANSFORMS and shutil.which(settings.JPEGTRAN_PATH)
+    if not jpegtran or any(step['operation'] not in GEOMETRY_OPERATIONS for step in steps):
+        return None
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Exception:
+        return None
+    if image.format != 'JPEG' or image.mode not in ('L', 'RGB'):
+        return None
+    segments = plan(steps, image.size)
+    if len(segments) != 1 or segments[0].lossless() is None:
+        return None
+    (left, top, right, bottom), orientation = segments[0].lossless()
+
+    # MCU size from the largest sampling factors of the frame's components
+    mcu_x = 8 * max(component[1] for component in image.layer)
+    mcu_y = 8 * max(component[2] for component in image.layer)
+    if left % mcu_x or top % mcu_y:
+        return None
+    try:
+        if (left, top, right, bottom) != (0, 0) + image.size:
+            data = _jpegtran(jpegtran, ['-crop', f'{right - left}x{bottom - top}+{left}+{top}'], data)
+        if orientation != IDENTITY:
+            # -perfect fails instead of dropping partial edge blocks
+            data = _jpegtran(jpegtran, ['-perfect'] + JPEGTRAN_TRANSPOSES[orientation], data)
+    except subprocess.CalledProcessError:
+        # Usually -perfect refusing partial blocks
+        return None
+    except (subprocess.SubprocessError, OSError) as e:
+        logging.warning(f"Lossless JPEG transform failed, re-encoding instead: {e}")
+        return None
+    if Image.open(io.BytesIO(data)).size != segments[0].size:
+        return None
+    return data
+
+def _jpegtran(jpegtran: str, args: list, data: bytes) -> bytes:
+    completed = subprocess.run([jpegtran, '-copy', 'none'] + args, input=data, capture_output=True,
+                               timeout=30, check=True)
+    return completed.stdout
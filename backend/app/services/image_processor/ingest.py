@@ -0,0 +1,143 @@
+"""Upload ingestion: judge an upload by its header before reading its pixels.
+
+Starlette's multipart parser already streams each file part into a
+SpooledTemporaryFile (in memory up to 1 MB, a temp file beyond), so the body
+is never held in memory as a whole unless a route calls ``read()``. Here the
+spooled file is checked instead: its size, then the format and dimensions
+from Pillow's header parse, which reads a few KB. Oversize, unsupported or
+over-pixel-budget uploads are rejected before anything is decoded, so a
+decompression bomb or a 200 MP TIFF costs a header read.
+
+Accepted uploads are handed to the decoder as an ``UploadSource``: small
+ones as their bytes, spooled-to-disk ones as a read-only memory map of the
+temp file, which the page cache backs instead of another heap copy.
+"""
+import io
+import mmap
+import threading
+import warnings
+from PIL import Image, UnidentifiedImageError
+from app.core.config import settings
+
+class UploadRejected(ValueError):
+    """An upload refused from its size or header, with the HTTP status to answer"""
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+class UploadSource(io.RawIOBase):
+    """Seekable read-only file over a buffer, with BytesIO's getbuffer()/getvalue().
+
+    A computation that may outlive its request (one other requests coalesce
+    onto) retain()s the source, and close() waits for its release().
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.position = 0
+        # The request closes from a worker thread, holders release on the event loop
+        self.lock = threading.Lock()
+        self.holds = 0
+        self.close_requested = False
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self.view) if size is None or size < 0 else min(len(self.view), self.position + size)
+        data = self.view[self.position:end].tobytes()
+        self.position = max(self.position, end)
+        return data
+
+    def readinto(self, target) -> int:
+        data = self.read(len(target))
+        target[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.view)}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def getbuffer(self) -> memoryview:
+        return self.view
+
+    def getvalue(self) -> bytes:
+        return self.view.tobytes()
+
+    def retain(self):
+        with self.lock:
+            self.holds += 1
+
+    def release(self):
+        with self.lock:
+            self.holds -= 1
+            deferred = self.holds == 0 and self.close_requested
+        if deferred:
+            self.close()
+
+    def close(self):
+        with self.lock:
+            if self.holds:
+                self.close_requested = True
+                return
+        if self.closed:
+            return
+        super().close()
+        try:
+            self.view.release()
+            if isinstance(self.buffer, mmap.mmap):
+                self.buffer.close()
+        except BufferError:
+            # Something still maps the buffer; it is unmapped when that is collected
+            pass
+
+def sniff(file) -> tuple:
+    """(format, size) from the image header; reads no pixel data"""
+    file.seek(0)
+    try:
+        # Opening a file object only parses the header, and never closes the file.
+        # MAX_UPLOAD_PIXELS is checked next, so Pillow's lower warning threshold is noise
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            image = Image.open(file)
+        return image.format, image.size
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(str(e), 413)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise UploadRejected("Upload is not a recognised image", 415)
+    finally:
+        file.seek(0)
+
+def check_image(format: str, size) -> None:
+    """Reject formats outside UPLOAD_FORMATS and images over MAX_UPLOAD_PIXELS"""
+    if format not in settings.UPLOAD_FORMATS:
+        raise UploadRejected(f"Unsupported image format: {format}", 415)
+    pixels = size[0] * size[1]
+    if pixels > settings.MAX_UPLOAD_PIXELS:
+        raise UploadRejected(
+            f"Image is {size[0]}x{size[1]} ({pixels} pixels), the limit is {settings.MAX_UPLOAD_PIXELS}",
+            413
+        )
+
+def ingest(file) -> UploadSource:
+    """Check a spooled upload from its header, then map or read it for the decoder"""
+    file.seek(0, io.SEEK_END)
+    size = file.tell()
+    if size == 0:
+        raise UploadRejected("Upload is empty", 400)
+    if size > settings.MAX_UPLOAD_BYTES:
+        raise UploadRejected(f"Upload is {size} bytes, the limit is {settings.MAX_UPLOAD_BYTES}", 413)
+    check_image(*sniff(file))
+
+    # SpooledTemporaryFile keeps small uploads in memory; _rolled means a real temp file
+    if getattr(file, '_rolled', False):
+        return UploadSource(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+    return UploadSource(file.read())
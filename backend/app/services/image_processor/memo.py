@@ -0,0 +1,65 @@
+from PIL import Image
+from app.core.config import settings
+from .cache import image_nbytes
+from .frame import freeze
+
+class IntermediateCache:
+    """Memory-bounded cache of pipeline intermediates keyed by source hash + step prefix.
+
+    Eviction is GreedyDual-Size: an entry's priority is the running inflation
+    value plus cost/size, where cost is the time it took to produce the image
+    from the source. Cheap, large intermediates (a flip of a 24MP photo) go
+    first; expensive ones (a background removal) survive much longer than
+    they would under plain LRU. Hits refresh an entry's priority.
+    """
+
+    def __init__(self, max_bytes: int = None):
+        self.max_bytes = settings.MEMO_CACHE_BYTES if max_bytes is None else max_bytes
+        # key -> [image, cost_ms, nbytes, priority]
+        self.entries = {}
+        self.nbytes = 0
+        self.inflation = 0.0
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "saved_ms": 0.0}
+
+    def _priority(self, cost_ms: float, nbytes: int) -> float:
+        return self.inflation + cost_ms / max(nbytes, 1)
+
+    def lookup(self, keys):
+        """Longest cached prefix of a chain of keys: (index, image, cost_ms), or (-1, None, 0)"""
+        for index in range(len(keys) - 1, -1, -1):
+            entry = self.entries.get(keys[index])
+            if entry is not None:
+                entry[3] = self._priority(entry[1], entry[2])
+                self.counters["hits"] += 1
+                self.counters["saved_ms"] += entry[1]
+                return index, entry[0], entry[1]
+        if keys:
+            self.counters["misses"] += 1
+        return -1, None, 0.0
+
+    def put(self, key: str, image: Image.Image, cost_ms: float):
+        size = image_nbytes(image)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[2]
+        # Later steps must not change a cached frame in place
+        freeze(image)
+        self.entries[key] = [image, cost_ms, size, self._priority(cost_ms, size)]
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            victim = min(self.entries, key=lambda k: self.entries[k][3])
+            _, _, victim_size, priority = self.entries.pop(victim)
+            self.nbytes -= victim_size
+            # Age every remaining entry relative to the evicted one
+            self.inflation = priority
+            self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.nbytes
+        }
@@ -0,0 +1,194 @@
+"""Segmentation model registry and the pool of loaded sessions.
+
+onnxruntime and rembg are imported on first use: together they take over a
+second to import, and only background removal needs them.
+
+A remove_background step may name a model from MODELS; otherwise previews
+use the fast tier (SEGMENTATION_FAST_MODEL) and full-resolution renders the
+quality tier (REMBG_MODEL). Sessions are loaded on first use into a
+SessionPool, which unloads the least recently used ones once their estimated
+memory passes SEGMENTATION_POOL_BYTES.
+
+The -int8 variants are the same networks with their weights quantized to
+8 bits by ONNX Runtime's dynamic quantization, done once from the fp32
+download and saved next to it. They are about a quarter of the size; whether
+they are also faster depends on the CPU's integer dot-product support, which
+``python -m benchmarks segmentation`` measures.
+"""
+from collections import OrderedDict
+import os
+import threading
+from app.core.config import settings
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disabled": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+# Registry name -> (rembg model it is built from, weights quantized to INT8)
+MODELS = {
+    # 4.7 MB, 320px input: the lightweight U2-Net for previews and simple product shots
+    "u2netp": ("u2netp", False),
+    # 43 MB, a pruned U2-Net for general objects
+    "silueta": ("silueta", False),
+    # 176 MB each: general objects, and people
+    "u2net": ("u2net", False),
+    "u2net_human_seg": ("u2net_human_seg", False),
+    # 179 MB, 1024px input: finest edges, slowest
+    "isnet-general-use": ("isnet-general-use", False),
+    # Loaded from a path by rembg's u2net_custom session, which preprocesses
+    # like U2-Net; rembg 2.0.50 has no such session for IS-Net
+    "u2net-int8": ("u2net", True),
+    "u2net_human_seg-int8": ("u2net_human_seg", True),
+}
+
+# A loaded session is estimated at this multiple of its model file: the
+# weights, ONNX Runtime's pre-packed copies of them and its memory arena
+SESSION_MEMORY_FACTOR = 2
+
+def base_model(model_name: str) -> str:
+    """rembg model a registry entry is built from (preprocessing, batch normalisation)"""
+    return MODELS.get(model_name, (model_name, False))[0]
+
+def available_models() -> list:
+    """Names a request may ask for: the registry plus whatever the tiers are configured to"""
+    return list(dict.fromkeys([*MODELS, settings.REMBG_MODEL, settings.SEGMENTATION_FAST_MODEL]))
+
+def build_session_options():
+    """Build ONNX Runtime session options from settings"""
+    import onnxruntime as ort
+
+    level = settings.ONNX_GRAPH_OPTIMIZATION_LEVEL.lower()
+    if level not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unsupported graph optimization level: {level}")
+
+    sess_opts = ort.SessionOptions()
+    sess_opts.intra_op_num_threads = settings.ONNX_INTRA_OP_THREADS
+    sess_opts.inter_op_num_threads = settings.ONNX_INTER_OP_THREADS
+    sess_opts.graph_optimization_level = getattr(ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[level])
+    return sess_opts
+
+def _session_class(rembg_name: str):
+    # rembg imports pymatting, and numba's default TBB threading layer hangs at
+    # interpreter exit when first loaded off the main thread (background warmup).
+    # Only rembg's own alpha matting uses it, which this service doesn't call.
+    os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+    from rembg.sessions import sessions_class
+
+    session_class = next((sc for sc in sessions_class if sc.name() == rembg_name), None)
+    if session_class is None:
+        raise ValueError(f"Unsupported segmentation model: {rembg_name}")
+    return session_class
+
+def quantize_model(source: str, path: str):
+    """Write an INT8 copy of the ONNX model at source to path (needs the onnx package)"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    # Written under a temporary name so another worker never loads half a file
+    partial = f"{path}.{os.getpid()}.partial"
+    quantize_dynamic(source, partial, weight_type=QuantType.QUInt8)
+    os.replace(partial, path)
+
+def quantized_model_path(model_name: str) -> str:
+    """INT8 copy of a registry model's ONNX file, quantized on first use"""
+    base_class = _session_class(base_model(model_name))
+    path = os.path.join(base_class.u2net_home(), f"{model_name}.onnx")
+    if not os.path.exists(path):
+        quantize_model(base_class.download_models(), path)
+    return path
+
+def model_file(model_name: str) -> str:
+    """Path of a model's ONNX file, downloading (and quantizing) it first if needed"""
+    base, quantized = MODELS.get(model_name, (model_name, False))
+    if quantized:
+        return quantized_model_path(model_name)
+    return _session_class(base).download_models()
+
+def create_session(model_name: str):
+    """Load a segmentation session with the configured runtime options"""
+    base, quantized = MODELS.get(model_name, (model_name, False))
+    kwargs = {}
+    if settings.ONNX_EXECUTION_PROVIDERS:
+        kwargs["providers"] = list(settings.ONNX_EXECUTION_PROVIDERS)
+    if quantized:
+        session_class = _session_class("u2net_custom")
+        kwargs["model_path"] = quantized_model_path(model_name)
+    else:
+        session_class = _session_class(base)
+    return session_class(model_name, build_session_options(), **kwargs)
+
+def session_nbytes(session) -> int:
+    """Estimated memory held by a loaded session, 0 when its model file is unknown"""
+    try:
+        return os.path.getsize(session.inner_session._model_path) * SESSION_MEMORY_FACTOR
+    except (AttributeError, OSError, TypeError):
+        return 0
+
+class SessionPool:
+    """Sessions loaded on first use; the least recently used are unloaded past max_bytes.
+
+    The session just loaded is never the one unloaded, so a single model
+    larger than the cap still works. A session unloaded while a request is
+    using it stays alive until that request finishes.
+    """
+
+    def __init__(self, load, max_bytes: int = None):
+        self.load = load
+        self.max_bytes = settings.SEGMENTATION_POOL_BYTES if max_bytes is None else max_bytes
+        # name -> (session, estimated bytes), least recently used first
+        self.sessions = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        # name -> lock held while that model loads, so only its requests wait
+        self.loading = {}
+        self.counters = {"loads": 0, "hits": 0, "evictions": 0}
+
+    def _lookup(self, name: str):
+        entry = self.sessions.get(name)
+        if entry is None:
+            return None
+        self.sessions.move_to_end(name)
+        self.counters["hits"] += 1
+        return entry[0]
+
+    def get(self, name: str):
+        with self.lock:
+            session = self._lookup(name)
+            if session is not None:
+                return session
+            loading = self.loading.setdefault(name, threading.Lock())
+        # A request can arrive while warmup is still loading the same model
+        with loading:
+            with self.lock:
+                session = self._lookup(name)
+            if session is None:
+                # A failed load raises here and is retried by the next request
+                session = self.load(name)
+                self.add(name, session)
+            return session
+
+    def add(self, name: str, session, nbytes: int = None):
+        nbytes = session_nbytes(session) if nbytes is None else nbytes
+        evicted = []
+        with self.lock:
+            if name in self.sessions:
+                self.nbytes -= self.sessions[name][1]
+            self.sessions[name] = (session, nbytes)
+            self.sessions.move_to_end(name)
+            self.nbytes += nbytes
+            self.counters["loads"] += 1
+            while self.nbytes > self.max_bytes and len(self.sessions) > 1:
+                _, (old, old_bytes) = self.sessions.popitem(last=False)
+                self.nbytes -= old_bytes
+                self.counters["evictions"] += 1
+                evicted.append(old)
+        for old in evicted:
+            # Stops an InferenceBatcher's dispatcher so the session can be freed
+            if hasattr(old, "close"):
+                old.close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"loaded": list(self.sessions), "bytes": self.nbytes, **self.counters}
@@ -1,41 +1,400 @@
-import cv2
-import numpy as np
 from PIL import Image
-from .filters import (ImageFilter, ExposureFilter, HighlightsFilter, 
-                     ShadowsFilter, SharpnessFilter, RotateFilter, 
-                     FlipFilter, RemoveBackgroundFilter, ResizeFilter,
-                     WhiteBackgroundFilter)
-from .utils import convert_to_base64, load_image
-from typing import Optional
+from .filters import ImageFilter, ToneCurveFilter, GeometryFilter, create_filters
+from .tone import TONE_OPERATIONS
+from .geometry import GEOMETRY_OPERATIONS, jpeg_transform
+from .executor import FilterExecutor
+from .encoding import OutputFormat, EncodedImage, encode_image
+from .cache import content_key, chain_key
+from .memo import IntermediateCache
+from .coalesce import SingleFlight
+from .renditions import plan_renditions, decode_bound
+from .frame import freeze
+from .tiling import should_tile
+from app.core.config import settings
+from app.services.metrics import stage, INPUT_MEGAPIXELS
+from .utils import decode_image, fit_within, DECODE_MODES
+from typing import Optional, List
+import asyncio
 import io
+import time
 
 class ImageProcessor:
-    def __init__(self):
-        self.filters = {
-            'exposure': ExposureFilter(),
-            'highlights': HighlightsFilter(),
-            'shadows': ShadowsFilter(),
-            'sharpness': SharpnessFilter(),
-            'rotate': RotateFilter(),
-            'flip': FlipFilter(),
-            'remove_background': RemoveBackgroundFilter(),
-            'resize': ResizeFilter(),
-            'white_background': WhiteBackgroundFilter()
+    def __init__(self, executor: FilterExecutor = None, memo: IntermediateCache = None):
+        self.filters = create_filters()
+        self.executor = executor or FilterExecutor()
+        self.memo = memo or IntermediateCache()
+        self.tone_filter = ToneCurveFilter()
+        self.geometry_filter = GeometryFilter()
+        # Identical in-flight requests, keyed by their result ETag
+        self.inflight = SingleFlight()
+        self.ready = False
+        self.warming = False
+        self.warmup_status = {}
+
+    def warmup(self):
+        """Warm up every filter that loads a model, then mark the processor ready"""
+        self.warming = True
+        try:
+            for name, filter_instance in self.filters.items():
+                if hasattr(filter_instance, 'warmup'):
+                    try:
+                        self.warmup_status[name] = filter_instance.warmup()
+                    except Exception as e:
+                        print(f"Failed to warm up {name}: {e}")
+                        self.warmup_status[name] = False
+        finally:
+            self.warming = False
+        self.ready = True
+
+    def status(self) -> dict:
+        """Readiness summary for the health endpoint"""
+        if not self.ready:
+            state = "starting"
+        elif self.warming:
+            state = "warming_up"
+        elif not all(self.warmup_status.values()):
+            state = "degraded"
+        else:
+            state = "ready"
+        return {
+            "status": state,
+            "model": self.filters['remove_background'].model_name,
+            "warmup": self.warmup_status,
+            "executor": self.executor.status(),
+            "background_cache": self.filters['remove_background'].cache.stats(),
+            "segmentation_sessions": self.filters['remove_background'].sessions.stats(),
+            "intermediate_cache": self.memo.stats(),
+            "coalescing": self.inflight.stats()
         }
+
+    def shutdown(self):
+        self.executor.shutdown()
     
-    async def process(self, image_bytes: io.BytesIO, operation: str, params: dict):
+    async def process(self, image_bytes: io.BytesIO, operation: str, params: dict,
+                      output: OutputFormat = None, preview_edge: int = None) -> EncodedImage:
         """Main processing method that routes to specific operations"""
         if operation not in self.filters:
             raise ValueError(f"Unsupported operation: {operation}")
             
-        image = await load_image(image_bytes)
-        filter_instance = self.filters[operation]
-        processed_image = await filter_instance.apply(image, params)
-        
-        return await convert_to_base64(processed_image)
+        async with self.executor.admit():
+            step = {'operation': operation, 'params': params}
+            encoded = await self.transform_jpeg(image_bytes, [step], output, preview_edge)
+            if encoded:
+                return encoded
+            image, key, [step], decoded = await self.decode_for_steps(image_bytes, [step], preview_edge)
+            if preview_edge:
+                image, key = await self.make_proxy(image, key, preview_edge)
+                [step] = self.preview_steps([step], image.width / decoded["source_size"][0])
+            processed_image = await self.run_filter(operation, self.filters[operation], image, step['params'])
+
+            return await self.encode(processed_image, output, preview=bool(preview_edge))
     
-    async def crop(self, image_bytes: io.BytesIO, x: int, y: int, width: int, height: int):
-        """Crop the image to specified dimensions"""
-        image = Image.open(image_bytes)
-        cropped = image.crop((x, y, x + width, y + height))
-        return await convert_to_base64(cropped)
+    async def run_filter(self, operation: str, filter_instance: ImageFilter, image: Image.Image, params: dict):
+        """Run one filter, strip by strip when the frame is over TILED_PIXEL_THRESHOLD"""
+        tiled = should_tile(image, filter_instance.tile_overlap)
+        INPUT_MEGAPIXELS.observe(image.width * image.height / 1_000_000, operation=operation)
+        with stage("filter", operation):
+            return await self.executor.apply(operation, filter_instance, image, params, tiled)
+
+    def validate_steps(self, steps: List[dict]):
+        """Check every step of a pipeline up front so a bad step fails before any work"""
+        if not steps:
+            raise ValueError("Pipeline must contain at least one step")
+        for index, step in enumerate(steps):
+            operation = step.get('operation')
+            if operation not in self.filters:
+                raise ValueError(f"Step {index}: unsupported operation: {operation}")
+            params = step.get('params', {})
+            if not isinstance(params, dict):
+                raise ValueError(f"Step {index} ({operation}): params must be an object")
+            try:
+                self.filters[operation].validate(params)
+            except ValueError as e:
+                raise ValueError(f"Step {index} ({operation}): {e}")
+
+    def plan_steps(self, steps: List[dict]) -> List[List[dict]]:
+        """Group runs of consecutive tone steps so they execute as one fused curve,
+        and runs of geometric steps so they execute as one transform"""
+        groups = []
+        for step in steps:
+            previous = groups[-1][-1]['operation'] if groups else None
+            if any(step['operation'] in family and previous in family
+                   for family in (TONE_OPERATIONS, GEOMETRY_OPERATIONS)):
+                groups[-1].append(step)
+            else:
+                groups.append([step])
+        return groups
+
+    def fused_filter(self, group: List[dict]):
+        """Operation name and filter that run a group of steps"""
+        if len(group) == 1:
+            return group[0]['operation'], self.filters[group[0]['operation']]
+        if group[0]['operation'] in TONE_OPERATIONS:
+            return 'tone', self.tone_filter
+        return 'geometry', self.geometry_filter
+
+    async def make_proxy(self, image: Image.Image, key: str, edge: int):
+        """Downscaled copy for previews, keyed apart from the full-size image"""
+        if max(image.size) <= edge:
+            return image, key
+        proxy = await self.executor.call(fit_within, image, edge)
+        key = chain_key(key, 'preview', {'edge': edge})
+        proxy.info['content_key'] = key
+        return proxy, key
+
+    def preview_steps(self, steps: List[dict], scale: float) -> List[dict]:
+        """Steps for a proxy at scale: pixel-space params (crop boxes, resize targets)
+        rescaled, and each filter's preview defaults (the fast segmentation model) applied"""
+        previews = []
+        for step in steps:
+            filter_instance = self.filters[step['operation']]
+            params = step.get('params', {})
+            if scale != 1.0:
+                params = filter_instance.scale_params(params, scale)
+            previews.append({'operation': step['operation'], 'params': filter_instance.preview_params(params)})
+        return previews
+
+    async def decode(self, image_bytes: io.BytesIO):
+        """Decode an upload off the event loop, returning the image and its content key"""
+        with stage("decode"):
+            image = await self.executor.call(decode_image, image_bytes)
+        key = content_key(image_bytes.getbuffer())
+        image.info['content_key'] = key
+        return image, key
+
+    def plan_decode(self, steps: List[dict], source_size, preview_edge: int = None):
+        """Smallest size the steps need the source at (None for full size).
+
+        Decoding can be scaled down for previews, or when every step before the
+        first resize is resolution independent. That resize's target is then
+        made explicit in source pixels, so the output size doesn't change.
+        """
+        if preview_edge:
+            if max(source_size) <= preview_edge:
+                return None, steps
+            ratio = preview_edge / max(source_size)
+            return (max(1, round(source_size[0] * ratio)), max(1, round(source_size[1] * ratio))), steps
+
+        for index, step in enumerate(steps):
+            filter_instance = self.filters[step['operation']]
+            if step['operation'] == 'resize':
+                width, height = filter_instance.output_size(step.get('params', {}), source_size)
+                if width >= source_size[0] or height >= source_size[1]:
+                    return None, steps
+                explicit = {'operation': 'resize', 'params': {**step.get('params', {}), 'width': width, 'height': height}}
+                return (width, height), steps[:index] + [explicit] + steps[index + 1:]
+            if not filter_instance.resolution_independent:
+                break
+        return None, steps
+
+    def decode_modes(self, steps: List[dict]) -> tuple:
+        """Modes every step takes as they are, so the decoder needn't convert"""
+        modes = ('L', 'LA', 'RGB', 'RGBA')
+        for step in steps:
+            modes = tuple(mode for mode in modes if mode in self.filters[step['operation']].modes)
+        return modes
+
+    def _decode_for_steps(self, image_bytes: io.BytesIO, steps: List[dict], preview_edge: int = None):
+        # Reading the header doesn't decode any pixels
+        source_size = Image.open(image_bytes).size
+        image_bytes.seek(0)
+        target, steps = self.plan_decode(steps, source_size, preview_edge)
+        return decode_image(image_bytes, target, self.decode_modes(steps)), source_size, steps
+
+    async def decode_for_steps(self, image_bytes: io.BytesIO, steps: List[dict], preview_edge: int = None):
+        """Decode only as many pixels as the steps need; returns image, key, steps, decode stats"""
+        with stage("decode"):
+            image, source_size, steps = await self.executor.call(self._decode_for_steps, image_bytes, steps, preview_edge)
+        key = content_key(image_bytes.getbuffer())
+        if image.size != source_size:
+            # A reduced decode is a different image from the full-size one
+            key = chain_key(key, 'decode', {'size': list(image.size)})
+        if image.mode not in DECODE_MODES:
+            # Memoized steps from this decode mustn't be resumed by a chain that needs RGB
+            key = chain_key(key, 'decode', {'mode': image.mode})
+        image.info['content_key'] = key
+        decoded = {
+            "source_size": list(source_size),
+            "decoded_size": list(image.size),
+            "pixels_saved_pct": round(100 * (1 - (image.width * image.height) / (source_size[0] * source_size[1])), 1)
+        }
+        return image, key, steps, decoded
+
+    async def apply_steps(self, image: Image.Image, key: str, steps: List[dict], timings: dict = None,
+                          memoize: bool = True):
+        """Apply validated steps in memory; returns the result and its chained key.
+
+        Every intermediate is memoized under upload bytes + the steps applied so
+        far, and work resumes from the longest prefix already in the cache.
+        Bulk jobs pass memoize=False, their one-off images would only churn it.
+        """
+        groups = self.plan_steps(steps)
+        keys = []
+        source_key = key
+        for group in groups:
+            for step in group:
+                key = chain_key(key, step['operation'], step.get('params', {}))
+            keys.append(key)
+
+        resumed, cached, cost_ms = self.memo.lookup(keys) if memoize else (-1, None, 0.0)
+        key = source_key
+        if cached is not None:
+            image, key = cached, keys[resumed]
+        if timings is not None:
+            timings["cached_steps"] = sum(len(group) for group in groups[:resumed + 1])
+
+        for group, group_key in zip(groups[resumed + 1:], keys[resumed + 1:]):
+            step_start = time.perf_counter()
+            image.info['content_key'] = key
+            operation, filter_instance = self.fused_filter(group)
+            params = {'steps': group} if len(group) > 1 else group[0].get('params', {})
+            image = await self.run_filter(operation, filter_instance, image, params)
+            key = group_key
+            duration_ms = (time.perf_counter() - step_start) * 1000
+            # Cost is the time to rebuild this intermediate from the source
+            cost_ms += duration_ms
+            if memoize:
+                self.memo.put(key, image, cost_ms)
+            if timings is not None:
+                timings["steps"].append({
+                    "operation": "+".join(step['operation'] for step in group),
+                    "duration_ms": duration_ms
+                })
+        image.info['content_key'] = key
+        return image, key
+
+    async def run_pipeline(self, image_bytes: io.BytesIO, steps: List[dict], output: OutputFormat = None,
+                           preview_edge: int = None, memoize: bool = True):
+        """Decode once, apply every step in memory, encode once"""
+        self.validate_steps(steps)
+        async with self.executor.admit():
+            timings = {"steps": []}
+            start = time.perf_counter()
+            encoded = await self.transform_jpeg(image_bytes, steps, output, preview_edge)
+            if encoded:
+                timings["lossless_jpeg"] = True
+                timings["total_ms"] = (time.perf_counter() - start) * 1000
+                return encoded, timings
+
+            image, key, steps, timings["decode"] = await self.decode_for_steps(image_bytes, steps, preview_edge)
+            if preview_edge:
+                image, key = await self.make_proxy(image, key, preview_edge)
+                steps = self.preview_steps(steps, image.width / timings["decode"]["source_size"][0])
+            timings["decode_ms"] = (time.perf_counter() - start) * 1000
+
+            image, key = await self.apply_steps(image, key, steps, timings, memoize)
+
+            encode_start = time.perf_counter()
+            result = await self.encode(image, output, preview=bool(preview_edge))
+            timings["encode_ms"] = (time.perf_counter() - encode_start) * 1000
+            timings["total_ms"] = (time.perf_counter() - start) * 1000
+            return result, timings
+
+    async def edit(self, image: Image.Image, key: str, steps: List[dict], output: OutputFormat = None,
+                   preview_scale: float = None):
+        """Apply steps to an already decoded image (edit sessions); returns image, key, encoding, timings.
+
+        With preview_scale the image is a proxy at that scale of the stored version.
+        """
+        self.validate_steps(steps)
+        if preview_scale:
+            steps = self.preview_steps(steps, preview_scale)
+        async with self.executor.admit():
+            timings = {"steps": []}
+            start = time.perf_counter()
+            image, key = await self.apply_steps(image, key, steps, timings)
+
+            encode_start = time.perf_counter()
+            result = await self.encode(image, output, preview=bool(preview_scale))
+            timings["encode_ms"] = (time.perf_counter() - encode_start) * 1000
+            timings["total_ms"] = (time.perf_counter() - start) * 1000
+            return image, key, result, timings
+
+    async def render_renditions(self, image_bytes: io.BytesIO, renditions: List[dict], steps: List[dict] = None):
+        """Decode once, apply steps once, then yield (rendition, encoding) as each output is ready.
+
+        Renditions are resize params ('width', 'height', 'max_bytes',
+        'lossy_fallback') plus 'output' (an OutputFormat) and
+        'white_background'. Only a rendition's own max_bytes is a byte budget,
+        never RESIZE_MAX_BYTES. Each is resized from
+        the nearest larger rendition the cascade plan allows (see renditions.py)
+        and all of them are encoded concurrently.
+        """
+        steps = steps or []
+        if steps:
+            self.validate_steps(steps)
+        async with self.executor.admit():
+            # A trailing resize to the largest rendition lets the decode be reduced
+            bound = {'operation': 'resize', 'params': decode_bound(renditions)}
+            image, key, planned, decoded = await self.decode_for_steps(image_bytes, steps + [bound])
+            if planned[:-1]:
+                image, key = await self.apply_steps(image, key, planned[:-1])
+            # A reduced decode only happens before size-preserving steps, so
+            # rendition sizes stay relative to the full-size source
+            size = decoded["source_size"] if decoded["decoded_size"] != decoded["source_size"] else image.size
+            freeze(image)
+
+            resize = self.filters['resize']
+            resized = {}
+
+            async def build(index, target, parent):
+                source = image if parent is None else await resized[parent]
+                params = {
+                    'width': target[0],
+                    'height': target[1],
+                    # None leaves the encode unbudgeted instead of using RESIZE_MAX_BYTES
+                    'max_bytes': renditions[index].get('max_bytes'),
+                    'lossy_fallback': renditions[index].get('lossy_fallback', True)
+                }
+                result = await self.run_filter('resize', resize, source, params)
+                freeze(result)
+                return result
+
+            async def finish(index):
+                rendition = renditions[index]
+                result = await resized[index]
+                if rendition.get('white_background'):
+                    result = await self.run_filter('white_background', self.filters['white_background'], result, {})
+                return rendition, await self.encode(result, rendition.get('output'))
+
+            for index, target, parent in plan_renditions(renditions, size):
+                resized[index] = asyncio.ensure_future(build(index, target, parent))
+            outputs = [asyncio.ensure_future(finish(index)) for index in range(len(renditions))]
+            try:
+                for output in asyncio.as_completed(outputs):
+                    yield await output
+            finally:
+                for task in [*resized.values(), *outputs]:
+                    task.cancel()
+
+    async def transform_jpeg(self, image_bytes: io.BytesIO, steps: List[dict], output: OutputFormat = None,
+                             preview_edge: int = None) -> Optional[EncodedImage]:
+        """The lossless jpegtran result when the steps only crop/flip/turn a JPEG kept as JPEG, else None"""
+        output = output or OutputFormat()
+        if (preview_edge or output.format != 'jpeg' or output.quality is not None
+                or not settings.JPEG_LOSSLESS_TRANSFORMS
+                or any(step['operation'] not in GEOMETRY_OPERATIONS for step in steps)
+                or image_bytes.getbuffer()[:2] != b'\xff\xd8'):
+            return None
+        with stage("filter", "jpegtran"):
+            data = await self.executor.call(jpeg_transform, image_bytes.getvalue(), steps)
+        return EncodedImage(data, output.media_type) if data else None
+
+    async def encode(self, image: Image.Image, output: OutputFormat = None, preview: bool = False) -> EncodedImage:
+        """Encode off the event loop; previews use the fastest settings and skip byte budgets"""
+        output = output or OutputFormat()
+        if preview:
+            output = output.fastest()
+        with stage("encode", output.format):
+            return await self.executor.call(encode_image, image, output, not preview)
+
+    async def crop(self, image_bytes: io.BytesIO, x: int, y: int, width: int, height: int,
+                   output: OutputFormat = None) -> EncodedImage:
+        """Crop the image to specified dimensions.
+
+        A one-step pipeline, so a JPEG kept as JPEG is cropped losslessly by
+        jpegtran when the box is on block boundaries.
+        """
+        step = {'operation': 'crop', 'params': {'x': x, 'y': y, 'width': width, 'height': height}}
+        encoded, _ = await self.run_pipeline(image_bytes, [step], output)
+        return encoded
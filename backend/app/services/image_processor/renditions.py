@@ -0,0 +1,117 @@
+"""Several output sizes of one upload from a shared downscale cascade.
+
+A storefront needs every product photo at thumbnail, listing, zoom and print
+size. Rendering them one request at a time re-uploads and re-decodes the
+original for each. Here the source is decoded once, at the smallest draft
+scale the largest rendition allows, and each rendition is resized from the
+smallest already-built rendition that is still at least
+RENDITION_REDUCING_GAP times its size, so most downscales read a fraction
+of the source's pixels. The gap plays the role of Pillow's reducing_gap:
+resampling from an image only a little larger than the target would blur
+it twice for no gain.
+
+Outputs are encoded concurrently on the filter thread pool and streamed as a
+ZIP (stored, since the entries are already compressed) or multipart/mixed
+body in the order they finish.
+"""
+import zipfile
+from typing import List
+from app.core.config import settings
+from .encoding import EncodedImage, MEDIA_TYPES
+from .geometry import fit_size
+
+# File extension per encoded format name
+EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+def plan_renditions(renditions: List[dict], size) -> List[tuple]:
+    """(index, target size, parent index or None for the source), largest target first.
+
+    Every parent comes before its children in the returned order.
+    """
+    targets = [fit_size(rendition, size) for rendition in renditions]
+    order = sorted(range(len(renditions)), key=lambda index: targets[index][0] * targets[index][1], reverse=True)
+    gap = settings.RENDITION_REDUCING_GAP
+    plan = []
+    for position, index in enumerate(order):
+        width, height = targets[index]
+        parent = None
+        # Planned so far is ordered largest first, so the last one that fits is the smallest
+        for candidate in order[:position]:
+            if targets[candidate][0] >= width * gap and targets[candidate][1] >= height * gap:
+                parent = candidate
+        plan.append((index, (width, height), parent))
+    return plan
+
+def decode_bound(renditions: List[dict]) -> dict:
+    """Resize params whose fitted size covers every rendition's, for planning a reduced decode"""
+    bound = {}
+    for name in ('width', 'height'):
+        # A rendition without the dimension is limited only by the source
+        if all(rendition.get(name) for rendition in renditions):
+            bound[name] = max(rendition[name] for rendition in renditions)
+    return bound
+
+def filename(name: str, encoded: EncodedImage) -> str:
+    # The byte budget may have switched PNG to JPEG/WebP, so go by what was encoded
+    return f"{name}.{EXTENSIONS[MEDIA_TYPES[encoded.media_type]]}"
+
+class _Sink:
+    """Write-only, unseekable buffer; zipfile then streams entries with data descriptors"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+class ZipStream:
+    """ZIP archive produced incrementally: add() and close() return the bytes to send next"""
+    media_type = 'application/zip'
+
+    def __init__(self):
+        self.sink = _Sink()
+        self.archive = zipfile.ZipFile(self.sink, 'w', zipfile.ZIP_STORED)
+
+    def add(self, name: str, encoded: EncodedImage) -> bytes:
+        return self.add_bytes(filename(name, encoded), encoded.data)
+
+    def add_bytes(self, name: str, data, compress_type: int = None) -> bytes:
+        self.archive.writestr(name, data, compress_type)
+        return self.sink.take()
+
+    def add_file(self, name: str, path) -> bytes:
+        # Encoded images don't deflate, they are stored as-is
+        self.archive.write(path, name)
+        return self.sink.take()
+
+    def close(self) -> bytes:
+        self.archive.close()
+        return self.sink.take()
+
+class MultipartStream:
+    """multipart/mixed body, one part per rendition"""
+
+    def __init__(self, boundary: str):
+        self.boundary = boundary
+        self.media_type = f'multipart/mixed; boundary={boundary}'
+
+    def add(self, name: str, encoded: EncodedImage) -> bytes:
+        lines = [
+            f'--{self.boundary}',
+            f'Content-Type: {encoded.media_type}',
+            f'Content-Disposition: attachment; name="{name}"; filename="{filename(name, encoded)}"',
+            f'Content-Length: {len(encoded.data)}',
+        ]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode() + encoded.data + b'\r\n'
+
+    def close(self) -> bytes:
+        return f'--{self.boundary}--\r\n'.encode()
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+import secrets
+import time
+from PIL import Image
+from app.core.config import settings
+from .cache import image_nbytes
+from .frame import freeze
+
+class ImageVersion:
+    def __init__(self, version: int, image: Image.Image, key: str, parent: int = None):
+        self.version = version
+        self.image = image
+        self.key = key
+        self.parent = parent
+        # Preview edge -> (proxy, key), least recently used first
+        self.proxies = OrderedDict()
+        self.nbytes = image_nbytes(image)
+
+class EditSession:
+    def __init__(self, image_id: str):
+        self.image_id = image_id
+        self.versions = OrderedDict()
+        self.next_version = 0
+        self.last_access = time.monotonic()
+        # Base version and steps of the last preview, replayed by export
+        self.pending = None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(version.nbytes for version in self.versions.values())
+
+    @property
+    def latest(self) -> ImageVersion:
+        return next(reversed(self.versions.values()))
+
+class ImageStore:
+    """Decoded images of edit sessions, bounded by bytes with LRU eviction and an idle TTL.
+
+    Each session keeps its source as version 0 and every edit result as a new
+    version, so clients can branch from any earlier version without uploading
+    the image again.
+    """
+
+    def __init__(self, max_bytes: int = None, ttl_seconds: int = None, max_versions: int = None):
+        self.max_bytes = settings.SESSION_STORE_BYTES if max_bytes is None else max_bytes
+        self.ttl = settings.SESSION_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_versions = settings.SESSION_MAX_VERSIONS if max_versions is None else max_versions
+        self.sessions = OrderedDict()
+        self.nbytes = 0
+        self.evictions = 0
+
+    def create(self, image: Image.Image, key: str) -> EditSession:
+        session = EditSession(secrets.token_urlsafe(16))
+        self.sessions[session.image_id] = session
+        self._add(session, image, key, None)
+        return session
+
+    def get(self, image_id: str, version: int = None) -> ImageVersion:
+        """Return a version (latest by default); KeyError if the session or version is gone"""
+        self._expire()
+        session = self.sessions[image_id]
+        session.last_access = time.monotonic()
+        self.sessions.move_to_end(image_id)
+        if version is None:
+            return session.latest
+        return session.versions[version]
+
+    def add_version(self, image_id: str, image: Image.Image, key: str, parent: int) -> ImageVersion:
+        session = self.sessions[image_id]
+        return self._add(session, image, key, parent)
+
+    def get_proxy(self, image_id: str, version: int, edge: int):
+        """Cached (proxy, key) of a version for the given preview edge, or None"""
+        stored = self.sessions[image_id].versions[version]
+        if edge not in stored.proxies:
+            return None
+        stored.proxies.move_to_end(edge)
+        return stored.proxies[edge]
+
+    def put_proxy(self, image_id: str, version: int, edge: int, proxy: Image.Image, key: str):
+        session = self.sessions.get(image_id)
+        stored = session.versions.get(version) if session else None
+        if stored is None or proxy is stored.image or edge in stored.proxies:
+            return
+        size = image_nbytes(proxy)
+        stored.proxies[edge] = (proxy, key)
+        stored.nbytes += size
+        self.nbytes += size
+        while len(stored.proxies) > settings.PREVIEW_PROXIES_PER_VERSION:
+            _, (oldest, _) = stored.proxies.popitem(last=False)
+            stored.nbytes -= image_nbytes(oldest)
+            self.nbytes -= image_nbytes(oldest)
+        self._evict(keep=image_id)
+
+    def session(self, image_id: str) -> EditSession:
+        return self.sessions[image_id]
+
+    def delete(self, image_id: str):
+        session = self.sessions.pop(image_id)
+        self.nbytes -= session.nbytes
+
+    def _add(self, session: EditSession, image: Image.Image, key: str, parent: int) -> ImageVersion:
+        # Edits start from stored versions, which in-place filters must not change
+        freeze(image)
+        stored = ImageVersion(session.next_version, image, key, parent)
+        session.next_version += 1
+        session.versions[stored.version] = stored
+        session.last_access = time.monotonic()
+        self.nbytes += stored.nbytes
+
+        # Drop the oldest edits past the version cap, but always keep the source
+        while len(session.versions) > self.max_versions:
+            oldest = next(version for version in session.versions if version != 0)
+            self.nbytes -= session.versions.pop(oldest).nbytes
+
+        self.sessions.move_to_end(session.image_id)
+        self._evict(keep=session.image_id)
+        return stored
+
+    def _expire(self):
+        now = time.monotonic()
+        for image_id in [i for i, s in self.sessions.items() if now - s.last_access > self.ttl]:
+            self.delete(image_id)
+
+    def _evict(self, keep: str):
+        self._expire()
+        for image_id in list(self.sessions):
+            if self.nbytes <= self.max_bytes:
+                break
+            if image_id != keep:
+                self.delete(image_id)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "bytes": self.nbytes,
+            "evictions": self.evictions
+        }
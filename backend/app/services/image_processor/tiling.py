@@ -0,0 +1,45 @@
+"""Strip-wise execution of per-pixel filters for very large images.
+
+A filter run on a whole frame holds several full-size copies at once (the
+NumPy view of the input, working arrays, the output array, the final
+Image). Here the filter only ever sees a horizontal strip; each result is
+pasted into one output image allocated up front, so peak memory is the
+input, the output and a few strips of at most TILE_MEMORY_BYTES.
+
+Filters with a neighbourhood (sharpness) declare a tile_overlap: strips
+are cut with that many extra rows on each side and the extra rows are
+dropped on paste, so the result matches a full-frame run exactly.
+"""
+from PIL import Image
+from app.core.config import settings
+
+# Copies of a strip a filter holds while it works, used to size strips
+WORKING_COPIES = 4
+
+def strip_rows(image: Image.Image, overlap: int = 0, max_bytes: int = None) -> int:
+    """Rows per strip that keep a filter's working set under max_bytes"""
+    max_bytes = settings.TILE_MEMORY_BYTES if max_bytes is None else max_bytes
+    row_bytes = image.width * len(image.getbands()) * WORKING_COPIES
+    return max(1, max_bytes // row_bytes - 2 * overlap)
+
+def run_tiled(image: Image.Image, func, overlap: int = 0, max_bytes: int = None) -> Image.Image:
+    """Apply a size-preserving func strip by strip into a preallocated output"""
+    rows = strip_rows(image, overlap, max_bytes)
+    output = None
+    for top in range(0, image.height, rows):
+        bottom = min(image.height, top + rows)
+        upper = max(0, top - overlap)
+        lower = min(image.height, bottom + overlap)
+        result = func(image.crop((0, upper, image.width, lower)))
+        if output is None:
+            # The output mode is only known once the filter has run (e.g. RGBA -> RGB)
+            output = Image.new(result.mode, image.size)
+        if upper != top or lower != bottom:
+            result = result.crop((0, top - upper, image.width, bottom - upper))
+        output.paste(result, (0, top))
+    output.info = dict(image.info)
+    return output
+
+def should_tile(image: Image.Image, overlap) -> bool:
+    """Tile filters that support it once the frame is over TILED_PIXEL_THRESHOLD"""
+    return overlap is not None and image.width * image.height >= settings.TILED_PIXEL_THRESHOLD
@@ -0,0 +1,128 @@
+"""Precomputed tone curves for the exposure, highlights and shadows filters.
+
+Every tone op maps a pixel using only its own channel value ``x`` and its HSV
+value ``v = max(R, G, B)``, so it can be compiled into a 256x256 table indexed
+by ``[v, x]``. Exposure is a plain per-channel curve; highlights and shadows
+scale V on one side of 127 and, keeping hue and saturation, scale every
+channel by the same factor. A chain of tone ops composes into a single table,
+applied to the frame in one gather pass instead of one HSV round trip per op.
+
+Tolerance: highlights and shadows (alone or fused) stay within 8 levels per
+channel of the former OpenCV HSV implementation, under 1 level on average;
+the gap comes from OpenCV quantizing hue to 180 steps, which the tables don't
+do. Exposure alone matches cv2.convertScaleAbs exactly. Alpha is passed
+through untouched.
+
+``tone_curve`` also takes a ``Frame`` and writes in place when it may; only a
+Pillow image with a pure exposure chain stays in Pillow, whose point() is
+faster than NumPy for a per-channel table.
+"""
+from functools import lru_cache
+from PIL import Image
+import numpy as np
+from .frame import Frame, ImageLike, as_image
+
+TONE_OPERATIONS = ('exposure', 'highlights', 'shadows')
+
+_LEVELS = np.arange(256, dtype=np.float64)
+_STRIP_PIXELS = 1 << 18
+
+@lru_cache(maxsize=256)
+def exposure_table(value: float) -> np.ndarray:
+    """Per-channel curve equivalent to cv2.convertScaleAbs(alpha=1 + value)"""
+    # OpenCV scales in single precision, match it so the rounding agrees
+    scaled = _LEVELS.astype(np.float32) * np.float32(1 + value)
+    table = np.clip(np.rint(np.abs(scaled)), 0, 255).astype(np.uint8)
+    table.flags.writeable = False
+    return table
+
+def _value_curve(operation: str, value: float) -> np.ndarray:
+    """New V for every old V; highlights touch V > 127, shadows V <= 127"""
+    scaled = np.clip(_LEVELS * (1 + value), 0, 255).astype(np.uint8)
+    mask = _LEVELS > 127 if operation == 'highlights' else _LEVELS <= 127
+    return np.where(mask, scaled, _LEVELS.astype(np.uint8))
+
+@lru_cache(maxsize=256)
+def tone_table(operation: str, value: float) -> np.ndarray:
+    """256x256 table mapping [v, x] to the new channel value for one tone op"""
+    if operation == 'exposure':
+        table = np.broadcast_to(exposure_table(value), (256, 256)).copy()
+    else:
+        curve = _value_curve(operation, value).astype(np.float64)
+        # Channels keep their ratio to V, so each one scales by curve[v] / v
+        gain = np.divide(curve, _LEVELS, out=np.ones(256), where=_LEVELS > 0)
+        table = np.clip(np.rint(_LEVELS[None, :] * gain[:, None]), 0, 255).astype(np.uint8)
+    table.flags.writeable = False
+    return table
+
+@lru_cache(maxsize=256)
+def compile_curve(steps: tuple) -> np.ndarray:
+    """Fuse a chain of (operation, value) tone steps into one [v, x] table"""
+    levels = np.arange(256)
+    table = np.broadcast_to(levels.astype(np.uint8), (256, 256)).copy()
+    # value_map[v] is the current V of a pixel whose original V was v
+    value_map = levels.copy()
+    for operation, value in steps:
+        step = tone_table(operation, float(value))
+        table = step[value_map[:, None], table]
+        value_map = table[levels, levels].astype(np.intp)
+    table.flags.writeable = False
+    return table
+
+def apply_curve(image: Image.Image, steps) -> Image.Image:
+    """Apply a chain of tone steps to an L, RGB or RGBA image in a single pass"""
+    return as_image(tone_curve(image, steps))
+
+def _apply_lut(frame: Frame, lut: np.ndarray) -> Frame:
+    import cv2
+
+    if frame.mode == 'RGBA':
+        # Alpha goes through an identity table
+        lut = np.stack([lut, lut, lut, np.arange(256, dtype=np.uint8)], axis=-1).reshape(256, 1, 4)
+    out = frame.target()
+    cv2.LUT(frame.pixels, lut, dst=out)
+    return frame.with_pixels(out)
+
+def tone_curve(image: ImageLike, steps) -> ImageLike:
+    """Apply a chain of tone steps in a single pass; returns a Frame unless Pillow is faster"""
+    steps = tuple((operation, float(value)) for operation, value in steps)
+    if image.mode not in ('L', 'RGB', 'RGBA'):
+        image = image.convert('RGB')
+
+    if all(operation == 'exposure' for operation, _ in steps):
+        # Pure per-channel curve: compose 1D tables into one lookup
+        lut = np.arange(256, dtype=np.uint8)
+        for _, value in steps:
+            lut = exposure_table(value)[lut]
+        if isinstance(image, Frame):
+            return _apply_lut(image, lut)
+        bands = 1 if image.mode == 'L' else 3
+        identity = list(range(256)) if image.mode == 'RGBA' else []
+        return image.point(lut.tolist() * bands + identity)
+
+    table = compile_curve(steps)
+    if isinstance(image, Frame):
+        frame = image
+        pixels, out = frame.pixels, frame.target()
+    else:
+        frame = Frame(np.asarray(image), image.mode, dict(image.info))
+        pixels = frame.pixels
+        out = np.empty_like(pixels)
+    if frame.mode == 'L':
+        out[...] = table[pixels, pixels]
+        return frame.with_pixels(out)
+
+    flat_table = table.ravel()
+    # Work in strips so the index buffer stays small and cache-resident
+    rows = max(1, _STRIP_PIXELS // image.width)
+    for top in range(0, image.height, rows):
+        rgb = pixels[top:top + rows, :, :3]
+        # Pairwise maximum is far faster than max(axis=2) on interleaved uint8
+        value = np.maximum(np.maximum(rgb[..., 0], rgb[..., 1]), rgb[..., 2]).astype(np.uint16)
+        # Flat index v * 256 + x into the table, one gather per strip
+        index = (value[..., None] << 8) | rgb
+        # Strips don't overlap, so writing back in place is safe
+        out[top:top + rows, :, :3] = np.take(flat_table, index)
+    if frame.mode == 'RGBA' and out is not pixels:
+        out[..., 3] = pixels[..., 3]
+    return frame.with_pixels(out)
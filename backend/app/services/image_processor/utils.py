@@ -2,23 +2,82 @@ from PIL import Image
 import base64
 import io
 import numpy as np
-import cv2
+from .encoding import has_alpha
+from .frame import as_image
+from app.services.metrics import stage
+
+def encode_base64(image: Image.Image) -> str:
+    """Encode PIL Image as a base64 PNG string"""
+    with stage("encode", "png"):
+        buffered = io.BytesIO()
+        image.save(buffered, format="PNG")
+    with stage("base64"):
+        img_str = base64.b64encode(buffered.getvalue()).decode()
+    return img_str
+
+# Decode-time downscaling keeps at least this multiple of the target size,
+# like Image.thumbnail's reducing_gap, so the final resample stays sharp
+DRAFT_GAP = 2.0
+
+# Modes every filter takes without converting
+DECODE_MODES = ('RGB', 'RGBA')
+
+def decode_image(image_bytes: io.BytesIO, target_size=None, modes=DECODE_MODES) -> Image.Image:
+    """Decode, converting to RGB (RGBA when the source has transparency) unless
+    the source's mode is one of modes.
+
+    With a target_size the steps only need, JPEGs are decoded at a reduced
+    DCT scale (Image.draft) and other formats are reduced right after
+    decoding. A grayscale source that only gets geometry keeps its one
+    channel instead of being expanded to three.
+    """
+    with Image.open(image_bytes) as opened:
+        image = opened
+        if target_size:
+            requested = (
+                min(image.width, max(1, int(target_size[0] * DRAFT_GAP))),
+                min(image.height, max(1, int(target_size[1] * DRAFT_GAP)))
+            )
+            if image.format == 'JPEG':
+                image.draft('RGB', requested)
+            image.load()
+            factor = min(image.width // requested[0], image.height // requested[1])
+            if factor >= 2:
+                image = image.reduce(factor)
+        if image.mode not in modes:
+            image = image.convert('RGBA' if has_alpha(image) else 'RGB')
+        # Decode now, on this worker thread, rather than in whichever filter touches it first
+        image.load()
+        # Formats that can hold several frames (PNG, TIFF, GIF) keep the source file
+        # for seek() even after loading; only the first frame is used, so a decode
+        # that produced no new image is copied rather than pinning the upload
+        if image is opened:
+            image = opened.copy()
+    return image
+
+def fit_within(image: Image.Image, longest_edge: int) -> Image.Image:
+    """Downscale so the longest edge is at most longest_edge, never upscale"""
+    if max(image.size) <= longest_edge:
+        return image
+    image = as_image(image)
+    ratio = longest_edge / max(image.size)
+    size = (max(1, round(image.width * ratio)), max(1, round(image.height * ratio)))
+    return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
 
 async def convert_to_base64(image: Image.Image) -> str:
     """Convert PIL Image to base64 string"""
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return img_str
+    return encode_base64(image)
 
-async def load_image(image_bytes: io.BytesIO) -> Image.Image:
+async def load_image(image_bytes: io.BytesIO, target_size=None) -> Image.Image:
     """Load image from bytes into PIL Image"""
-    return Image.open(image_bytes).convert('RGB')
+    return decode_image(image_bytes, target_size)
 
 async def pil_to_cv2(image: Image.Image) -> np.ndarray:
     """Convert PIL Image to CV2 format"""
+    import cv2
     return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
 
 async def cv2_to_pil(image: np.ndarray) -> Image.Image:
     """Convert CV2 image to PIL format"""
+    import cv2
     return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
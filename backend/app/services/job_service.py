@@ -0,0 +1,353 @@
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path, PurePosixPath
+from typing import List, Optional
+import asyncio
+import io
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from app.core.config import settings
+from app.services.image_processor import ImageProcessor, ServerBusyError, OutputFormat
+from app.services.image_processor.ingest import UploadRejected, sniff, check_image
+from app.services.image_processor.renditions import ZipStream
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tif', '.tiff', '.gif'}
+EXTENSIONS = {'image/png': '.png', 'image/jpeg': '.jpg', 'image/webp': '.webp'}
+
+def write_json(path: Path, data: dict):
+    """Write next to the target then rename, so a crash never leaves a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def archive_name(name: str) -> str:
+    """Relative path for a results entry: no root, drive or '..' parts from the uploaded name"""
+    parts = PurePosixPath(name.replace("\\", "/")).parts
+    return "/".join(part for part in parts if part not in ("/", ".", "..") and not part.endswith(":"))
+
+class Job:
+    """One bulk job on disk.
+
+    job.json holds the immutable spec (steps, output, items) and is written
+    once. progress.jsonl gets one line per finished item, so after a restart
+    the job resumes with only the items that have no line yet.
+    """
+
+    def __init__(self, directory: Path, spec: dict):
+        self.directory = directory
+        self.spec = spec
+        self.job_id = spec["job_id"]
+        self.results = {}  # index -> {"status", "file" or "error", "attempts"}
+        self.cancelled = False
+        self.started_at = None
+        self.finished_at = None
+        # Throughput counts only items processed since this worker (re)started the job
+        self.processed_this_run = 0
+        self.run_started = None
+        self.lock = threading.Lock()
+        self._archive = None
+
+    @property
+    def items(self) -> List[dict]:
+        return self.spec["items"]
+
+    @property
+    def output(self) -> OutputFormat:
+        return OutputFormat(**self.spec["output"])
+
+    def load_progress(self):
+        path = self.directory / "progress.jsonl"
+        if not path.exists():
+            return
+        for line in path.read_text().splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from a crash, the item is simply redone
+            self.results[record["index"]] = record
+
+    def record(self, index: int, status: str, **fields):
+        record = {"index": index, "status": status, **fields}
+        self.results[index] = record
+        with (self.directory / "progress.jsonl").open("a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def pending(self) -> List[int]:
+        return [index for index in range(len(self.items)) if index not in self.results]
+
+    def read_input(self, index: int) -> bytes:
+        item = self.items[index]
+        if "path" in item:
+            return Path(item["path"]).read_bytes()
+        # One shared handle per job; ZipFile reads aren't safe across threads
+        with self.lock:
+            if self._archive is None:
+                self._archive = zipfile.ZipFile(self.directory / "input.zip")
+            return self._archive.read(item["member"])
+
+    def write_output(self, index: int, data: bytes, media_type: str) -> str:
+        name = f"{index:06d}{EXTENSIONS.get(media_type, '.bin')}"
+        path = self.directory / "outputs" / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(data)
+        return name
+
+    def close(self):
+        with self.lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+
+    def status(self) -> dict:
+        total = len(self.items)
+        done = sum(1 for r in self.results.values() if r["status"] == "done")
+        failed = sum(1 for r in self.results.values() if r["status"] == "failed")
+        remaining = total - done - failed
+
+        if self.cancelled:
+            state = "cancelled"
+        elif remaining == 0:
+            state = "completed" if failed == 0 else ("failed" if done == 0 else "completed_with_errors")
+        elif self.run_started is None:
+            state = "queued"
+        else:
+            state = "running"
+
+        throughput = 0.0
+        if self.run_started is not None and self.processed_this_run:
+            elapsed = (self.finished_at or time.monotonic()) - self.run_started
+            throughput = self.processed_this_run / elapsed if elapsed > 0 else 0.0
+
+        errors = [
+            {"name": self.items[r["index"]]["name"], "error": r.get("error")}
+            for r in self.results.values() if r["status"] == "failed"
+        ]
+        return {
+            "job_id": self.job_id,
+            "status": state,
+            "created_at": self.spec["created_at"],
+            "total": total,
+            "done": done,
+            "failed": failed,
+            "remaining": remaining,
+            "images_per_second": throughput,
+            "eta_seconds": remaining / throughput if throughput and remaining else None,
+            "errors": errors[:20]
+        }
+
+    def result_files(self):
+        """(archive name, path) of every finished item, named after its input"""
+        used = set()
+        for index in sorted(self.results):
+            record = self.results[index]
+            if record["status"] != "done":
+                continue
+            stem = os.path.splitext(archive_name(self.items[index]["name"]))[0] or f"{index:06d}"
+            name = stem + os.path.splitext(record["file"])[1]
+            if name in used:
+                name = f"{stem}-{index}{os.path.splitext(record['file'])[1]}"
+            used.add(name)
+            yield name, self.directory / "outputs" / record["file"]
+
+class JobManager:
+    """Runs bulk pipeline jobs in the background on the processor's worker pools.
+
+    Each job processes up to its concurrency of items at once and all jobs
+    share JOB_WORKERS slots, so a big drop can't starve interactive requests.
+    Failed items are retried with exponential backoff; a busy server is
+    waited out without using up attempts.
+    """
+
+    def __init__(self, processor: ImageProcessor, jobs_dir: str = None):
+        self.processor = processor
+        self.jobs_dir = Path(jobs_dir or settings.JOBS_DIR)
+        self.jobs = {}
+        self.tasks = {}
+        self.slots = None
+
+    async def start(self):
+        """Load jobs from disk and resume any that didn't finish before the last shutdown"""
+        self.slots = asyncio.Semaphore(settings.JOB_WORKERS)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        for spec_path in self.jobs_dir.glob("*/job.json"):
+            try:
+                job = Job(spec_path.parent, json.loads(spec_path.read_text()))
+            except (json.JSONDecodeError, KeyError) as e:
+                print(f"Skipping unreadable job {spec_path.parent.name}: {e}")
+                continue
+            job.load_progress()
+            self.jobs[job.job_id] = job
+            if job.pending():
+                self._launch(job)
+
+    async def stop(self):
+        """Cancel running jobs; their progress is on disk and they resume on the next start"""
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks.clear()
+        for job in self.jobs.values():
+            job.close()
+
+    async def create(self, steps: List[dict], output: OutputFormat, archive: Optional[str] = None,
+                     paths: Optional[List[str]] = None, concurrency: Optional[int] = None) -> Job:
+        """Register a job from a ZIP already saved to disk, or from server-local paths"""
+        # Moving the archive and reading its central directory is disk work
+        job = await asyncio.to_thread(self._register, steps, output, archive, paths, concurrency)
+        self.jobs[job.job_id] = job
+        self._launch(job)
+        return job
+
+    def _register(self, steps: List[dict], output: OutputFormat, archive: Optional[str],
+                  paths: Optional[List[str]], concurrency: Optional[int]) -> Job:
+        job_id = secrets.token_urlsafe(12)
+        directory = self.jobs_dir / job_id
+        directory.mkdir(parents=True)
+        try:
+            if archive is not None:
+                shutil.move(archive, directory / "input.zip")
+                items = self._zip_items(directory / "input.zip")
+            else:
+                items = self._path_items(paths or [])
+            if not items:
+                raise ValueError("The job contains no images")
+            if len(items) > settings.JOB_MAX_ITEMS:
+                raise ValueError(f"The job has {len(items)} images, the limit is {settings.JOB_MAX_ITEMS}")
+
+            spec = {
+                "job_id": job_id,
+                "created_at": now_iso(),
+                "steps": steps,
+                "output": {
+                    "format": output.format,
+                    "quality": output.quality,
+                    "compress_level": output.compress_level,
+                    "effort": output.effort
+                },
+                "concurrency": min(concurrency or settings.JOB_CONCURRENCY, settings.JOB_WORKERS),
+                "items": items
+            }
+            write_json(directory / "job.json", spec)
+        except Exception:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        return Job(directory, spec)
+
+    def _zip_items(self, path: Path) -> List[dict]:
+        try:
+            with zipfile.ZipFile(path) as archive:
+                members = archive.infolist()
+        except zipfile.BadZipFile:
+            raise ValueError("The upload is not a valid ZIP archive")
+        items = []
+        for member in members:
+            name = member.filename
+            if member.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                continue
+            if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            if member.file_size > settings.JOB_MAX_ITEM_BYTES:
+                raise ValueError(f"{name} is larger than {settings.JOB_MAX_ITEM_BYTES} bytes")
+            items.append({"name": name, "member": name})
+        return items
+
+    def _path_items(self, paths: List[str]) -> List[dict]:
+        roots = [Path(root).resolve() for root in settings.JOB_LOCAL_ROOTS]
+        if not roots:
+            raise ValueError("Server-local paths are disabled (JOB_LOCAL_ROOTS is empty)")
+        items = []
+        for raw_path in paths:
+            path = Path(raw_path).resolve()
+            if not any(path.is_relative_to(root) for root in roots):
+                raise ValueError(f"{raw_path} is outside the allowed directories")
+            if not path.is_file():
+                raise ValueError(f"{raw_path} does not exist")
+            items.append({"name": path.name, "path": str(path)})
+        return items
+
+    def get(self, job_id: str) -> Job:
+        return self.jobs[job_id]
+
+    async def delete(self, job_id: str):
+        job = self.jobs.pop(job_id)
+        job.cancelled = True
+        task = self.tasks.pop(job_id, None)
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        job.close()
+        await asyncio.to_thread(shutil.rmtree, job.directory, True)
+
+    def _launch(self, job: Job):
+        task = asyncio.create_task(self._run(job))
+        self.tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job.job_id, None))
+
+    async def _run(self, job: Job):
+        pending = deque(job.pending())
+        job.run_started = time.monotonic()
+
+        async def worker():
+            while pending:
+                await self._run_item(job, pending.popleft())
+
+        await asyncio.gather(*(worker() for _ in range(job.spec["concurrency"])))
+        job.finished_at = time.monotonic()
+        job.close()
+
+    async def _run_item(self, job: Job, index: int):
+        attempts = 0
+        while True:
+            try:
+                data = await asyncio.to_thread(job.read_input, index)
+                # The same header checks as interactive uploads; retrying won't change the answer
+                check_image(*sniff(io.BytesIO(data)))
+                async with self.slots:
+                    encoded, _ = await self.processor.run_pipeline(
+                        io.BytesIO(data), job.spec["steps"], job.output, memoize=False
+                    )
+                name = await asyncio.to_thread(job.write_output, index, encoded.data, encoded.media_type)
+                job.record(index, "done", file=name, attempts=attempts + 1)
+                break
+            except ServerBusyError as e:
+                await asyncio.sleep(e.retry_after)
+            except UploadRejected as e:
+                job.record(index, "failed", error=str(e), attempts=attempts + 1)
+                break
+            except Exception as e:
+                attempts += 1
+                if attempts >= settings.JOB_MAX_ATTEMPTS:
+                    print(f"Job {job.job_id}: {job.items[index]['name']} failed: {e}")
+                    job.record(index, "failed", error=str(e), attempts=attempts)
+                    break
+                await asyncio.sleep(settings.JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1))
+        job.processed_this_run += 1
+
+    def iter_results(self, job: Job):
+        """Stream finished outputs as a ZIP, with a manifest of every item's status"""
+        stream = ZipStream()
+        for name, path in job.result_files():
+            yield stream.add_file(name, path)
+        manifest = {
+            "status": job.status(),
+            "items": [
+                {"name": item["name"], **job.results.get(index, {"status": "pending"})}
+                for index, item in enumerate(job.items)
+            ]
+        }
+        yield stream.add_bytes("manifest.json", json.dumps(manifest, indent=2), zipfile.ZIP_DEFLATED)
+        yield stream.close()
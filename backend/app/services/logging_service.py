@@ -1,23 +1,50 @@
-from google.cloud import bigquery
+from abc import ABC, abstractmethod
 from datetime import datetime
+import asyncio
 import time
 from fastapi import Request
-from typing import Optional
+from typing import Optional, List
 from app.core.config import settings
 import os
 from pathlib import Path
 import json
 
-class LoggingService:
+class LogSink(ABC):
+    """Destination for batches of request log rows"""
+    @abstractmethod
+    def write(self, rows: List[dict]):
+        pass
+
+class NullSink(LogSink):
+    def write(self, rows: List[dict]):
+        pass
+
+class FileSink(LogSink):
+    """Appends rows to a local JSONL file"""
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def write(self, rows: List[dict]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+
+class BigQuerySink(LogSink):
     def __init__(self):
+        # Imported here: the client library takes most of a second to import
+        from google.cloud import bigquery
+
+        if not settings.GOOGLE_APPLICATION_CREDENTIALS or not settings.PROJECT_ID:
+            raise ValueError("GOOGLE_APPLICATION_CREDENTIALS and PROJECT_ID are required for the BigQuery sink")
         # Convert relative path to absolute path
         credentials_path = Path(settings.GOOGLE_APPLICATION_CREDENTIALS).resolve()
-        
+
         if not credentials_path.exists():
             raise FileNotFoundError(f"Credentials file not found at: {credentials_path}")
-            
+
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = str(credentials_path)
-        
+
         try:
             self.client = bigquery.Client(project=settings.PROJECT_ID)
             self.table_id = f"{settings.PROJECT_ID}.{settings.DATASET_ID}.{settings.TABLE_ID}"
@@ -29,6 +56,7 @@ class LoggingService:
 
     def _ensure_table_exists(self):
         """Create dataset and table if they don't exist"""
+        from google.cloud import bigquery
         try:
             dataset_ref = self.client.dataset(settings.DATASET_ID)
             try:
@@ -64,6 +92,149 @@ class LoggingService:
         except Exception as e:
             print(f"Error setting up BigQuery: {str(e)}")
 
+    def write(self, rows: List[dict]):
+        errors = self.client.insert_rows_json(self.table_id, rows)
+        if errors:
+            raise RuntimeError(f"Errors inserting rows: {errors}")
+
+def bigquery_configured() -> bool:
+    return all((settings.GOOGLE_APPLICATION_CREDENTIALS, settings.PROJECT_ID,
+                settings.DATASET_ID, settings.TABLE_ID))
+
+def create_sink(name: str) -> LogSink:
+    if name == "auto":
+        name = "bigquery" if bigquery_configured() else "file"
+    if name == "bigquery":
+        return BigQuerySink()
+    if name == "file":
+        return FileSink(settings.LOG_FILE_PATH)
+    if name == "none":
+        return NullSink()
+    raise ValueError(f"Unsupported log sink: {name}")
+
+class LoggingService:
+    """Queues request log rows and writes them to the sink in batches from a background task"""
+
+    def __init__(self, sink: Optional[LogSink] = None):
+        # Created by the flush task, so importing this module stays cheap and
+        # the BigQuery round trips happen off the startup path
+        self.sink = sink
+        self.spill = FileSink(settings.LOG_SPILL_PATH)
+        self.queue = None
+        self.task = None
+        self.dropped = 0
+
+    async def start(self):
+        """Start the flush task; called from the lifespan hook or lazily on first log"""
+        if self.task and not self.task.done():
+            return
+        if self.task is not None:
+            self._report(self.task)
+        # Rows queued while a previous task was down carry over to the new queue
+        queue, self.queue = self.queue, asyncio.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+        while queue is not None and not queue.empty():
+            row = queue.get_nowait()
+            if row is not None:
+                self.queue.put_nowait(row)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the flush task"""
+        if not self.task:
+            return
+        if not self.task.done():
+            # The sentinel queues up behind pending rows, so they all get flushed first
+            await self.queue.put(None)
+            await asyncio.wait([self.task])
+        self._report(self.task)
+        self.task = None
+
+    def _report(self, task: asyncio.Task):
+        # A failed flush task is restarted or shut down, never re-raised into the app
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Log flush task failed: {str(task.exception())}")
+
+    async def _open_sink(self):
+        if self.sink is not None:
+            return
+        try:
+            self.sink = await asyncio.to_thread(create_sink, settings.LOG_SINK)
+        except Exception as e:
+            # Rows are kept in the spill file and replayed once a sink works again
+            print(f"Error creating {settings.LOG_SINK} log sink, spilling to {self.spill.path}: {str(e)}")
+            self.sink = self.spill
+
+    async def _run(self):
+        await self._open_sink()
+        try:
+            await self._replay_spill()
+        except Exception as e:
+            # The spilled rows stay on disk and are retried on the next start
+            print(f"Error replaying spilled log rows: {str(e)}")
+        while True:
+            row = await self.queue.get()
+            if row is None:
+                return
+            batch = [row]
+            deadline = time.monotonic() + settings.LOG_FLUSH_INTERVAL_SECONDS
+            while len(batch) < settings.LOG_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    await self._flush(batch)
+                    return
+                batch.append(row)
+            await self._flush(batch)
+
+    async def _flush(self, rows: List[dict]):
+        """Write a batch with exponential backoff, spilling to disk if the sink stays down"""
+        if not rows:
+            return
+        delay = settings.LOG_RETRY_BACKOFF_SECONDS
+        for attempt in range(settings.LOG_MAX_RETRIES + 1):
+            try:
+                await asyncio.to_thread(self.sink.write, rows)
+                return
+            except Exception as e:
+                print(f"Error writing {len(rows)} log rows (attempt {attempt + 1}): {str(e)}")
+                if attempt < settings.LOG_MAX_RETRIES:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+        try:
+            await asyncio.to_thread(self.spill.write, rows)
+        except Exception as e:
+            print(f"Error spilling log rows: {str(e)}")
+
+    async def _replay_spill(self):
+        """Send rows spilled by a previous run back through the sink"""
+        path = self.spill.path
+        if isinstance(self.sink, NullSink) or self.sink is self.spill:
+            return
+        replay_path = path.with_suffix(".replay")
+        # A replay interrupted by a crash is picked up before anything spilled since
+        if not replay_path.exists():
+            if not path.exists():
+                return
+            path.replace(replay_path)
+        rows = []
+        with replay_path.open() as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Torn by a crash mid-write; counted with the dropped rows
+                    self.dropped += 1
+        replay_path.unlink()
+        for i in range(0, len(rows), settings.LOG_BATCH_SIZE):
+            await self._flush(rows[i:i + settings.LOG_BATCH_SIZE])
+
     async def log_request(
         self,
         request: Request,
@@ -76,7 +247,7 @@ class LoggingService:
         metadata: Optional[dict] = None
     ):
         try:
-            rows = [{
+            row = {
                 "datetime": datetime.utcnow().isoformat(),
                 "user_email": user_email,
                 "user_ip": request.client.host if hasattr(request, "client") else None,
@@ -87,10 +258,15 @@ class LoggingService:
                 "error_message": error_message or "",
                 "task": task or "",
                 "tool_url": tool_url or str(request.base_url) if hasattr(request, "base_url") else ""
-            }]
+            }
 
-            errors = self.client.insert_rows_json(self.table_id, rows)
-            if errors:
-                print(f"Errors inserting rows: {errors}")
+            if self.task is None or self.task.done():
+                await self.start()
+            # Never wait on the sink in the request path: drop the row if the queue is full
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.dropped += 1
         except Exception as e:
-            print(f"Error logging to BigQuery: {str(e)}") 
\ No newline at end of file
+            print(f"Error queueing log row: {str(e)}")
+
+logging_service = LoggingService()
@@ -0,0 +1,157 @@
+"""In-process metrics: stage timings per request and a Prometheus text endpoint.
+
+Code wraps work in ``stage(name, operation)``. Each stage is observed in the
+``image_stage_seconds`` histogram and appended to the current request's
+timings, which the logging middleware turns into a ``Server-Timing``
+header. A stage costs two perf_counter calls, a bisect and a lock, so
+instrumentation stays on in production. The request timings live in a
+context variable; FilterExecutor runs work inside a copy of the caller's
+context so stages recorded on worker threads still reach the request.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Sequence
+import threading
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MEGAPIXEL_BUCKETS = (0.3, 1, 2, 5, 12, 24, 50, 100)
+BATCH_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = f'le="{_number(float(bound))}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+def render_gauge(name: str, documentation: str, samples: dict, labelname: str = None,
+                 kind: str = "gauge") -> List[str]:
+    """Gauge lines for values read at scrape time; samples maps label value (or None) to value"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for label, value in sorted(samples.items(), key=lambda item: str(item[0])):
+        labels = _labels((labelname,), (label,)) if labelname else ""
+        lines.append(f"{name}{labels} {_number(value)}")
+    return lines
+
+def render_counter(name: str, documentation: str, samples: dict, labelname: str = None) -> List[str]:
+    """Counter lines for a running total kept elsewhere, read at scrape time"""
+    return render_gauge(name, documentation, samples, labelname, kind="counter")
+
+STAGE_SECONDS = Histogram(
+    "image_stage_seconds", "Time spent per processing stage", ("operation", "stage")
+)
+INPUT_MEGAPIXELS = Histogram(
+    "image_input_megapixels", "Size of images entering a filter", ("operation",), MEGAPIXEL_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "End-to-end request latency", ("method", "route", "status")
+)
+REQUESTS = Counter("http_requests_total", "Requests served", ("method", "route", "status"))
+INFERENCE_BATCH_SIZE = Histogram(
+    "inference_batch_size", "Images per segmentation forward pass", ("model",), BATCH_BUCKETS
+)
+INFERENCE_QUEUE_SECONDS = Histogram(
+    "inference_queue_seconds", "Time a segmentation request waited for its batch", ("model",)
+)
+
+METRICS = (STAGE_SECONDS, INPUT_MEGAPIXELS, REQUEST_SECONDS, REQUESTS, INFERENCE_BATCH_SIZE, INFERENCE_QUEUE_SECONDS)
+
+# (stage, operation, seconds) for the request being handled, None outside requests
+_request_stages: ContextVar[Optional[list]] = ContextVar("request_stages", default=None)
+
+def begin_request() -> list:
+    stages = []
+    _request_stages.set(stages)
+    return stages
+
+@contextmanager
+def stage(name: str, operation: str = ""):
+    """Time a block as a stage of the current request and of the stage histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, operation=operation, stage=name)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((name, operation, elapsed))
+
+def server_timing(stages: list, total: float) -> str:
+    """Server-Timing header value, e.g. 'decode;dur=12.1, filter;desc="exposure";dur=3.4'"""
+    entries = []
+    for name, operation, elapsed in stages:
+        desc = f';desc="{operation}"' if operation else ""
+        entries.append(f"{name}{desc};dur={elapsed * 1000:.1f}")
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+def render(extra_lines: List[str] = ()) -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,79 @@
+"""Benchmark suite for filters and endpoints with regression gates.
+
+Run from backend/, fully offline (BigQuery and the rembg model are stubbed):
+
+    python -m benchmarks                      # filters + load, full matrix
+    python -m benchmarks --quick              # small sizes, fewer requests (CI)
+    python -m benchmarks filters --only exposure sharpness
+    python -m benchmarks load --url http://localhost:8005
+    python -m benchmarks startup              # cold-start budget, exit 1 if over
+    python -m benchmarks segmentation         # real models: latency, load time, memory
+    python -m benchmarks --save-baseline      # store results as the baseline
+    python -m benchmarks --compare            # exit 1 if anything regressed
+
+The segmentation suite is the exception: it downloads the real models on
+first run, so it is not part of "all".
+
+Baselines are written to benchmarks/baselines/<name>.json and are only
+comparable on the machine that produced them.
+"""
+from benchmarks import stubs
+import argparse
+import sys
+from benchmarks import report
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("suite", nargs="?", choices=("all", "filters", "load", "startup", "segmentation"), default="all")
+    parser.add_argument("--quick", action="store_true", help="0.3 and 2 MP only, fewer requests")
+    parser.add_argument("--only", nargs="*", help="only cases whose name contains one of these")
+    parser.add_argument("--url", help="load an already running server instead of the in-process app")
+    parser.add_argument("--load-megapixels", type=float, default=2, help="size of the uploaded image")
+    parser.add_argument("--baseline", default=None, help="baseline name (default: full or quick)")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="compare with the baseline, exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown before flagging")
+    args = parser.parse_args(argv)
+
+    results = {}
+    failed = []
+    if args.suite in ("all", "startup"):
+        from benchmarks import startup
+        print("Cold start")
+        startup_results = startup.run(quick=args.quick)
+        failed = startup.over_budget(startup_results)
+        results.update(startup_results)
+    if args.suite in ("all", "filters"):
+        from benchmarks import filters
+        print("Filter micro-benchmarks")
+        results.update(filters.run(quick=args.quick, only=args.only))
+    if args.suite in ("all", "load"):
+        from benchmarks import load
+        print("End-to-end load")
+        results.update(load.run(quick=args.quick, url=args.url, megapixels=args.load_megapixels, only=args.only))
+    if args.suite == "segmentation":
+        from benchmarks import segmentation
+        print("Segmentation models")
+        results.update(segmentation.run(quick=args.quick, only=args.only))
+
+    name = args.baseline or ("quick" if args.quick else "full")
+    if args.save_baseline:
+        print(f"Baseline written to {report.save(results, name)}")
+    if args.compare:
+        try:
+            baseline = report.load(name)
+        except FileNotFoundError:
+            print(f"No baseline named {name!r}, run with --save-baseline first")
+            return 1
+        rows = report.compare(baseline["results"], results, args.threshold)
+        report.print_report(rows, args.threshold)
+        if any(row["regression"] for row in rows):
+            return 1
+    if failed:
+        print(f"Over the startup budget: {', '.join(failed)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
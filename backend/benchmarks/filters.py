@@ -0,0 +1,104 @@
+"""Micro-benchmarks: every filter, load_image and convert_to_base64 over the size/mode/format matrix"""
+from benchmarks import stubs
+import io
+import secrets
+import statistics
+import time
+from benchmarks.images import SIZES_MP, MODES, FORMATS, catalogue_image, encoded
+from app.services.image_processor import ImageProcessor
+from app.services.image_processor.frame import Frame
+from app.services.image_processor.geometry import transform
+from app.services.image_processor.utils import decode_image, encode_base64
+
+def filter_params(operation: str, size) -> dict:
+    width, height = size
+    return {
+        'exposure': {'value': 0.3},
+        'highlights': {'value': -0.3},
+        'shadows': {'value': 0.3},
+        'sharpness': {'value': 0.5},
+        'rotate': {'angle': 90},
+        'flip': {'flipX': True},
+        'crop': {'x': width // 4, 'y': height // 4, 'width': width // 2, 'height': height // 2},
+        'remove_background': {'quality': 'balanced'},
+        'resize': {'width': 1000, 'height': 1000},
+        'white_background': {},
+    }.get(operation, {})
+
+def geometry_chains(size) -> dict:
+    """Editor-style geometric edits ending in an export resize"""
+    width, height = size
+    crop = {'operation': 'crop', 'params': {'x': width // 8, 'y': height // 8,
+                                            'width': width * 3 // 4, 'height': height * 3 // 4}}
+    resize = {'operation': 'resize', 'params': {'width': 1000, 'height': 1000}}
+    return {
+        'turn': [crop, {'operation': 'rotate', 'params': {'angle': 90}},
+                 {'operation': 'flip', 'params': {'flipX': True}}, resize],
+        'straighten': [{'operation': 'rotate', 'params': {'angle': 3}}, crop, resize],
+    }
+
+def measure(func, repeat: int = 5, budget_seconds: float = 3.0) -> dict:
+    """Median and best wall time after one warm-up call; large cases stop early at the budget"""
+    func()
+    samples = []
+    deadline = time.perf_counter() + budget_seconds
+    while len(samples) < repeat and (len(samples) < 2 or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(samples), "min_ms": min(samples), "runs": len(samples)}
+
+def run(quick: bool = False, only=None) -> dict:
+    sizes = SIZES_MP[:2] if quick else SIZES_MP
+    repeat = 3 if quick else 5
+    stubs.install()
+    processor = ImageProcessor()
+    results = {}
+
+    def record(name: str, megapixels: float, func):
+        if only and not any(part in name for part in only):
+            return
+        result = measure(func, repeat)
+        result["mpix_per_s"] = megapixels / (result["median_ms"] / 1000)
+        results[name] = result
+        print(f"  {name:<45} {result['median_ms']:>10.1f} ms  {result['mpix_per_s']:>8.1f} MP/s")
+
+    try:
+        for megapixels in sizes:
+            for mode in MODES:
+                image = catalogue_image(megapixels, mode)
+                for operation, filter_instance in processor.filters.items():
+                    params = filter_params(operation, image.size)
+
+                    def run_filter():
+                        # Fresh key so background removal measures inference, not its cache
+                        image.info['content_key'] = secrets.token_hex(20)
+                        filter_instance.run(image, params)
+
+                    record(f"filter/{operation}/{mode}/{megapixels}MP", megapixels, run_filter)
+
+                frame = Frame.from_image(image)
+                for chain, steps in geometry_chains(image.size).items():
+
+                    def one_by_one():
+                        result = image
+                        for step in steps:
+                            result = processor.filters[step['operation']].run(result, step['params'])
+
+                    record(f"geometry/{chain}/one_by_one/{mode}/{megapixels}MP", megapixels, one_by_one)
+                    record(f"geometry/{chain}/fused/{mode}/{megapixels}MP", megapixels,
+                           lambda: transform(image, steps))
+                    record(f"geometry/{chain}/fused_frame/{mode}/{megapixels}MP", megapixels,
+                           lambda: transform(frame, steps))
+
+                record(f"convert_to_base64/{mode}/{megapixels}MP", megapixels, lambda: encode_base64(image))
+
+                for format in FORMATS:
+                    if format == "JPEG" and mode == "RGBA":
+                        continue
+                    data = encoded(megapixels, mode, format)
+                    record(f"load_image/{format}/{mode}/{megapixels}MP", megapixels,
+                           lambda: decode_image(io.BytesIO(data)))
+    finally:
+        processor.shutdown()
+    return results
@@ -0,0 +1,50 @@
+"""Deterministic synthetic catalogue images.
+
+A product shot is mostly a smooth backdrop with a textured subject, which
+compresses very differently from pure noise or a flat colour; the
+generator mimics that so encode and decode timings are realistic.
+"""
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFilter
+import io
+import numpy as np
+
+# Megapixel sizes of the matrix; --quick keeps the first two
+SIZES_MP = (0.3, 2, 12, 24, 50)
+MODES = ("RGB", "RGBA")
+FORMATS = ("JPEG", "PNG", "WEBP")
+
+def dimensions(megapixels: float) -> tuple:
+    """3:2 frame of roughly the given megapixels"""
+    height = int((megapixels * 1_000_000 / 1.5) ** 0.5)
+    return int(height * 1.5), height
+
+@lru_cache(maxsize=8)
+def catalogue_image(megapixels: float, mode: str = "RGB") -> Image.Image:
+    width, height = dimensions(megapixels)
+    # Vertical backdrop gradient
+    ramp = np.linspace(235, 180, height, dtype=np.float32)[:, None, None]
+    backdrop = np.broadcast_to(ramp, (height, width, 3)).astype(np.uint8)
+    image = Image.fromarray(backdrop, "RGB")
+
+    # Textured subject: fine noise inside a soft-edged ellipse
+    rng = np.random.default_rng(int(megapixels * 10))
+    texture = rng.integers(40, 200, (height // 4 + 1, width // 4 + 1, 3), dtype=np.uint8)
+    subject = Image.fromarray(texture, "RGB").resize((width, height), Image.Resampling.BILINEAR)
+    mask = Image.new("L", (width, height), 0)
+    ImageDraw.Draw(mask).ellipse((width // 4, height // 6, width * 3 // 4, height * 5 // 6), fill=255)
+    mask = mask.filter(ImageFilter.GaussianBlur(max(1, width // 400)))
+    image.paste(subject, mask=mask)
+
+    if mode == "RGBA":
+        image.putalpha(mask.point(lambda v: max(v, 32)))
+    return image
+
+@lru_cache(maxsize=16)
+def encoded(megapixels: float, mode: str, format: str) -> bytes:
+    image = catalogue_image(megapixels, mode)
+    if format == "JPEG" and mode == "RGBA":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **({"quality": 90} if format != "PNG" else {"compress_level": 6}))
+    return buffer.getvalue()
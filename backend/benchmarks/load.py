@@ -0,0 +1,121 @@
+"""End-to-end load generator: throughput and latency percentiles at set concurrency levels.
+
+By default the FastAPI app runs in-process (lifespan included) behind
+httpx's ASGI transport, so client and server share one event loop and CPU
+work still goes to the app's own worker pools. Pass a URL to load a real
+uvicorn deployment instead.
+"""
+from benchmarks import stubs
+import asyncio
+import json
+import random
+import statistics
+import time
+import httpx
+from benchmarks.images import encoded
+
+CONCURRENCY_LEVELS = (1, 4, 16)
+
+def exposure_request(image: bytes) -> dict:
+    # A fresh value per request so the intermediate cache can't answer it
+    value = round(random.uniform(-0.5, 0.5), 3)
+    return {
+        "url": "/api/process-image",
+        "files": {"image": ("bench.jpg", image, "image/jpeg")},
+        "headers": {"operation": "exposure", "params": json.dumps({"value": value})}
+    }
+
+def pipeline_request(image: bytes) -> dict:
+    steps = [
+        {"operation": "highlights", "params": {"value": round(random.uniform(-0.5, 0.5), 3)}},
+        {"operation": "sharpness", "params": {"value": 0.5}},
+        {"operation": "resize", "params": {"width": 1000, "height": 1000}},
+    ]
+    return {
+        "url": "/api/pipeline",
+        "files": {"image": ("bench.jpg", image, "image/jpeg")},
+        "data": {"steps": json.dumps(steps)}
+    }
+
+def remove_background_request(image: bytes) -> dict:
+    return {
+        "url": "/api/process-image",
+        "files": {"image": ("bench.jpg", image, "image/jpeg")},
+        "headers": {"operation": "remove_background", "params": json.dumps({"quality": "balanced"})}
+    }
+
+SCENARIOS = {
+    "process-image/exposure": exposure_request,
+    "pipeline/highlights+sharpness+resize": pipeline_request,
+    "process-image/remove_background": remove_background_request,
+}
+
+def percentile(samples, fraction: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+async def run_level(client: httpx.AsyncClient, build, image: bytes, concurrency: int, requests: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            request = build(image)
+            url = request.pop("url")
+            start = time.perf_counter()
+            response = await client.post(url, **request)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "mean_ms": statistics.mean(latencies),
+        "errors": errors
+    }
+
+async def run_all(client: httpx.AsyncClient, image: bytes, requests: int, levels, only) -> dict:
+    results = {}
+    for scenario, build in SCENARIOS.items():
+        if only and not any(part in scenario for part in only):
+            continue
+        for concurrency in levels:
+            # Let pools and caches settle before measuring
+            await run_level(client, build, image, concurrency, concurrency)
+            result = await run_level(client, build, image, concurrency, requests)
+            name = f"load/{scenario}/c{concurrency}"
+            results[name] = result
+            print(f"  {name:<50} {result['throughput_rps']:>7.1f} req/s  "
+                  f"p50 {result['p50_ms']:>7.1f}  p95 {result['p95_ms']:>7.1f}  "
+                  f"p99 {result['p99_ms']:>7.1f} ms  errors {result['errors']}")
+    return results
+
+async def _run(quick: bool, url: str, megapixels: float, only) -> dict:
+    image = encoded(megapixels, "RGB", "JPEG")
+    requests = 20 if quick else 100
+    levels = CONCURRENCY_LEVELS[:2] if quick else CONCURRENCY_LEVELS
+    timeout = httpx.Timeout(300.0)
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=timeout) as client:
+            return await run_all(client, image, requests, levels, only)
+
+    stubs.install()
+    from app.main import app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+            return await run_all(client, image, requests, levels, only)
+
+def run(quick: bool = False, url: str = None, megapixels: float = 2, only=None) -> dict:
+    return asyncio.run(_run(quick, url, megapixels, only))
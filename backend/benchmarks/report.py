@@ -0,0 +1,73 @@
+"""Stored baselines and the regression report"""
+from datetime import datetime, timezone
+from pathlib import Path
+import json
+import os
+import platform
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+
+# Metrics compared against the baseline and whether lower is better
+METRICS = {
+    "median_ms": True,
+    "p95_ms": True,
+    "p99_ms": True,
+    "throughput_rps": False,
+}
+# Timing differences below this are noise whatever the percentage
+MIN_DELTA_MS = 1.0
+
+def machine() -> dict:
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count()
+    }
+
+def save(results: dict, name: str) -> Path:
+    BASELINE_DIR.mkdir(exist_ok=True)
+    path = BASELINE_DIR / f"{name}.json"
+    data = {"created_at": datetime.now(timezone.utc).isoformat(), "machine": machine(), "results": results}
+    path.write_text(json.dumps(data, indent=2, sort_keys=True))
+    return path
+
+def load(name: str) -> dict:
+    return json.loads((BASELINE_DIR / f"{name}.json").read_text())
+
+def compare(baseline: dict, current: dict, threshold: float = 0.15) -> list:
+    """One row per shared case and metric; a row regresses when it is worse by more than threshold"""
+    rows = []
+    for case in sorted(set(baseline) & set(current)):
+        for metric, lower_is_better in METRICS.items():
+            if metric not in baseline[case] or metric not in current[case]:
+                continue
+            before = baseline[case][metric]
+            after = current[case][metric]
+            if not before:
+                continue
+            change = (after - before) / before
+            worse = change if lower_is_better else -change
+            if metric.endswith("_ms") and abs(after - before) < MIN_DELTA_MS:
+                worse = 0.0
+            rows.append({
+                "case": case,
+                "metric": metric,
+                "baseline": before,
+                "current": after,
+                "change": change,
+                "regression": worse > threshold
+            })
+    return rows
+
+def print_report(rows: list, threshold: float):
+    if not rows:
+        print("No cases in common with the baseline")
+        return
+    print(f"\n{'case':<55} {'metric':<15} {'baseline':>10} {'current':>10} {'change':>8}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['case']:<55} {row['metric']:<15} {row['baseline']:>10.1f} "
+              f"{row['current']:>10.1f} {row['change']:>+7.0%}{flag}")
+    regressions = sum(row["regression"] for row in rows)
+    print(f"\n{regressions} regression(s) over {threshold:.0%} in {len(rows)} comparisons")
@@ -0,0 +1,75 @@
+"""Segmentation models on CPU: load time, resident memory and inference latency.
+
+Unlike the other suites this needs the real models. They are downloaded,
+and the -int8 variants quantized, on first run. A model that can't be
+fetched is reported and skipped. Each model is measured in a fresh
+interpreter so its memory isn't hidden by another model's arena.
+Latency is one forward pass on a catalogue image, at the model's input size.
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+from app.services.image_processor.models import MODELS
+
+CHILD = """
+import json, os, statistics, sys, time
+from benchmarks import stubs
+from benchmarks.images import catalogue_image
+from app.services.image_processor import models
+from app.services.image_processor.matting import predict_mask
+
+def rss():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+name, runs = sys.argv[1], int(sys.argv[2])
+try:
+    # Downloading and quantizing are not part of the load time
+    path = models.model_file(name)
+except Exception as e:
+    print(json.dumps({"error": f"{type(e).__name__}: {e}"}))
+    sys.exit(0)
+
+image = catalogue_image(2)
+before = rss()
+start = time.perf_counter()
+session = models.create_session(name)
+load_ms = (time.perf_counter() - start) * 1000
+predict_mask(session, image)
+resident = rss() - before
+
+samples = []
+for _ in range(runs):
+    start = time.perf_counter()
+    predict_mask(session, image)
+    samples.append((time.perf_counter() - start) * 1000)
+print(json.dumps({
+    "median_ms": statistics.median(samples),
+    "p95_ms": sorted(samples)[max(0, round(0.95 * len(samples)) - 1)],
+    "load_ms": load_ms,
+    "rss_mb": resident / 2**20,
+    "file_mb": os.path.getsize(path) / 2**20,
+    "runs": runs
+}))
+"""
+
+def measure(name: str, runs: int) -> dict:
+    completed = subprocess.run([sys.executable, "-c", CHILD, name, str(runs)], cwd=Path(__file__).parent.parent,
+                               capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def run(quick: bool = False, only=None) -> dict:
+    results = {}
+    for name in MODELS:
+        if only and not any(part in name for part in only):
+            continue
+        result = measure(name, 5 if quick else 20)
+        if "error" in result:
+            print(f"  segmentation/{name:<33} skipped: {result['error']}")
+            continue
+        results[f"segmentation/{name}"] = result
+        print(f"  segmentation/{name:<33} {result['median_ms']:>8.1f} ms  p95 {result['p95_ms']:>8.1f} ms  "
+              f"load {result['load_ms']:>7.0f} ms  {result['rss_mb']:>6.0f} MB resident  "
+              f"({result['file_mb']:.0f} MB file)")
+    return results
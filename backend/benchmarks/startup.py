@@ -0,0 +1,84 @@
+"""Cold-start budget: import time and time to the first served request.
+
+Each run is a fresh interpreter, timed from the moment it is spawned, so
+the numbers include interpreter boot and every import on the startup path.
+The first request goes through the full lifespan (processor, stores, job
+resume) and a real filter, not just the health check.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Seconds; an autoscaled replica should take traffic within these
+BUDGETS = {
+    "startup/import": 1.5,
+    "startup/first_request": 3.0,
+}
+# Must never be imported on the startup path
+HEAVY_MODULES = ("rembg", "onnxruntime", "cv2", "google.cloud.bigquery", "skimage")
+
+CHILD = """
+import os, sys, time, json
+spawned = float(os.environ["BENCH_SPAWNED_AT"])
+from benchmarks import stubs
+import app.main
+imported = time.time() - spawned
+heavy = [name for name in json.loads(os.environ["BENCH_HEAVY_MODULES"]) if name in sys.modules]
+
+import asyncio, io, httpx
+from PIL import Image
+stubs.install()
+
+async def first_request():
+    upload = io.BytesIO()
+    Image.new("RGB", (640, 480), "gray").save(upload, "JPEG")
+    async with app.main.app.router.lifespan_context(app.main.app):
+        transport = httpx.ASGITransport(app=app.main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.post(
+                "/api/process-image",
+                files={"image": ("bench.jpg", upload.getvalue(), "image/jpeg")},
+                headers={"operation": "exposure", "params": json.dumps({"value": 0.2})}
+            )
+            served = time.time() - spawned
+    return response.status_code, served
+
+status, served = asyncio.run(first_request())
+print(json.dumps({"import_s": imported, "first_request_s": served, "status": status, "heavy": heavy}))
+"""
+
+def cold_start() -> dict:
+    env = {**os.environ, "BENCH_HEAVY_MODULES": json.dumps(HEAVY_MODULES)}
+    env["BENCH_SPAWNED_AT"] = repr(time.time())
+    completed = subprocess.run([sys.executable, "-c", CHILD], cwd=Path(__file__).parent.parent,
+                               env=env, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def run(quick: bool = False) -> dict:
+    runs = [cold_start() for _ in range(3 if quick else 7)]
+    for result in runs:
+        if result["status"] != 200:
+            raise RuntimeError(f"First request failed with status {result['status']}")
+    results = {
+        "startup/import": {"median_ms": statistics.median(r["import_s"] for r in runs) * 1000},
+        "startup/first_request": {"median_ms": statistics.median(r["first_request_s"] for r in runs) * 1000},
+    }
+    for name, result in results.items():
+        print(f"  {name:<45} {result['median_ms']:>10.1f} ms  (budget {BUDGETS[name] * 1000:.0f} ms)")
+    heavy = sorted({name for r in runs for name in r["heavy"]})
+    if heavy:
+        print(f"  heavy modules imported at startup: {', '.join(heavy)}")
+    results["startup/import"]["heavy_modules"] = heavy
+    return results
+
+def over_budget(results: dict) -> list:
+    """Names of startup cases over their budget, or importing a heavy module"""
+    failed = [name for name, budget in BUDGETS.items()
+              if name in results and results[name]["median_ms"] > budget * 1000]
+    if results.get("startup/import", {}).get("heavy_modules"):
+        failed.append("startup/heavy_modules")
+    return failed
@@ -1,5 +1,15 @@
+import os
+import tempfile
 import pytest
 from fastapi.testclient import TestClient
+
+# Keep request logs local so the suite runs without GCP
+os.environ.setdefault("LOG_SINK", "none")
+# Bulk jobs persist to disk, keep them out of the working tree
+os.environ.setdefault("JOBS_DIR", tempfile.mkdtemp(prefix="jobs-"))
+# Don't download segmentation models; tests that need a session stub it
+os.environ.setdefault("WARMUP_ON_STARTUP", "false")
+
 from app.main import app
 import io
 from PIL import Image
@@ -7,7 +17,9 @@ import numpy as np
 
 @pytest.fixture
 def client():
-    return TestClient(app)
+    # Entering the client runs the lifespan hook that builds the processor
+    with TestClient(app) as client:
+        yield client
 
 @pytest.fixture
 def test_image():
@@ -0,0 +1,61 @@
+import threading
+import numpy as np
+from PIL import Image
+from app.services.image_processor.batching import InferenceBatcher, to_tensor, IMAGENET
+
+class FakeInput:
+    name = "input.1"
+    shape = ["batch_size", 3, 320, 320]
+
+class FakeInnerSession:
+    """ONNX session stand-in: the 'mask' is the red channel of the input tensor"""
+    def __init__(self):
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [FakeInput()]
+
+    def run(self, outputs, feeds):
+        tensor = feeds["input.1"]
+        self.batch_sizes.append(len(tensor))
+        return [tensor[:, :1]]
+
+class FakeSession:
+    model_name = "u2net_human_seg"
+
+    def __init__(self):
+        self.inner_session = FakeInnerSession()
+
+def test_concurrent_requests_share_one_forward_pass():
+    session = FakeSession()
+    batcher = InferenceBatcher(session, max_batch=4, window_ms=2000)
+    sizes = [(320, 240), (200, 320), (320, 320), (100, 50)]
+    results = {}
+
+    def call(size):
+        results[size] = batcher.predict(Image.new("RGB", size, (255, 0, 0)))
+
+    threads = [threading.Thread(target=call, args=(size,)) for size in sizes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # A full batch goes out without waiting for the rest of the window
+    assert session.inner_session.batch_sizes == [4]
+    for size in sizes:
+        [mask] = results[size]
+        assert mask.mode == "L" and mask.size == size
+
+def test_preprocessing_matches_rembg():
+    from rembg.sessions.base import BaseSession
+
+    class Inner:
+        def get_inputs(self):
+            return [FakeInput()]
+
+    session = BaseSession.__new__(BaseSession)
+    session.inner_session = Inner()
+    image = Image.effect_noise((300, 200), 60).convert("RGB")
+    expected = session.normalize(image, *IMAGENET, (320, 320))["input.1"][0]
+    assert np.allclose(to_tensor(image, *IMAGENET, 320), expected, atol=1e-4)
@@ -0,0 +1,17 @@
+from benchmarks.report import compare
+
+def test_compare_flags_slowdowns_and_throughput_drops():
+    baseline = {
+        "filter/exposure/RGB/2MP": {"median_ms": 10.0},
+        "load/process-image/exposure/c4": {"p95_ms": 100.0, "throughput_rps": 40.0},
+        "filter/removed": {"median_ms": 5.0},
+    }
+    current = {
+        "filter/exposure/RGB/2MP": {"median_ms": 11.0},
+        "load/process-image/exposure/c4": {"p95_ms": 90.0, "throughput_rps": 30.0},
+    }
+    rows = {(row["case"], row["metric"]): row for row in compare(baseline, current, threshold=0.15)}
+    assert len(rows) == 3
+    assert not rows[("filter/exposure/RGB/2MP", "median_ms")]["regression"]
+    assert not rows[("load/process-image/exposure/c4", "p95_ms")]["regression"]
+    assert rows[("load/process-image/exposure/c4", "throughput_rps")]["regression"]
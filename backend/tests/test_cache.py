@@ -0,0 +1,42 @@
+from PIL import Image
+from app.services.image_processor.cache import ImageCache
+
+def cutout(size=(40, 30)):
+    image = Image.new("RGBA", size, (200, 10, 10, 255))
+    image.putpixel((0, 0), (0, 0, 0, 0))
+    return image
+
+def test_disk_tier_serves_results_across_instances(tmp_path):
+    writer = ImageCache(cache_dir=str(tmp_path))
+    writer.put("ab" * 20, cutout())
+
+    reader = ImageCache(cache_dir=str(tmp_path))
+    cached = reader.get("ab" * 20)
+    assert cached.getpixel((1, 1)) == (200, 10, 10, 255)
+    assert reader.stats()["disk_hits"] == 1
+    assert reader.get("cd" * 20) is None
+    assert reader.stats()["misses"] == 1
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    entry_bytes = 40 * 30 * 4
+    cache = ImageCache(cache_dir=str(tmp_path), memory_bytes=entry_bytes * 2)
+    for key in ("aa" * 20, "bb" * 20, "cc" * 20):
+        cache.put(key, cutout())
+    stats = cache.stats()
+    assert stats["memory_entries"] == 2
+    assert stats["memory_evictions"] == 1
+
+def test_mask_only_entries_rebuild_from_source(tmp_path):
+    cache = ImageCache(cache_dir=str(tmp_path), memory_bytes=0, store_mask_only=True)
+    cache.put("ee" * 20, cutout())
+    source = Image.new("RGB", (40, 30), (200, 10, 10))
+    cached = cache.get("ee" * 20, source=source)
+    assert cached.getpixel((0, 0))[3] == 0
+    assert cached.getpixel((1, 1)) == (200, 10, 10, 255)
+
+def test_rewriting_an_entry_counts_its_bytes_once(tmp_path):
+    cache = ImageCache(cache_dir=str(tmp_path))
+    cache.put("ff" * 20, cutout())
+    once = cache.disk_bytes
+    cache.put("ff" * 20, cutout())
+    assert cache.disk_bytes == once
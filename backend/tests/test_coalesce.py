@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+from app.services.image_processor.coalesce import SingleFlight, etag_matches
+
+def test_identical_requests_share_one_computation():
+    flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return object()
+
+    async def main():
+        leader = asyncio.create_task(flight.run("key", compute))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(flight.run("key", compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        # The first caller going away doesn't cancel the work the others wait on
+        leader.cancel()
+        return await asyncio.gather(*followers)
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {"in_flight": 0, "coalesced": 3}
+
+def test_upload_stays_open_until_the_shared_computation_ends(client):
+    from app.api.routes.image_routes import compute_once
+    from app.services.image_processor.ingest import UploadSource
+    processor = client.app.state.processor
+    source = UploadSource(b"upload bytes")
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return source.getvalue()
+
+    async def main():
+        leader = asyncio.create_task(compute_once(processor, "etag", source, compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(compute_once(processor, "etag", source, compute))
+        await asyncio.sleep(0)
+        # The first request is cancelled and its upload dependency closes the source
+        leader.cancel()
+        source.close()
+        assert not source.closed
+        return await follower
+
+    assert asyncio.run(main()) == b"upload bytes"
+    assert source.closed
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("bad image")
+
+    async def main():
+        results = await asyncio.gather(flight.run("key", fail), flight.run("key", fail), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        return await flight.run("key", lambda: asyncio.sleep(0, result="ok"))
+
+    assert asyncio.run(main()) == "ok"
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", "abc"', True),
+    ("*", True),
+    ('"xyz"', False),
+])
+def test_if_none_match_uses_weak_comparison(header, expected):
+    assert etag_matches(header, '"abc"') is expected
+
+def test_settings_that_change_the_bytes_change_the_etag(monkeypatch):
+    from app.core.config import settings
+    from app.services.image_processor.coalesce import result_etag
+    request = {"route": "pipeline", "steps": [{"operation": "rotate", "params": {"angle": 90}}]}
+    before = result_etag("source", request)
+    monkeypatch.setattr(settings, "JPEG_LOSSLESS_TRANSFORMS", not settings.JPEG_LOSSLESS_TRANSFORMS)
+    assert result_etag("source", request) != before
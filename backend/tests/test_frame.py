@@ -0,0 +1,88 @@
+import asyncio
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+from PIL import Image
+from app.core.config import settings
+from app.services.image_processor import ImageProcessor
+from app.services.image_processor.executor import FilterExecutor
+from app.services.image_processor.filters import CropFilter
+from app.services.image_processor.frame import Frame, share, attach, receive
+from app.services.image_processor.tone import apply_curve, tone_curve
+
+def noise(mode: str, size=(64, 48)) -> Image.Image:
+    return Image.effect_noise(size, 80).convert(mode)
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "RGBA"])
+@pytest.mark.parametrize("steps", [[("exposure", 0.3)], [("highlights", -0.4), ("shadows", 0.5)]])
+def test_frame_tone_curve_matches_pillow_path(mode, steps):
+    image = noise(mode)
+    expected = np.asarray(apply_curve(image, steps))
+    result = tone_curve(Frame.from_image(image), steps)
+    assert isinstance(result, Frame)
+    assert np.array_equal(result.pixels, expected)
+
+def test_owned_frames_change_in_place_and_frozen_frames_are_copied():
+    frame = Frame(np.array(noise("RGB")), "RGB")
+    assert tone_curve(frame, [("shadows", 0.5)]) is frame
+
+    frame.freeze()
+    before = frame.pixels.copy()
+    result = tone_curve(frame, [("shadows", 0.5)])
+    assert result is not frame and np.array_equal(frame.pixels, before)
+
+def test_crop_is_a_view_and_pads_like_pillow():
+    image = noise("RGB")
+    frame = Frame.from_image(image)
+    inside = CropFilter().run_frame(frame, {"x": 4, "y": 2, "width": 20, "height": 10})
+    assert np.shares_memory(inside.pixels, frame.pixels)
+    assert np.array_equal(inside.pixels, np.asarray(image.crop((4, 2, 24, 12))))
+
+    box = {"x": 50, "y": 40, "width": 30, "height": 20}
+    outside = CropFilter().run_frame(frame, box)
+    assert np.array_equal(outside.pixels, np.asarray(CropFilter().run(image, box)))
+
+def test_memoized_intermediates_survive_later_steps():
+    processor = ImageProcessor()
+    image = noise("RGB", (200, 150))
+    image.info["content_key"] = "source"
+    steps = [{"operation": "highlights", "params": {"value": 0.4}}]
+
+    async def run(extra):
+        return await processor.apply_steps(image, "source", steps + extra)
+
+    first, _ = asyncio.run(run([]))
+    snapshot = np.asarray(first.to_image() if isinstance(first, Frame) else first).copy()
+    # Resumes from the cached highlights frame and runs more tone work on a view of it
+    asyncio.run(run([
+        {"operation": "crop", "params": {"x": 0, "y": 0, "width": 200, "height": 100}},
+        {"operation": "exposure", "params": {"value": 0.5}}
+    ]))
+    again, _ = asyncio.run(run([]))
+    assert np.array_equal(np.asarray(again.to_image()), snapshot)
+    processor.shutdown()
+
+def test_shared_memory_round_trip_frees_segments():
+    image = noise("RGBA")
+    image.info["content_key"] = "abc"
+    shared = share(image)
+    with attach(shared) as frame:
+        assert frame.info["content_key"] == "abc"
+        assert np.array_equal(frame.pixels, np.asarray(image))
+    result = receive(shared)
+    assert np.array_equal(result.pixels, np.asarray(image))
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=shared.name)
+
+def test_process_pool_exchanges_frames_through_shared_memory(monkeypatch):
+    monkeypatch.setattr(settings, "FILTER_PROCESS_WORKERS", 1)
+    monkeypatch.setattr(settings, "PROCESS_POOL_OPERATIONS", ["shadows"])
+    processor = ImageProcessor(executor=FilterExecutor())
+    image = noise("RGB")
+    try:
+        result = asyncio.run(processor.executor.apply(
+            "shadows", processor.filters["shadows"], image, {"value": 0.5}
+        ))
+    finally:
+        processor.shutdown()
+    assert np.array_equal(result.pixels, np.asarray(apply_curve(image, [("shadows", 0.5)])))
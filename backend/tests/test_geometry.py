@@ -0,0 +1,78 @@
+import io
+import shutil
+import numpy as np
+import pytest
+from PIL import Image
+from app.services.image_processor import ImageProcessor
+from app.services.image_processor.filters import create_filters
+from app.services.image_processor.frame import Frame, as_image
+from app.services.image_processor.geometry import transform, plan, jpeg_transform
+
+def noise(size=(120, 90), mode="RGB") -> Image.Image:
+    return Image.effect_noise(size, 80).convert(mode)
+
+def step(operation, **params):
+    return {"operation": operation, "params": params}
+
+def one_by_one(image, steps):
+    filters = create_filters()
+    for s in steps:
+        image = filters[s["operation"]].run(image, s["params"])
+    return image
+
+CHAINS = [
+    [step("crop", x=10, y=5, width=80, height=60), step("resize", width=40, height=30)],
+    [step("resize", width=60, height=45), step("crop", x=7, y=3, width=30, height=20)],
+    [step("rotate", angle=90), step("flip", flipX=True), step("resize", width=50, height=70),
+     step("rotate", angle=-90), step("crop", x=2, y=4, width=40, height=20)],
+    [step("crop", x=100, y=80, width=40, height=30), step("rotate", angle=180)],
+]
+
+@pytest.mark.parametrize("steps", CHAINS)
+@pytest.mark.parametrize("as_frame", [False, True])
+def test_fused_chain_matches_running_filters_one_by_one(steps, as_frame):
+    image = noise()
+    expected = np.asarray(one_by_one(image, steps))
+    result = transform(Frame.from_image(image) if as_frame else image, steps)
+    assert np.array_equal(np.asarray(as_image(result)), expected)
+
+def test_quarter_turns_flips_and_crops_are_frame_views():
+    frame = Frame.from_image(noise())
+    steps = [step("rotate", angle=270), step("flip", flipX=True), step("crop", x=5, y=10, width=50, height=40)]
+    [segment] = plan(steps, frame.size)
+    assert segment.resample is None
+    result = transform(frame, steps)
+    assert np.shares_memory(result.pixels, frame.pixels)
+    assert np.array_equal(result.pixels, np.asarray(one_by_one(as_image(frame), steps)))
+
+def test_rotate_and_crop_resample_once():
+    steps = [step("crop", x=10, y=10, width=100, height=70), step("rotate", angle=12),
+             step("crop", x=20, y=15, width=60, height=40)]
+    [segment] = plan(steps, (120, 90))
+    assert segment.resample == "rotate" and segment.window == (10, 10, 110, 80)
+    image = noise()
+    expected = image.crop((10, 10, 110, 80)).rotate(12, expand=True)
+    expected = expected.crop((20, 15, 80, 55))
+    assert np.array_equal(np.asarray(transform(image, steps)), np.asarray(expected))
+
+def test_pipeline_runs_geometric_steps_as_one_group():
+    processor = ImageProcessor()
+    steps = [step("exposure", value=0.2), step("rotate", angle=90), step("crop", x=0, y=0, width=30, height=30),
+             step("resize", width=10, height=10), step("shadows", value=0.3)]
+    groups = processor.plan_steps(steps)
+    assert [len(group) for group in groups] == [1, 3, 1]
+    assert processor.fused_filter(groups[1])[0] == "geometry"
+    processor.shutdown()
+
+@pytest.mark.skipif(shutil.which("jpegtran") is None, reason="jpegtran is not installed")
+def test_jpeg_crop_and_quarter_turn_are_lossless():
+    buffer = io.BytesIO()
+    noise((128, 96)).save(buffer, "JPEG", quality=90, subsampling=0)
+    steps = [step("crop", x=16, y=8, width=64, height=48), step("rotate", angle=90)]
+    data = jpeg_transform(buffer.getvalue(), steps)
+    assert data is not None
+    source = Image.open(io.BytesIO(buffer.getvalue())).convert("RGB")
+    expected = np.asarray(one_by_one(source, steps)).astype(int)
+    result = np.asarray(Image.open(io.BytesIO(data)).convert("RGB")).astype(int)
+    # Same DCT blocks, so only decoder rounding at block edges differs
+    assert result.shape == expected.shape and np.abs(result - expected).mean() < 1
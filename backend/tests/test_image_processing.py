@@ -1,6 +1,11 @@
 from fastapi.testclient import TestClient
 import io
+import json
+import base64
 from PIL import Image
+from app.core.config import settings
+from app.services.image_processor.encoding import encode_to_budget
+import numpy as np
 
 def test_process_image_exposure(client, test_image):
     response = client.post(
@@ -18,3 +23,233 @@ def test_crop_image(client, test_image):
         data={"x": 0, "y": 0, "width": 50, "height": 50}
     )
     assert response.status_code == 200
+
+def test_crop_goes_through_the_pipeline(client):
+    buffer = io.BytesIO()
+    Image.new("RGB", (320, 240), (40, 120, 200)).save(buffer, format="JPEG")
+    upload = {"image": ("photo.jpg", buffer.getvalue(), "image/jpeg")}
+    query = "/api/crop?x=16&y=16&width=64&height=48"
+    response = client.post(query, files=upload, headers={"Accept": "image/jpeg"})
+    assert response.status_code == 200
+    assert Image.open(io.BytesIO(response.content)).size == (64, 48)
+    # Timed like the other image routes: a decode, or jpegtran where it is installed
+    assert any(name in response.headers["Server-Timing"] for name in ("decode", "jpegtran"))
+    repeat = client.post(query, files=upload, headers={"Accept": "image/jpeg", "If-None-Match": response.headers["ETag"]})
+    assert repeat.status_code == 304
+
+def test_health_reports_processor_ready(client):
+    response = client.get("/api/health")
+    assert response.status_code == 200
+    # The model may still be loading in the background, other filters already serve
+    assert response.json()["status"] in ("ready", "degraded", "warming_up")
+
+def test_processor_is_shared_across_requests(client, test_image):
+    processor = client.app.state.processor
+    client.post(
+        "/api/crop",
+        files={"image": ("test.png", test_image, "image/png")}
+    )
+    assert client.app.state.processor is processor
+
+def test_pipeline_applies_steps_with_timings(client, test_image):
+    steps = [
+        {"operation": "exposure", "params": {"value": 0.2}},
+        {"operation": "rotate", "params": {"angle": 90}},
+        {"operation": "white_background", "params": {}}
+    ]
+    response = client.post(
+        "/api/pipeline",
+        files={"image": ("test.png", test_image, "image/png")},
+        data={"steps": json.dumps(steps)}
+    )
+    assert response.status_code == 200
+    timings = response.json()["metadata"]["timings"]
+    assert [step["operation"] for step in timings["steps"]] == ["exposure", "rotate", "white_background"]
+
+def test_pipeline_rejects_invalid_chain(client, test_image):
+    steps = [
+        {"operation": "exposure", "params": {"value": 0.2}},
+        {"operation": "resize", "params": {"width": "big"}}
+    ]
+    response = client.post(
+        "/api/pipeline",
+        files={"image": ("test.png", test_image, "image/png")},
+        data={"steps": json.dumps(steps)}
+    )
+    assert response.status_code == 400
+    assert "Step 1" in response.json()["detail"]
+
+def test_saturated_queue_returns_retry_after(client, test_image, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_QUEUED_REQUESTS", 0)
+    response = client.post(
+        "/api/process-image",
+        files={"image": ("test.png", test_image, "image/png")},
+        headers={"operation": "exposure", "params": '{"value": 0.5}'}
+    )
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+def test_process_image_returns_negotiated_binary(client, test_image):
+    response = client.post(
+        "/api/process-image?quality=70",
+        files={"image": ("test.png", test_image, "image/png")},
+        headers={"operation": "exposure", "params": '{"value": 0.5}', "Accept": "image/webp, image/png;q=0.5"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert Image.open(io.BytesIO(response.content)).format == "WEBP"
+
+def test_crop_keeps_base64_json_by_default(client, test_image):
+    response = client.post(
+        "/api/crop?format=jpeg",
+        files={"image": ("test.png", test_image, "image/png")}
+    )
+    assert response.status_code == 200
+    image = Image.open(io.BytesIO(base64.b64decode(response.json())))
+    assert image.format == "JPEG"
+
+def test_resize_output_fits_byte_budget():
+    noise = np.random.default_rng(0).integers(0, 256, (600, 800, 3), dtype=np.uint8)
+    image = Image.fromarray(noise)
+    image.info['dpi'] = (300, 300)
+    encoded = encode_to_budget(image, 200 * 1024)
+    assert len(encoded.data) <= 200 * 1024
+    assert Image.open(io.BytesIO(encoded.data)).info['dpi'] == (300, 300)
+
+def test_edit_session_reuses_uploaded_image(client, test_image):
+    upload = client.post("/api/images", files={"image": ("test.png", test_image, "image/png")})
+    assert upload.status_code == 200
+    image_id = upload.json()["image_id"]
+
+    first = client.post(f"/api/images/{image_id}/process", json={"steps": [{"operation": "crop", "params": {"x": 0, "y": 0, "width": 40, "height": 30}}]})
+    assert first.status_code == 200
+    assert first.json()["metadata"]["version"] == 1
+
+    # Branch from the original upload rather than the cropped version
+    second = client.post(
+        f"/api/images/{image_id}/process",
+        json={"steps": [{"operation": "flip", "params": {"flipX": True}}], "base_version": 0},
+        headers={"Accept": "image/png"}
+    )
+    assert second.status_code == 200
+    assert second.headers["X-Image-Version"] == "2"
+    assert Image.open(io.BytesIO(second.content)).size == (upload.json()["width"], upload.json()["height"])
+
+    assert client.delete(f"/api/images/{image_id}").status_code == 204
+    assert client.get(f"/api/images/{image_id}/versions/0").status_code == 404
+
+def test_preview_runs_on_proxy_and_export_renders_full_size(client):
+    buffer = io.BytesIO()
+    Image.new("RGB", (3000, 2000), (120, 90, 60)).save(buffer, format="PNG")
+    buffer.seek(0)
+    image_id = client.post("/api/images", files={"image": ("big.png", buffer, "image/png")}).json()["image_id"]
+    steps = {"steps": [
+        {"operation": "exposure", "params": {"value": 0.3}},
+        {"operation": "crop", "params": {"x": 300, "y": 200, "width": 1500, "height": 1000}}
+    ]}
+
+    preview = client.post(f"/api/images/{image_id}/process?preview=true&viewport=600", json=steps)
+    assert preview.status_code == 200
+    # Viewport rounds up to 768, so the crop box is scaled by 768/3000
+    assert preview.json()["metadata"]["preview"] == {"width": 384, "height": 256}
+
+    export = client.post(f"/api/images/{image_id}/export", headers={"Accept": "image/png"})
+    assert export.status_code == 200
+    assert export.headers["X-Image-Version"] == "1"
+    assert Image.open(io.BytesIO(export.content)).size == (1500, 1000)
+
+def test_pipeline_resumes_from_memoized_prefix(client, test_image):
+    steps = [
+        {"operation": "rotate", "params": {"angle": 90}},
+        {"operation": "sharpness", "params": {"value": 0.5}},
+        {"operation": "exposure", "params": {"value": 0.1}}
+    ]
+    client.post("/api/pipeline", files={"image": ("test.png", test_image, "image/png")}, data={"steps": json.dumps(steps)})
+
+    # Only the last step changed, so the first two are served from the cache
+    steps[2]["params"]["value"] = 0.4
+    test_image.seek(0)
+    response = client.post("/api/pipeline", files={"image": ("test.png", test_image, "image/png")}, data={"steps": json.dumps(steps)})
+    timings = response.json()["metadata"]["timings"]
+    assert timings["cached_steps"] == 2
+    assert [step["operation"] for step in timings["steps"]] == ["exposure"]
+
+def test_resize_pipeline_decodes_jpeg_at_reduced_scale(client):
+    buffer = io.BytesIO()
+    Image.new("RGB", (3000, 2000), (40, 120, 200)).save(buffer, format="JPEG")
+    buffer.seek(0)
+    steps = [{"operation": "exposure", "params": {"value": 0.2}}, {"operation": "resize", "params": {"width": 300, "height": 300}}]
+    response = client.post(
+        "/api/pipeline?format=png",
+        files={"image": ("big.jpg", buffer, "image/jpeg")},
+        data={"steps": json.dumps(steps)}
+    )
+    metadata = response.json()["metadata"]
+    assert metadata["timings"]["decode"]["decoded_size"] == [750, 500]
+    assert metadata["timings"]["decode"]["pixels_saved_pct"] > 90
+    assert Image.open(io.BytesIO(base64.b64decode(response.json()["image"]))).size == (300, 200)
+
+def test_decode_keeps_alpha(client):
+    buffer = io.BytesIO()
+    Image.new("RGBA", (50, 50), (255, 0, 0, 0)).save(buffer, format="PNG")
+    buffer.seek(0)
+    response = client.post(
+        "/api/process-image",
+        files={"image": ("clear.png", buffer, "image/png")},
+        headers={"operation": "exposure", "params": '{"value": 0.5}', "Accept": "image/png"}
+    )
+    image = Image.open(io.BytesIO(response.content))
+    assert image.mode == "RGBA"
+    assert image.getpixel((10, 10))[3] == 0
+
+def test_grayscale_keeps_its_mode_through_geometry_only(client):
+    buffer = io.BytesIO()
+    Image.linear_gradient("L").resize((400, 300)).save(buffer, format="PNG")
+
+    def run(steps, format="png"):
+        response = client.post(
+            f"/api/pipeline?format={format}",
+            files={"image": ("gray.png", buffer.getvalue(), "image/png")},
+            data={"steps": json.dumps(steps)},
+            headers={"Accept": f"image/{format}"}
+        )
+        assert response.status_code == 200
+        return Image.open(io.BytesIO(response.content))
+
+    resize = {"operation": "resize", "params": {"width": 200}}
+    assert run([{"operation": "flip", "params": {"flipX": True}}, resize]).mode == "L"
+    assert run([resize], "jpeg").size == (200, 150)
+    # Filters that work in RGB still get it, even after a cached geometry prefix
+    assert run([resize, {"operation": "exposure", "params": {"value": 0.2}}]).mode == "RGB"
+
+def test_stage_timings_reach_header_and_metrics(client, test_image):
+    response = client.post(
+        "/api/process-image",
+        files={"image": ("test.png", test_image, "image/png")},
+        headers={"operation": "exposure", "params": '{"value": 0.5}'}
+    )
+    timing = response.headers["Server-Timing"]
+    for name in ("upload", "decode", 'filter;desc="exposure"', "encode", "base64", "log", "total"):
+        assert name in timing
+
+    metrics = client.get("/metrics").text
+    assert 'image_stage_seconds_count{operation="exposure",stage="filter"}' in metrics
+    assert 'http_requests_total{method="POST",route="/api/process-image",status="200"}' in metrics
+    assert "image_queue_depth" in metrics
+    assert "# TYPE request_log_dropped_total counter" in metrics
+
+def test_repeat_request_with_etag_is_not_modified(client, test_image):
+    request = {"operation": "exposure", "params": '{"value": 0.5}', "Accept": "image/png"}
+    upload = test_image.getvalue()
+    first = client.post("/api/process-image", files={"image": ("test.png", upload, "image/png")}, headers=request)
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and not etag.startswith("W/")
+
+    repeat = client.post("/api/process-image", files={"image": ("test.png", upload, "image/png")},
+                         headers={**request, "If-None-Match": etag})
+    assert repeat.status_code == 304 and repeat.content == b""
+    assert repeat.headers["ETag"] == etag
+
+    changed = client.post("/api/process-image", files={"image": ("test.png", upload, "image/png")},
+                          headers={**request, "params": '{"value": 0.6}', "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
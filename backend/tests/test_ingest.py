@@ -0,0 +1,86 @@
+import gc
+import io
+import struct
+import weakref
+import zlib
+import pytest
+from tempfile import SpooledTemporaryFile
+from PIL import Image
+from app.core.config import settings
+from app.services.image_processor.cache import content_key
+from app.services.image_processor.ingest import UploadRejected, UploadSource, ingest
+from app.services.image_processor.utils import decode_image
+
+def png(size=(64, 48)) -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 60).convert("RGB").save(buffer, "PNG")
+    return buffer.getvalue()
+
+def claimed_size(data: bytes, width: int, height: int) -> bytes:
+    """A PNG whose header claims another size, like a decompression bomb"""
+    header = data[12:16] + struct.pack(">II", width, height) + data[24:29]
+    return data[:12] + header + struct.pack(">I", zlib.crc32(header)) + data[33:]
+
+def spooled(data: bytes, max_size: int = 1024 * 1024) -> SpooledTemporaryFile:
+    file = SpooledTemporaryFile(max_size=max_size)
+    file.write(data)
+    return file
+
+def test_large_upload_is_memory_mapped_not_copied():
+    data = png((300, 200))
+    source = ingest(spooled(data, max_size=1024))
+    assert source.buffer.__class__.__name__ == "mmap"
+    assert content_key(source.getbuffer()) == content_key(data)
+    with Image.open(source) as image:
+        assert image.size == (300, 200) and image.tobytes() == Image.open(io.BytesIO(data)).tobytes()
+    source.close()
+
+def test_pixel_budget_is_checked_from_the_header():
+    # 12000x10000 is under Pillow's own bomb limit but over MAX_UPLOAD_PIXELS
+    with pytest.raises(UploadRejected) as rejected:
+        ingest(spooled(claimed_size(png(), 12000, 10000)))
+    assert rejected.value.status_code == 413
+    with pytest.raises(UploadRejected) as rejected:
+        ingest(spooled(claimed_size(png(), 30000, 30000)))
+    assert rejected.value.status_code == 413
+
+def test_unsupported_and_unreadable_uploads_are_rejected(client):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, "PPM")
+    for data in (buffer.getvalue(), b"not an image"):
+        response = client.post(
+            "/api/process-image",
+            files={"image": ("upload", data, "application/octet-stream")},
+            data={"operation": "exposure", "params": "0.1"}
+        )
+        assert response.status_code == 415
+
+def test_declared_body_over_the_limit_is_refused_before_parsing(client, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_UPLOAD_BYTES", 1000)
+    data = png((300, 200))
+    response = client.post("/api/images", files={"image": ("big.png", data, "image/png")})
+    assert response.status_code == 413
+    monkeypatch.setattr(settings, "MAX_UPLOAD_BYTES", len(data) - 1)
+    response = client.post("/api/images", files={"image": ("big.png", data, "image/png")})
+    assert response.status_code == 413 and "Upload is" in response.json()["detail"]
+
+def test_stored_image_does_not_hold_the_upload(client):
+    # An RGB PNG is stored without conversion; over 1 MB it is memory-mapped
+    data = png((900, 700))
+    response = client.post("/api/images", files={"image": ("photo.png", data, "image/png")})
+    assert response.status_code == 200
+    stored = client.app.state.image_store.get(response.json()["image_id"], 0).image
+    gc.collect()
+    assert not [obj for obj in gc.get_objects() if isinstance(obj, UploadSource) and not obj.closed]
+    assert stored.tobytes() == Image.open(io.BytesIO(data)).tobytes()
+
+def test_decoded_image_outlives_its_source():
+    data = png((300, 200))
+    source = ingest(spooled(data, max_size=1024))
+    upload = weakref.ref(source)
+    image = decode_image(source)
+    source.close()
+    del source
+    gc.collect()
+    assert upload() is None
+    assert image.tobytes() == Image.open(io.BytesIO(data)).tobytes()
@@ -0,0 +1,84 @@
+import asyncio
+import io
+import json
+import time
+import zipfile
+from PIL import Image
+from app.core.config import settings
+from app.services.image_processor import EncodedImage, OutputFormat
+from app.services.job_service import JobManager
+
+def png_bytes(color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (20, 10), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def make_zip(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+def test_job_processes_zip_and_streams_results(client, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(settings, "JOB_RETRY_BACKOFF_SECONDS", 0)
+    archive = make_zip({"a.png": png_bytes(), "shop/b.png": png_bytes("blue"), "broken.png": b"not an image",
+                        "../../escape.png": png_bytes("green")})
+    response = client.post(
+        "/api/jobs?format=jpeg",
+        files={"archive": ("drop.zip", archive, "application/zip")},
+        data={"steps": json.dumps([{"operation": "flip", "params": {"flipX": True}}])}
+    )
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    for _ in range(100):
+        status = client.get(f"/api/jobs/{job_id}").json()
+        if status["remaining"] == 0:
+            break
+        time.sleep(0.05)
+    assert status["status"] == "completed_with_errors"
+    assert (status["done"], status["failed"]) == (3, 1)
+    assert status["images_per_second"] > 0
+
+    results = client.get(f"/api/jobs/{job_id}/results")
+    with zipfile.ZipFile(io.BytesIO(results.content)) as archive:
+        assert sorted(archive.namelist()) == ["a.jpg", "escape.jpg", "manifest.json", "shop/b.jpg"]
+        assert Image.open(io.BytesIO(archive.read("a.jpg"))).format == "JPEG"
+
+class FakeProcessor:
+    def __init__(self):
+        self.calls = 0
+
+    async def run_pipeline(self, image_bytes, steps, output=None, memoize=True):
+        self.calls += 1
+        return EncodedImage(image_bytes.getvalue(), "image/png"), {}
+
+def test_unfinished_job_resumes_after_restart(tmp_path):
+    archive_path = tmp_path / "upload.zip"
+    archive_path.write_bytes(make_zip({f"{i}.png": png_bytes() for i in range(4)}))
+
+    async def first_run():
+        manager = JobManager(FakeProcessor(), jobs_dir=str(tmp_path / "jobs"))
+        await manager.start()
+        job = await manager.create([{"operation": "flip", "params": {}}], OutputFormat(), archive=str(archive_path))
+        # Shut down before any item got a turn
+        await manager.stop()
+        return job
+
+    job = asyncio.run(first_run())
+    job.write_output(0, b"done before the restart", "image/png")
+    job.record(0, "done", file="000000.png", attempts=1)
+
+    async def second_run():
+        processor = FakeProcessor()
+        manager = JobManager(processor, jobs_dir=str(tmp_path / "jobs"))
+        await manager.start()
+        await asyncio.gather(*manager.tasks.values())
+        return processor, manager.get(job.job_id).status()
+
+    processor, status = asyncio.run(second_run())
+    assert processor.calls == 3
+    assert status["status"] == "completed"
+    assert status["done"] == 4
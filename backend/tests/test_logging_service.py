@@ -0,0 +1,95 @@
+import asyncio
+import json
+from app.core.config import settings
+from app.services.logging_service import LoggingService, FileSink, LogSink
+
+class FailingSink(LogSink):
+    def write(self, rows):
+        raise ConnectionError("sink is down")
+
+class FakeRequest:
+    class client:
+        host = "127.0.0.1"
+    class url:
+        path = "/api/process-image"
+    method = "POST"
+    base_url = "http://testserver/"
+
+def log_rows(service, count):
+    async def run():
+        await service.start()
+        for _ in range(count):
+            await service.log_request(FakeRequest(), "tester", 200, 0.1)
+        await service.stop()
+    asyncio.run(run())
+
+def test_rows_are_batched_and_drained_on_stop(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "LOG_SPILL_PATH", str(tmp_path / "spill.jsonl"))
+    monkeypatch.setattr(settings, "LOG_BATCH_SIZE", 2)
+    sink = FileSink(str(tmp_path / "requests.jsonl"))
+    log_rows(LoggingService(sink=sink), 5)
+
+    rows = [json.loads(line) for line in sink.path.read_text().splitlines()]
+    assert len(rows) == 5
+    assert rows[0]["endpoint"] == "/api/process-image"
+
+def test_rows_spill_to_disk_when_sink_is_down(tmp_path, monkeypatch):
+    spill_path = tmp_path / "spill.jsonl"
+    monkeypatch.setattr(settings, "LOG_SPILL_PATH", str(spill_path))
+    monkeypatch.setattr(settings, "LOG_MAX_RETRIES", 1)
+    monkeypatch.setattr(settings, "LOG_RETRY_BACKOFF_SECONDS", 0)
+    log_rows(LoggingService(sink=FailingSink()), 3)
+
+    assert len(spill_path.read_text().splitlines()) == 3
+
+def test_auto_sink_falls_back_to_file_without_gcp(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "LOG_SINK", "auto")
+    monkeypatch.setattr(settings, "LOG_FILE_PATH", str(tmp_path / "requests.jsonl"))
+    monkeypatch.setattr(settings, "LOG_SPILL_PATH", str(tmp_path / "spill.jsonl"))
+    monkeypatch.setattr(settings, "PROJECT_ID", None)
+    service = LoggingService()
+    assert service.sink is None
+    log_rows(service, 2)
+
+    assert isinstance(service.sink, FileSink)
+    assert len((tmp_path / "requests.jsonl").read_text().splitlines()) == 2
+
+def test_torn_spill_line_is_skipped_and_the_rest_replayed(tmp_path, monkeypatch):
+    spill_path = tmp_path / "spill.jsonl"
+    monkeypatch.setattr(settings, "LOG_SPILL_PATH", str(spill_path))
+    # Left behind by a replay that died, plus rows spilled since
+    spill_path.with_suffix(".replay").write_text(json.dumps({"row": 1}) + "\n" + '{"torn\n')
+    spill_path.write_text(json.dumps({"row": 2}) + "\n")
+    sink = FileSink(str(tmp_path / "requests.jsonl"))
+    service = LoggingService(sink=sink)
+    log_rows(service, 1)
+    log_rows(service, 1)
+
+    rows = [json.loads(line) for line in sink.path.read_text().splitlines()]
+    assert [row.get("row") for row in rows] == [1, None, 2, None]
+    assert service.dropped == 1 and not spill_path.with_suffix(".replay").exists()
+
+def test_dead_flush_task_is_restarted_and_stop_does_not_raise(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "LOG_SPILL_PATH", str(tmp_path / "spill.jsonl"))
+    sink = FileSink(str(tmp_path / "requests.jsonl"))
+    service = LoggingService(sink=sink)
+    open_sink = service._open_sink
+
+    async def broken_once():
+        service._open_sink = open_sink
+        raise ValueError("sink exploded")
+
+    async def run(log: bool):
+        service._open_sink = broken_once
+        await service.start()
+        await asyncio.sleep(0)
+        assert service.task.done()
+        if log:
+            await service.log_request(FakeRequest(), "tester", 200, 0.1)
+            assert not service.task.done()
+        # A task that died is reported at shutdown, not raised into it
+        await service.stop()
+
+    asyncio.run(run(log=True))
+    assert len(sink.path.read_text().splitlines()) == 1
+    asyncio.run(run(log=False))
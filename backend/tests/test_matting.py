@@ -0,0 +1,45 @@
+import numpy as np
+from PIL import Image, ImageDraw
+from app.services.image_processor.filters import RemoveBackgroundFilter
+from app.services.image_processor.cache import ImageCache
+from app.services.image_processor.models import SessionPool
+
+class FakeSession:
+    """Stands in for a rembg session: the mask is the bright part of the image"""
+    def __init__(self):
+        self.input_sizes = []
+
+    def predict(self, image):
+        self.input_sizes.append(image.size)
+        return [image.convert("L").point(lambda v: 255 if v > 128 else 0)]
+
+def subject_image(size=(1600, 1200)):
+    image = Image.new("RGB", size, (0, 0, 0))
+    ImageDraw.Draw(image).rectangle((403, 302, 1196, 897), fill=(250, 250, 250))
+    return image
+
+def make_filter(tmp_path):
+    bg_filter = RemoveBackgroundFilter.__new__(RemoveBackgroundFilter)
+    bg_filter.cache = ImageCache(cache_dir=str(tmp_path))
+    bg_filter.model_name = "fake"
+    bg_filter.session = FakeSession()
+    bg_filter.sessions = SessionPool(lambda name: bg_filter.session)
+    return bg_filter
+
+def test_model_runs_on_proxy_and_mask_is_applied_at_full_resolution(tmp_path):
+    bg_filter = make_filter(tmp_path)
+    result = bg_filter.run(subject_image(), {"quality": "fast"})
+    assert bg_filter.session.input_sizes == [(320, 320)]
+    assert result.size == (1600, 1200) and result.mode == "RGBA"
+    assert result.getpixel((800, 600))[3] == 255
+    assert result.getpixel((50, 50))[3] == 0
+
+def test_refined_mask_follows_full_resolution_edges(tmp_path):
+    bg_filter = make_filter(tmp_path)
+    image = subject_image()
+    fast = np.asarray(bg_filter.run(image, {"quality": "fast"}))[..., 3].astype(int)
+    refined = np.asarray(bg_filter.run(image, {"quality": "quality"}))[..., 3].astype(int)
+    truth = np.asarray(image.convert("L")) > 128
+    # Bilinear upsampling leaves a wide wrong band where the proxy grid misses the edge
+    error = lambda alpha: np.abs(alpha - truth * 255).max()
+    assert error(refined) < error(fast) / 2
@@ -0,0 +1,25 @@
+from PIL import Image
+from app.services.image_processor.memo import IntermediateCache
+
+def entry(size=(40, 30)):
+    return Image.new("RGB", size)
+
+def test_lookup_returns_longest_cached_prefix():
+    memo = IntermediateCache(max_bytes=10 * 1024 * 1024)
+    memo.put("k1", entry(), 5.0)
+    memo.put("k2", entry(), 9.0)
+    index, image, cost = memo.lookup(["k1", "k2", "k3"])
+    assert (index, cost) == (1, 9.0)
+    assert memo.lookup(["other"])[0] == -1
+    assert memo.stats()["hit_rate"] == 0.5
+
+def test_eviction_keeps_expensive_intermediates():
+    entry_bytes = 40 * 30 * 3
+    memo = IntermediateCache(max_bytes=entry_bytes * 2)
+    memo.put("background_removed", entry(), 800.0)
+    memo.put("flipped", entry(), 2.0)
+    # Plain LRU would drop the older background removal here
+    memo.put("rotated", entry(), 3.0)
+    assert "background_removed" in memo.entries
+    assert "flipped" not in memo.entries
+    assert memo.stats()["evictions"] == 1
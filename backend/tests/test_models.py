@@ -0,0 +1,123 @@
+import asyncio
+import io
+import threading
+import time
+import pytest
+from PIL import Image
+from app.core.config import settings
+from app.services.image_processor import ImageProcessor
+from app.services.image_processor.batching import InferenceBatcher
+from app.services.image_processor.cache import ImageCache
+from app.services.image_processor.models import SessionPool, base_model, SESSION_MEMORY_FACTOR
+
+class FakeInnerSession:
+    def __init__(self, model_path):
+        self._model_path = model_path
+
+class FakeSession:
+    """Records which model it stands for; the mask is the whole image"""
+    def __init__(self, name, model_path=None):
+        self.model_name = name
+        self.inner_session = FakeInnerSession(model_path)
+        self.closed = False
+
+    def predict(self, image):
+        return [Image.new("L", image.size, 255)]
+
+    def close(self):
+        self.closed = True
+
+def model_file(tmp_path, name, nbytes):
+    path = tmp_path / f"{name}.onnx"
+    path.write_bytes(b"\0" * nbytes)
+    return str(path)
+
+def test_pool_unloads_least_recently_used_past_the_cap(tmp_path):
+    paths = {name: model_file(tmp_path, name, 100) for name in ("a", "b", "c")}
+    pool = SessionPool(lambda name: FakeSession(name, paths[name]), max_bytes=2 * 100 * SESSION_MEMORY_FACTOR)
+    a = pool.get("a")
+    pool.get("b")
+    assert pool.get("a") is a
+    pool.get("c")
+    stats = pool.stats()
+    assert stats["loaded"] == ["a", "c"] and stats["evictions"] == 1
+    assert stats["bytes"] == 2 * 100 * SESSION_MEMORY_FACTOR
+
+def test_concurrent_requests_load_a_model_once():
+    loads = []
+
+    def load(name):
+        loads.append(name)
+        time.sleep(0.05)
+        return FakeSession(name)
+
+    pool = SessionPool(load)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.get("u2netp"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loads == ["u2netp"] and len({id(session) for session in results}) == 1
+
+def test_closed_batcher_dispatcher_exits_and_restarts_on_demand():
+    batcher = InferenceBatcher(FakeSession("u2netp-custom"), max_batch=4, window_ms=0)
+    assert batcher.predict(Image.new("RGB", (8, 8)))[0].size == (8, 8)
+    thread = batcher.thread
+    batcher.close()
+    thread.join(timeout=2)
+    assert not thread.is_alive() and batcher.thread is None
+    assert batcher.predict(Image.new("RGB", (4, 4)))[0].size == (4, 4)
+
+def test_previews_use_the_fast_tier_and_renders_the_quality_tier(tmp_path):
+    processor = ImageProcessor()
+    bg_filter = processor.filters["remove_background"]
+    bg_filter.cache = ImageCache(cache_dir=str(tmp_path))
+    bg_filter.sessions = SessionPool(FakeSession)
+    buffer = io.BytesIO()
+    Image.effect_noise((640, 480), 60).convert("RGB").save(buffer, "PNG")
+    steps = [{"operation": "remove_background", "params": {"quality": "fast"}}]
+
+    def render(steps, preview_edge=None):
+        asyncio.run(processor.run_pipeline(io.BytesIO(buffer.getvalue()), steps, preview_edge=preview_edge))
+        return bg_filter.sessions.stats()["loaded"][-1]
+
+    try:
+        assert render(steps, preview_edge=256) == settings.SEGMENTATION_FAST_MODEL
+        assert render(steps) == settings.REMBG_MODEL
+        chosen = [{"operation": "remove_background", "params": {"quality": "fast", "model": "u2net-int8"}}]
+        assert render(chosen, preview_edge=256) == "u2net-int8"
+    finally:
+        processor.shutdown()
+
+def test_unknown_model_is_rejected_before_any_work():
+    processor = ImageProcessor()
+    with pytest.raises(ValueError, match="model"):
+        processor.validate_steps([{"operation": "remove_background", "params": {"model": "yolo"}}])
+    processor.shutdown()
+    assert base_model("u2net_human_seg-int8") == "u2net_human_seg"
+
+def test_quantized_copy_loads_and_runs(tmp_path):
+    # The pinned onnx must work with onnxruntime's quantizer, which needs it
+    onnx = pytest.importorskip("onnx")
+    import numpy as np
+    import onnxruntime as ort
+    from onnx import helper, numpy_helper, TensorProto
+    from app.services.image_processor.models import quantize_model
+
+    weights = np.random.default_rng(0).normal(size=(1, 3, 3, 3)).astype(np.float32)
+    graph = helper.make_graph(
+        [helper.make_node("Conv", ["input", "weights"], ["conv"], pads=[1, 1, 1, 1]),
+         helper.make_node("Sigmoid", ["conv"], ["mask"])],
+        "mask",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [1, 3, 16, 16])],
+        [helper.make_tensor_value_info("mask", TensorProto.FLOAT, [1, 1, 16, 16])],
+        [numpy_helper.from_array(weights, "weights")]
+    )
+    # U2-Net's exports are opset 11
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid("", 11)]), tmp_path / "model.onnx")
+    quantize_model(str(tmp_path / "model.onnx"), str(tmp_path / "model-int8.onnx"))
+    assert "ConvInteger" in {node.op_type for node in onnx.load(tmp_path / "model-int8.onnx").graph.node}
+    session = ort.InferenceSession(str(tmp_path / "model-int8.onnx"), providers=["CPUExecutionProvider"])
+    mask = session.run(None, {"input": np.ones((1, 3, 16, 16), np.float32)})[0]
+    assert mask.shape == (1, 1, 16, 16)
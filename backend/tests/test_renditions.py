@@ -0,0 +1,115 @@
+import asyncio
+import email
+import io
+import json
+import zipfile
+import numpy as np
+from PIL import Image
+from app.services.image_processor import ImageProcessor, OutputFormat
+from app.services.image_processor.renditions import plan_renditions
+
+RENDITIONS = [
+    {"name": "thumb", "width": 100, "height": 100, "format": "webp"},
+    {"name": "zoom", "width": 1200, "height": 1200, "format": "jpeg", "quality": 90},
+    {"name": "listing", "width": 400, "height": 400, "format": "png", "white_background": True},
+]
+
+def photo(size=(1600, 1200), mode="RGB") -> bytes:
+    # Smooth gradients so the cascade and a direct resize are comparable
+    x = np.linspace(0, 255, size[0])[None, :, None]
+    y = np.linspace(0, 255, size[1])[:, None, None]
+    pixels = np.concatenate([np.broadcast_to(x, (*size[::-1], 1)), np.broadcast_to(y, (*size[::-1], 1)),
+                             np.broadcast_to((x + y) / 2, (*size[::-1], 1))], axis=2)
+    image = Image.fromarray(pixels.astype(np.uint8), "RGB").convert(mode)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+def test_each_rendition_resizes_the_smallest_large_enough_one():
+    plan = plan_renditions([{"width": 100}, {"width": 1200}, {"width": 400}, {"width": 1000}], (1600, 1200))
+    assert [(index, parent) for index, _, parent in plan] == [(1, None), (3, None), (2, 3), (0, 2)]
+    assert plan[-1][1] == (100, 75)
+
+def test_cascade_matches_resizing_the_source():
+    processor = ImageProcessor()
+    source = photo()
+    specs = [{"name": "a", "width": 800}, {"name": "b", "width": 200}, {"name": "c", "width": 60}]
+    for spec in specs:
+        spec["output"] = OutputFormat("png")
+
+    async def render():
+        return [part async for part in processor.render_renditions(io.BytesIO(source), specs)]
+
+    try:
+        parts = asyncio.run(render())
+    finally:
+        processor.shutdown()
+    original = Image.open(io.BytesIO(source)).convert("RGB")
+    assert sorted(rendition["name"] for rendition, _ in parts) == ["a", "b", "c"]
+    for rendition, encoded in parts:
+        result = np.asarray(Image.open(io.BytesIO(encoded.data)).convert("RGB")).astype(int)
+        direct = original.resize((rendition["width"], rendition["width"] * 3 // 4), Image.Resampling.LANCZOS)
+        assert result.shape == np.asarray(direct).shape
+        assert np.abs(result - np.asarray(direct).astype(int)).mean() < 1.5
+
+def test_renditions_endpoint_streams_a_zip(client):
+    source = photo(mode="RGBA")
+    response = client.post(
+        "/api/renditions",
+        files={"image": ("photo.png", source, "image/png")},
+        data={"renditions": json.dumps(RENDITIONS)}
+    )
+    assert response.status_code == 200 and response.headers["content-type"] == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert sorted(archive.namelist()) == ["listing.png", "thumb.webp", "zoom.jpg"]
+    listing = Image.open(io.BytesIO(archive.read("listing.png")))
+    assert listing.size == (400, 300) and listing.mode == "RGB"
+    assert Image.open(io.BytesIO(archive.read("zoom.jpg"))).size == (1200, 900)
+
+    repeat = client.post(
+        "/api/renditions",
+        files={"image": ("photo.png", source, "image/png")},
+        data={"renditions": json.dumps(RENDITIONS)},
+        headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert repeat.status_code == 304
+
+def test_requested_format_is_kept_without_a_budget(client):
+    # Noise PNG far over RESIZE_MAX_BYTES
+    buffer = io.BytesIO()
+    Image.effect_noise((1800, 1350), 90).convert("RGB").save(buffer, "PNG")
+    renditions = [{"name": "print", "width": 1800, "format": "png"},
+                  {"name": "small", "width": 600, "format": "png", "max_bytes": 2048}]
+    response = client.post(
+        "/api/renditions",
+        files={"image": ("noise.png", buffer.getvalue(), "image/png")},
+        data={"renditions": json.dumps(renditions)}
+    )
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    # Over budget, the smallest PNG found is sent rather than switching format
+    assert sorted(archive.namelist()) == ["print.png", "small.png"]
+    assert Image.open(io.BytesIO(archive.read("print.png"))).size == (1800, 1350)
+
+def test_renditions_endpoint_streams_multipart(client):
+    steps = [{"operation": "exposure", "params": {"value": 0.2}}]
+    response = client.post(
+        "/api/renditions?container=multipart",
+        files={"image": ("photo.png", photo(), "image/png")},
+        data={"renditions": json.dumps(RENDITIONS[:2]), "steps": json.dumps(steps)}
+    )
+    assert response.status_code == 200
+    message = email.message_from_bytes(
+        b"Content-Type: " + response.headers["content-type"].encode() + b"\r\n\r\n" + response.content
+    )
+    parts = {part.get_filename(): part for part in message.get_payload()}
+    assert sorted(parts) == ["thumb.webp", "zoom.jpg"]
+    assert parts["thumb.webp"].get_content_type() == "image/webp"
+    assert Image.open(io.BytesIO(parts["thumb.webp"].get_payload(decode=True))).size == (100, 75)
+
+def test_renditions_endpoint_rejects_bad_requests(client):
+    upload = {"image": ("photo.png", photo((64, 48)), "image/png")}
+    duplicate = [{"name": "a", "width": 10}, {"name": "a", "width": 20}]
+    bad_format = [{"name": "a", "width": 10, "format": "gif"}]
+    for renditions in (duplicate, bad_format, [], [{"name": "../a", "width": 10}]):
+        response = client.post("/api/renditions", files=upload, data={"renditions": json.dumps(renditions)})
+        assert response.status_code == 400
@@ -0,0 +1,19 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+def test_app_imports_without_gcp_or_heavy_dependencies():
+    # A clean environment: no Google Cloud settings, no users
+    env = {key: value for key, value in os.environ.items()
+           if not key.startswith(("GOOGLE_", "PROJECT_ID", "DATASET_ID", "TABLE_ID", "USER_"))}
+    script = (
+        "import sys, json; import app.main; "
+        "print(json.dumps([m for m in ('rembg', 'onnxruntime', 'cv2', 'google.cloud.bigquery', 'skimage') "
+        "if m in sys.modules]))"
+    )
+    completed = subprocess.run([sys.executable, "-c", script], cwd=Path(__file__).parent.parent,
+                               env=env, capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stderr
+    assert json.loads(completed.stdout.strip().splitlines()[-1]) == []
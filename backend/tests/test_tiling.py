@@ -0,0 +1,32 @@
+import numpy as np
+from PIL import Image
+from app.core.config import settings
+from app.services.image_processor.filters import create_filters
+from app.services.image_processor.tiling import run_tiled, should_tile
+
+def noise(mode="RGB", size=(300, 200)):
+    bands = len(mode)
+    pixels = np.random.default_rng(1).integers(0, 256, (size[1], size[0], bands), dtype=np.uint8)
+    return Image.fromarray(pixels, mode)
+
+def test_tiled_filters_match_full_frame():
+    filters = create_filters(["shadows", "sharpness", "white_background"])
+    cases = [
+        ("shadows", noise(), {"value": 0.4}),
+        ("sharpness", noise(), {"value": 1.5}),
+        ("white_background", noise("RGBA"), {}),
+    ]
+    for operation, image, params in cases:
+        filter_instance = filters[operation]
+        expected = filter_instance.run(image, params)
+        # About 20 rows per strip, so every strip boundary is exercised
+        tiled = run_tiled(image, lambda strip: filter_instance.run(strip, params),
+                          filter_instance.tile_overlap, max_bytes=300 * 4 * 4 * 20)
+        assert tiled.mode == expected.mode, operation
+        assert np.array_equal(np.asarray(tiled), np.asarray(expected)), operation
+
+def test_only_large_frames_of_tileable_filters_are_tiled(monkeypatch):
+    monkeypatch.setattr(settings, "TILED_PIXEL_THRESHOLD", 50_000)
+    assert should_tile(noise(), 0)
+    assert not should_tile(noise(size=(100, 100)), 0)
+    assert not should_tile(noise(), None)
@@ -0,0 +1,39 @@
+import cv2
+import numpy as np
+from PIL import Image
+from app.services.image_processor.tone import apply_curve
+
+def random_image(mode="RGB", seed=0):
+    rng = np.random.default_rng(seed)
+    channels = 4 if mode == "RGBA" else 3
+    return Image.fromarray(rng.integers(0, 256, (64, 96, channels), dtype=np.uint8), mode)
+
+def hsv_highlights(image, value):
+    hsv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2HSV)
+    h, s, v = cv2.split(hsv)
+    mask = v > 127
+    v[mask] = np.clip(v[mask] * (1 + value), 0, 255)
+    return cv2.cvtColor(cv2.merge([h, s, v]), cv2.COLOR_HSV2RGB)
+
+def test_exposure_curve_matches_convert_scale_abs():
+    image = random_image()
+    for value in (-0.7, 0.1, 0.5):
+        expected = cv2.convertScaleAbs(np.array(image), alpha=1 + value, beta=0)
+        assert np.array_equal(np.asarray(apply_curve(image, [("exposure", value)])), expected)
+
+def test_highlights_curve_within_documented_tolerance():
+    image = random_image()
+    result = np.asarray(apply_curve(image, [("highlights", 0.4)])).astype(int)
+    diff = np.abs(result - hsv_highlights(image, 0.4).astype(int))
+    assert diff.max() <= 8
+    assert diff.mean() < 1
+
+def test_fused_chain_matches_sequential_steps_and_keeps_alpha():
+    image = random_image("RGBA")
+    steps = [("exposure", 0.2), ("highlights", -0.3), ("shadows", 0.4)]
+    sequential = image
+    for step in steps:
+        sequential = apply_curve(sequential, [step])
+    fused = apply_curve(image, steps)
+    assert np.array_equal(np.asarray(fused), np.asarray(sequential))
+    assert np.array_equal(np.asarray(fused)[..., 3], np.asarray(image)[..., 3])